@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+"""Measure the throughput of the serialization and signing routines.
+
+Runs entirely offline. Every benchmark reports the operations per
+second (best of several rounds) and the memory an operation leaves
+allocated, averaged over many calls. Results can be written as JSON,
+and compared against a stored baseline::
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+
+When comparing, the script exits with a non-zero status if any
+benchmark allocates more than the baseline allows for. Being slower is
+only a warning, unless ``--strict`` is given: ops/sec depend on the
+machine and how busy it is. They are compared relative to a calibration
+loop that runs with every benchmark, so a baseline recorded on a
+machine twice as fast only expects half the ops/sec here. Use
+``--save-baseline`` to update the stored numbers after a change that
+is expected to move them.
+"""
+
+from __future__ import print_function
+import argparse
+import copy
+import fnmatch
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+# Python 2 has no perf_counter()
+timer = getattr(time, 'perf_counter', time.time)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from ripple import (
+    Transaction, TransactionSubscriptionMessage, PaymentTransaction)
+from ripple.serialize import (
+    serialize_object, RippleBaseDecoder, parse_non_native_amount)
+from ripple.sign import (
+    sign_transaction, root_key_from_seed, parse_seed, Signer,
+    verify_transaction, verify_claim)
+
+
+BENCHMARKS = []
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+CORPUS_DIR = os.path.join(ROOT, 'tests', 'transactions')
+
+SECRET = 'ssq55ueDob4yV3kPVnNQLHB6icwpC'
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function does the setup, and returns a callable
+    which runs a single operation.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+def open_transaction(name):
+    """Load a transaction from the test corpus; see the function of the
+    same name in ``tests/test_transaction_parsing.py``.
+    """
+    with open(os.path.join(CORPUS_DIR, name)) as f:
+        lines = f.readlines()
+    for idx, line in enumerate(lines):
+        if line.startswith('---'):
+            break
+    return json.loads(''.join(lines[idx+1:]))
+
+
+def load_corpus():
+    return [open_transaction(name)
+            for name in sorted(os.listdir(CORPUS_DIR))
+            if name.endswith('.json')]
+
+
+def strip_meta(data):
+    """Return only the transaction fields of a corpus entry."""
+    if 'transaction' in data:
+        data = data['transaction']
+    return {k: v for k, v in data.items() if k[0].isupper() and k != 'metaData'}
+
+
+PAYMENT = {
+    "TransactionType": "Payment",
+    "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+    "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+    "Amount": "200000000",
+    "Fee": "10",
+    "Flags": 2147483648,
+    "Sequence": 1,
+    "SigningPubKey": "0330E7FC9D56BB25D6893BA3F317AE5BCF33B3291BD63DB32654A313222F7FD020",
+}
+
+OFFER_CREATE = {
+    "TransactionType": "OfferCreate",
+    "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+    "Fee": "12",
+    "Flags": 0,
+    "Sequence": 53,
+    "LastLedgerSequence": 7108629,
+    "OfferSequence": 52,
+    "TakerGets": "6000000",
+    "TakerPays": {"currency": "USD", "value": "0.0324",
+                  "issuer": "rvYAfWj5gh67oV6fW32ZzP3Aw4Eubs59B"},
+    "SigningPubKey": "0330E7FC9D56BB25D6893BA3F317AE5BCF33B3291BD63DB32654A313222F7FD020",
+}
+
+
+@benchmark('serialize_object.payment')
+def bench_serialize_payment():
+    return lambda: serialize_object(PAYMENT)
+
+
+@benchmark('serialize_object.offer_create')
+def bench_serialize_offer_create():
+    return lambda: serialize_object(OFFER_CREATE)
+
+
+@benchmark('serialize_object.paths')
+def bench_serialize_paths():
+    tx = strip_meta(open_transaction('payment_with_intermediary_traders.json'))
+    return lambda: serialize_object(tx)
+
+
+@benchmark('base58.encode')
+def bench_base58_encode():
+    account_id = RippleBaseDecoder.decode('r3P9vH81KBayazSTrQj6S25jW6kDb779Gi', 25)
+    return lambda: RippleBaseDecoder.encode(account_id)
+
+
+@benchmark('base58.decode')
+def bench_base58_decode():
+    return lambda: RippleBaseDecoder.decode('r3P9vH81KBayazSTrQj6S25jW6kDb779Gi', 25)
+
+
+@benchmark('parse_non_native_amount')
+def bench_parse_amount():
+    return lambda: parse_non_native_amount('-1234.56789012345')
+
+
+@benchmark('root_key_from_seed')
+def bench_root_key_from_seed():
+    seed = parse_seed(SECRET)
+    return lambda: root_key_from_seed(seed)
+
+
+@benchmark('sign_transaction')
+def bench_sign_transaction():
+    return lambda: sign_transaction(dict(PAYMENT), SECRET)
+
+
+@benchmark('signer.sign')
+def bench_signer_sign():
+    signer = Signer(SECRET)
+    return lambda: signer.sign(dict(PAYMENT))
+
+
+@benchmark('signer.sign.ed25519')
+def bench_signer_sign_ed25519():
+    signer = Signer('sEdSKaCy2JT7JaM7v95H9SxkhP9wS2r')
+    return lambda: signer.sign(dict(PAYMENT))
+
+
+@benchmark('verify_transaction')
+def bench_verify_transaction():
+    tx = Signer(SECRET).sign(dict(PAYMENT))
+    return lambda: verify_transaction(tx)
+
+
+CHANNEL = '5DB01B7FFED6B67E6B0414DED11E051D2EE2B7619CE0EAA6286D67A3A4D5BDB3'
+
+
+@benchmark('claim.sign')
+def bench_claim_sign():
+    signer = Signer(SECRET)
+    return lambda: signer.sign_claim(CHANNEL, 1000000)
+
+
+@benchmark('claim.verify')
+def bench_claim_verify():
+    signer = Signer(SECRET)
+    signature = signer.sign_claim(CHANNEL, 1000000)
+    return lambda: verify_claim(CHANNEL, 1000000, signature, signer.public_key_hex)
+
+
+@benchmark('transaction.metadata')
+def bench_transaction_metadata():
+    def parse(corpus):
+        for data in corpus:
+            if 'transaction' in data:
+                tx = TransactionSubscriptionMessage(data).transaction
+            else:
+                tx = Transaction(data)
+            tx.successful
+            if isinstance(tx, PaymentTransaction):
+                tx.amounts_received
+                tx.recipient_balances
+
+    # Skip what the parser does not support yet (see the xfail tests).
+    corpus = []
+    for data in load_corpus():
+        try:
+            parse(copy.deepcopy([data]))
+        except (AttributeError, AssertionError, KeyError):
+            continue
+        corpus.append(data)
+
+    return lambda: parse(copy.deepcopy(corpus))
+
+
+def calibration():
+    """Plain interpreter work (integer arithmetic, a dict) that does not
+    change with our code; other results are compared relative to it.
+    """
+    def op():
+        d = {}
+        x = 1
+        for i in range(200):
+            x = x * 3 % 1000003
+            d[i] = x
+        return d
+    return op
+
+
+# How many calls the allocations are averaged over, at most; running
+# under tracemalloc is slow.
+ALLOC_CALLS = 1000
+
+# Allocations below this many bytes per op are noise, not a regression.
+ALLOC_SLACK = 16
+
+
+def measure(op, min_time=0.2, rounds=5):
+    """Return ops/sec (the best of ``rounds``) and the net number of
+    bytes allocated per call of ``op``, averaged over many calls.
+    """
+    op()  # warm up caches
+
+    # Find a loop count that takes at least ``min_time``.
+    number = 1
+    while True:
+        start = timer()
+        for _ in range(number):
+            op()
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    best = elapsed
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds - 1):
+            start = timer()
+            for _ in range(number):
+                op()
+            elapsed = timer() - start
+            best = min(best, elapsed)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    alloc = None
+    if tracemalloc is not None:
+        calls = min(number, ALLOC_CALLS)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            # Whatever the first call under tracemalloc sets up once
+            # is not what we are after.
+            op()
+            gc.collect()
+            before = tracemalloc.get_traced_memory()[0]
+            for _ in range(calls):
+                op()
+            gc.collect()
+            alloc = float(tracemalloc.get_traced_memory()[0] - before) / calls
+        finally:
+            tracemalloc.stop()
+
+    return number / best, alloc
+
+
+def run(pattern='*', min_time=0.2, rounds=5):
+    """Return the ops/sec of the calibration loop, and the results."""
+    results = {}
+    for name, setup in BENCHMARKS:
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        ops, alloc = measure(setup(), min_time=min_time, rounds=rounds)
+        results[name] = {
+            'ops_per_sec': round(ops, 1),
+            'alloc_bytes': None if alloc is None else round(alloc, 1)}
+    ops, _ = measure(calibration(), min_time=min_time, rounds=rounds)
+    return round(ops, 1), results
+
+
+def compare(results, baseline, threshold, speed=None):
+    """Compare against the baseline; return two lists of regressions,
+    in speed and in allocations.
+
+    ``speed`` is how fast this machine is compared to the one the
+    baseline was recorded on (see :func:`calibration`); without it,
+    ops/sec are not compared.
+    """
+    slower = []
+    allocations = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        expected = base['ops_per_sec'] * speed if speed else None
+        if expected and result['ops_per_sec'] < expected * (1 - threshold):
+            slower.append('%s: %.1f ops/sec, expected %.1f' % (
+                name, result['ops_per_sec'], expected))
+        if result['alloc_bytes'] is not None and base.get('alloc_bytes') is not None \
+                and result['alloc_bytes'] > base['alloc_bytes'] * (1 + threshold) + ALLOC_SLACK:
+            allocations.append('%s: %.1f bytes allocated, baseline %.1f' % (
+                name, result['alloc_bytes'], base['alloc_bytes']))
+    return slower, allocations
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(argv[0])
+    parser.add_argument('-k', dest='pattern', default='*',
+                        help='only run benchmarks matching this glob')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='compare against this baseline file')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown, as a fraction (default: 0.25)')
+    parser.add_argument('--strict', action='store_true',
+                        help='fail if slower than the baseline, not just warn')
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args(argv[1:])
+
+    calibration_ops, results = run(
+        args.pattern, min_time=args.min_time, rounds=args.rounds)
+
+    for name, result in sorted(results.items()):
+        print('%-32s %12.1f ops/sec %10s bytes/op' % (
+            name, result['ops_per_sec'],
+            '-' if result['alloc_bytes'] is None else result['alloc_bytes']))
+    print('%-32s %12.1f ops/sec' % ('(calibration)', calibration_ops))
+
+    report = {
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'calibration': calibration_ops,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        speed = None
+        if baseline.get('calibration'):
+            speed = calibration_ops / baseline['calibration']
+            print('\nThis machine runs at %.2fx the speed of the baseline\'s' % speed)
+        else:
+            print('\nThe baseline has no calibration; not comparing ops/sec')
+        slower, allocations = compare(
+            results, baseline['results'], args.threshold, speed)
+        if slower:
+            print('\nSlower than %s:' % args.baseline)
+            for line in slower:
+                print('    %s' % line)
+        if allocations:
+            print('\nAllocating more than %s:' % args.baseline)
+            for line in allocations:
+                print('    %s' % line)
+        if allocations or (slower and args.strict):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
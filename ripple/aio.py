@@ -0,0 +1,440 @@
+"""asyncio versions of :class:`ripple.client.Client` and
+:class:`ripple.client.Remote`.
+
+Instead of a thread per connection, all reading happens in a task on
+the event loop, so any number of connections and requests in flight
+can share a single thread::
+
+    async with AsyncClient('wss://s1.ripple.com') as client:
+        info = await client.request_account_info(account)
+
+        result, subscription = await client.subscribe(['ledger'])
+        async for msg in subscription:
+            ...
+
+The messages are dispatched exactly like in the threaded client.
+Requires Python 3.7, and the ``websockets`` package (which is not
+installed with this library; the ``asyncio`` extra pulls it in).
+"""
+
+import asyncio
+import json
+import logging
+from .client import (
+    BaseClient, BaseRemote, DeferredResponse, DeferredTransaction,
+    RippleError, transaction_hash)
+from .serialize import serialize_object
+
+
+__all__ = ('AsyncClient', 'AsyncRemote')
+
+
+log = logging.getLogger('ripple.aio')
+log.addHandler(logging.NullHandler())
+
+
+class AsyncDeferredResponse(DeferredResponse):
+    """A :class:`DeferredResponse` that is awaited instead of waited
+    for. Like :class:`AsyncDeferredTransaction`, it can only be created
+    inside the event loop it is used with.
+    """
+
+    def __init__(self):
+        self.future = asyncio.get_running_loop().create_future()
+        self.response = None
+        self.resulter = None
+
+    async def wait(self, timeout=None):
+        await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        return self.get_result()
+
+    def resolve(self, response):
+        self.response = response
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AsyncDeferredTransaction(DeferredTransaction):
+
+    def __init__(self, tx, txhash):
+        self.tx = tx
+        self.hash = txhash
+        self.future = asyncio.get_running_loop().create_future()
+        self.result = self.error = None
+
+    async def wait(self, timeout=None):
+        await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        return self.get_result()
+
+    def resolve(self, result, error=None):
+        self.result = result
+        self.error = error
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def done(self):
+        return self.future.done()
+
+
+class Subscription(object):
+    """The messages of a subscription; iterate over it with
+    ``async for``, or call :meth:`get`.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def put(self, msg):
+        self.queue.put_nowait(msg)
+
+    async def get(self):
+        result = await self.queue.get()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class AsyncClient(BaseClient):
+    """Connection to the Ripple network, for use with asyncio.
+
+    Call (and await) :meth:`connect` before using it, or use it as an
+    ``async with`` block. ``connection`` can be given instead of an
+    ``url``; it needs to have ``send()``, ``recv()`` and ``close()``
+    coroutines, like a connection from the ``websockets`` package.
+    """
+
+    def __init__(self, url=None, connection=None):
+        BaseClient.__init__(self)
+        self.url = url
+        self.conn = connection
+        self._read_task = None
+        self._shutdown = False
+
+    async def connect(self):
+        if self.conn is None:
+            import websockets
+            self.conn = await websockets.connect(self.url, max_size=None)
+        self._read_task = asyncio.ensure_future(self._read_proc())
+        return self
+
+    async def close(self):
+        log.debug('client.close()')
+        self._shutdown = True
+        # Never connected, or connecting failed
+        if self.conn is not None:
+            await self.conn.close()
+        if self._read_task:
+            self._read_task.cancel()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _read_proc(self):
+        """Runs the reading task."""
+        try:
+            while not self._shutdown:
+                msg = await self.conn.recv()
+                if isinstance(msg, bytes):
+                    msg = msg.decode('utf-8')
+                self._dispatch(json.loads(msg))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # As in Client, errors after shutting down are expected.
+            if not self._shutdown:
+                self._fail_all(e)
+                await self.conn.close()
+                log.exception('client.read_proc failed')
+        log.debug('client.read_proc now shut down')
+
+    async def execute(self, cmd, **data):
+        """Send a command to the server, and return the result.
+
+        Raises a ResponseError if the server returns an error.
+        """
+        id, message = self._make_command(cmd, data)
+        # Register before sending; the response may come in at any
+        # point after that.
+        deferred = AsyncDeferredResponse()
+        self._register(id, deferred)
+        try:
+            await self.conn.send(message)
+            return await deferred.wait()
+        finally:
+            self.callbacks.pop(id, None)
+
+    async def subscribe(self, streams=None):
+        """Returns the server's response, and a :class:`Subscription`."""
+        # The messages may start coming in before we get to see the
+        # response, so the subscription needs to be set up already.
+        subscription = Subscription()
+        self._add_subscription(streams, subscription)
+        try:
+            result = await self.execute('subscribe', streams=streams)
+        except:
+            self._remove_subscription(subscription)
+            raise
+        self._process_fee_update(result)
+        return result, subscription
+
+    async def request_account_info(self, account):
+        result = await self.execute("account_info", account=account)
+        return result['account_data']
+
+    async def submit(self, tx_blob=None, tx_json=None, secret=None):
+        """Submit the transaction, see :meth:`Client.submit`."""
+        assert not (tx_blob and tx_json)
+        if isinstance(tx_blob, dict):
+            tx_blob = serialize_object(tx_blob)
+
+        return await self.execute(
+            "submit", tx_blob=tx_blob, tx_json=tx_json, secret=secret)
+
+    async def find_path_once(self, source, destination, destination_amount,
+                             source_currencies=None):
+        """Use the ``ripple_path_find`` API to find a path"""
+        return await self.execute(
+            "ripple_path_find", source_account=source,
+            destination_account=destination,
+            destination_amount=destination_amount,
+            source_currencies=source_currencies
+        )
+
+
+class AsyncRemote(BaseRemote):
+    """The asyncio version of :class:`ripple.client.Remote`: submits
+    transactions, and follows them until they are validated.
+
+    ``client`` can be an :class:`AsyncClient` that is not yet
+    connected; otherwise, one is created for ``url``.
+    """
+
+    def __init__(self, url=None, secret=None, client=None):
+        BaseRemote.__init__(self, secret)
+        self.client = client or AsyncClient(url)
+        self._read_task = None
+        self._sequence_lock = None
+
+    async def connect(self):
+        self._sequence_lock = asyncio.Lock()
+        await self.client.connect()
+        # Start a subscription to transaction updates
+        _, subscription = await self.client.subscribe(
+            streams=['server', 'transactions'])
+        self._read_task = asyncio.ensure_future(self._read_proc(subscription))
+        return self
+
+    async def close(self):
+        log.debug('remote.close()')
+        if self._read_task:
+            self._read_task.cancel()
+        await self.client.close()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _read_proc(self, subscription):
+        try:
+            async for msg in subscription:
+                self._process_message(msg)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self._fail_pending(e)
+            log.exception('remote.read_proc failed')
+        log.debug('remote.read_proc now shut down')
+
+    async def get_sequence_number(self, account):
+        # Without the lock, two concurrent calls might both go to the
+        # server, and then hand out the same number.
+        async with self._sequence_lock:
+            if not account in self._sequence_cache:
+                # Will update the cache
+                await self.account_info(account)
+            current = self._sequence_cache[account]
+            self._sequence_cache[account] += 1
+            return current
+
+    async def account_info(self, account):
+        info = await self.client.request_account_info(account)
+        self._sequence_cache[account] = info['Sequence']
+        return info
+
+    async def submit(self, account, tx_json):
+        """Sign and submit the transaction. Returns an
+        :class:`AsyncDeferredTransaction` that you should await the
+        ``wait()`` of.
+
+        Or, raises an exception immediately if the server refuses it.
+        """
+        if not self.signer:
+            raise RippleError('Need a secret to sign transactions')
+        self.client.add_fee(tx_json)
+        tx_json = self._prepare_transaction(
+            account, tx_json, await self.get_sequence_number(account))
+        return await self.submit_signed(account, tx_json)
+
+    async def submit_signed(self, account, tx_json):
+        """Submit a transaction that is already signed, see
+        :meth:`ripple.client.Remote.submit_signed`.
+        """
+        pending = AsyncDeferredTransaction(tx_json, transaction_hash(tx_json))
+        self._watch(pending)
+        try:
+            result = await self.client.submit(tx_blob=tx_json)
+        except:
+            self._unwatch(pending)
+            raise
+        return self._process_submit_result(account, pending, result)
+
+
+class Test:
+
+    class FakeServer(object):
+        """Plays the server, as the connection of a client.
+
+        ``handlers`` maps commands to functions which return the result
+        (or ``None`` to not respond at all).
+        """
+
+        def __init__(self, handlers):
+            self.handlers = handlers
+            self.messages = asyncio.Queue()
+            self.sent = []
+
+        async def send(self, message):
+            msg = json.loads(message)
+            self.sent.append(msg)
+            handler = self.handlers[msg['command']]
+            result = handler(msg)
+            if result is None:
+                return
+            if isinstance(result, Exception):
+                self.push({'id': msg['id'], 'type': 'response',
+                           'status': 'error', 'error': 'oops',
+                           'error_message': str(result)})
+            else:
+                self.push({'id': msg['id'], 'type': 'response',
+                           'status': 'success', 'result': result})
+
+        def push(self, msg):
+            self.messages.put_nowait(json.dumps(msg).encode('utf-8'))
+
+        async def recv(self):
+            msg = await self.messages.get()
+            if isinstance(msg, Exception):
+                raise msg
+            return msg
+
+        async def close(self):
+            pass
+
+    def run(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_execute(self):
+        from .client import ResponseError
+
+        async def main():
+            server = self.FakeServer({
+                'ping': lambda msg: {'pong': msg['id']},
+                'fail': lambda msg: ValueError('nope'),
+            })
+            async with AsyncClient(connection=server) as client:
+                results = await asyncio.gather(
+                    *[client.execute('ping') for i in range(100)])
+                assert [r['pong'] for r in results] == list(range(1, 101))
+                assert not client.callbacks
+
+                try:
+                    await client.execute('fail')
+                except ResponseError as e:
+                    assert str(e) == 'nope'
+                else:
+                    assert False, 'no error raised'
+
+                # Losing the connection fails all the waiters
+                server.handlers['ping'] = lambda msg: None
+                waiter = asyncio.ensure_future(client.execute('ping'))
+                await asyncio.sleep(0)
+                server.messages.put_nowait(IOError('gone'))
+                try:
+                    await waiter
+                except IOError:
+                    pass
+                else:
+                    assert False, 'no error raised'
+        self.run(main())
+
+    def test_close_unconnected(self):
+        async def main():
+            # As after a failed connect()
+            await AsyncClient('wss://unused').close()
+            await AsyncRemote('wss://unused').close()
+        self.run(main())
+
+    def test_subscribe(self):
+        async def main():
+            server = self.FakeServer({
+                'subscribe': lambda msg: {'load_base': 256, 'load_factor': 512}
+            })
+            async with AsyncClient(connection=server) as client:
+                result, subscription = await client.subscribe(['ledger'])
+                assert client.fee_info['load_factor'] == 512
+                for index in range(3):
+                    server.push({'type': 'ledgerClosed', 'ledger_index': index})
+                received = []
+                async for msg in subscription:
+                    received.append(msg['ledger_index'])
+                    if len(received) == 3:
+                        break
+                assert received == [0, 1, 2]
+        self.run(main())
+
+    def test_remote_submit(self):
+        from .sign import Signer
+        signer = Signer('ssq55ueDob4yV3kPVnNQLHB6icwpC')
+
+        def submit(msg):
+            # Once accepted, the transaction is validated soon after.
+            from .serialize import deserialize_object
+            tx = deserialize_object(msg['tx_blob'])
+            server.push({'type': 'transaction', 'validated': True,
+                         'transaction': {'hash': transaction_hash(tx)},
+                         'engine_result': 'tesSUCCESS'})
+            return {'engine_result': 'tesSUCCESS'}
+
+        server = self.FakeServer({
+            'subscribe': lambda msg: {},
+            'account_info': lambda msg: {'account_data': {'Sequence': 7}},
+            'submit': submit,
+        })
+
+        async def main():
+            client = AsyncClient(connection=server)
+            async with AsyncRemote(secret=signer, client=client) as remote:
+                tx = {"TransactionType": "Payment",
+                      "Account": signer.account,
+                      "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+                      "Amount": "200000000"}
+                pending = await asyncio.gather(
+                    *[remote.submit(signer.account, dict(tx)) for i in range(3)])
+                assert sorted(p.tx['Sequence'] for p in pending) == [7, 8, 9]
+                for p in pending:
+                    result = await p.wait(timeout=5)
+                    assert result['engine_result'] == 'tesSUCCESS'
+                # account_info was only requested once
+                assert [m['command'] for m in server.sent].count('account_info') == 1
+        self.run(main())
@@ -4,23 +4,29 @@ try:
 except ImportError:
     # Python 2
     from Queue import Queue, Empty
+from collections import deque
 from decimal import Decimal
 import json
 import threading
+import time
 import websocket
 import logging
 from ripple import Amount
-from .serialize import serialize_object
-from .sign import hash_transaction, HASH_TX_ID, get_ripple_from_secret, sign_transaction
+from .serialize import serialize_object, SerializedTransaction, LRUCache
+from .sign import hash_transaction, HASH_TX_ID, sign_transaction, Signer
 
 
-__all__ = ('Remote', 'Client', 'RippleError')
+__all__ = ('Remote', 'Client', 'ClientPool', 'RippleError')
 
 
 log = logging.getLogger('ripple.client')
 log.addHandler(logging.NullHandler())
 
 
+# Python 2 has no perf_counter()
+timer = getattr(time, 'perf_counter', time.time)
+
+
 class RippleError(Exception):
     pass
 
@@ -37,6 +43,10 @@ class ResponseError(RippleError):
         return self.response[item]
 
 
+class ResponseTimeout(RippleError):
+    """No response arrived in time."""
+
+
 class TransactionError(ResponseError):
     """Respresents an error in a transaction. A transaction is a
     higher-level object of our own. For example, the ripple server
@@ -78,8 +88,11 @@ def transaction_hash(tx_json):
 
     In particular because we do not have a blob serializer, we'll have to
     use the dict structure to calculate the hash.
+
+    Returned as a string, so it can be compared to the hashes in the
+    messages from the server.
     """
-    return hash_transaction(tx_json, HASH_TX_ID)
+    return hash_transaction(tx_json, HASH_TX_ID).decode('ascii')
 
 
 class DeferredResponse(object):
@@ -92,14 +105,24 @@ class DeferredResponse(object):
     - If resolved with an exception instance, will throw that.
     - Otherwise will resolve the the ripple server response.
     """
-    def __init__(self):
+    def __init__(self, on_resolve=None):
         self.resolved = threading.Event()
+        self.id = None
         self.response = None
         self.resulter = None
+        # Called with this object, from the reading thread.
+        self.on_resolve = on_resolve
 
     def wait(self, timeout=None):
-        self.resolved.wait(timeout)
+        if not self.resolved.wait(timeout):
+            raise ResponseTimeout('No response after %s seconds' % timeout)
+        return self.get_result()
 
+    def done(self):
+        return self.resolved.is_set()
+
+    def get_result(self):
+        """Return the result of the resolved response, or raise."""
         if isinstance(self.response, Exception):
             raise self.response
 
@@ -111,8 +134,14 @@ class DeferredResponse(object):
         return result
 
     def resolve(self, response):
+        if self.resolved.is_set():
+            # The first response counts; after a reconnect, a command
+            # may have been sent twice.
+            return
         self.response = response
         self.resolved.set()
+        if self.on_resolve:
+            self.on_resolve(self)
 
 
 class SubscriptionQueue(Queue):
@@ -125,7 +154,179 @@ class SubscriptionQueue(Queue):
 
 
 
-class Client(object):
+# Which message type the server uses for each stream.
+STREAM_MESSAGE_TYPES = {
+    'ledger': 'ledgerClosed',
+    'transactions': 'transaction',
+    'server': 'serverStatus',
+}
+
+
+class FeeTracker(object):
+    """Keeps track of the server load, to calculate transaction fees."""
+
+    def __init__(self):
+        self.fee_info = FEE_DEFAULTS.copy()
+
+    def add_fee(self, tx, amount=None, cushion='1.2'):
+        """Add a fee to the given transaction dict.
+        """
+        if not amount:
+            # https://ripple.com/wiki/Transaction_Fee#Calculating_the_Transaction_Fee
+            # https://ripple.com/wiki/Calculating_the_Transaction_Fee
+            # Note: The ripple client uses a design where every transaction
+            # may have a different cost in fee units, but then just uses
+            # 10 as a default. We'll ignore it.
+            D = Decimal
+            i = lambda k: D(self.fee_info[k])
+            # One fee unit in XRP
+            one_unit = i('fee_base') / i('fee_ref')
+            # Therefore the cost =
+            fee = one_unit * i('base_fee')
+            # Consider the load
+            fee = fee * (i('load_factor') / i('load_base'))
+            # Add a safety cushion
+            amount = int(fee * D(cushion))
+        tx['Fee'] = amount
+
+    def _process_fee_update(self, msg):
+        """Call this with a message like a server_info response. Will
+        affect fee calculations."""
+        i = self.fee_info
+        # Result to a subscribe command will contain those
+        i['load_base'] = msg.get('load_base', i['load_base'])
+        i['load_factor'] = msg.get('load_factor', i['load_factor'])
+
+        # Note: the ledger stream gives us data for fee_ref and fee_base.
+        # The ripple client uses these to calculate the XRP value of a
+        # fee unit, though the Wiki instructions to calculate fees do not
+        # mention it. We'll ignore it for now.
+
+
+class BaseClient(FeeTracker):
+    """What :class:`Client` and :class:`ripple.aio.AsyncClient` have in
+    common: encoding commands, dispatching the messages from the server
+    and keeping track of the fees.
+
+    ``callbacks`` maps command ids to objects with a ``resolve()``
+    method, ``subscriptions`` maps message types to a list of objects
+    with a ``put()`` method.
+    """
+
+    def __init__(self):
+        FeeTracker.__init__(self)
+
+        # These will be used to sync the reading thread with the threads
+        # that are consuming us. Yes, single dict and lock could be used,
+        # but when setting up a subscription we need to wait for a server
+        # ok but can't miss a message afterwards, so a separate lock
+        # allows us to block incoming subscriptions update while still
+        # setting up the callback queue.
+        self.callbacks = {}
+        self.subscriptions = {}
+        self.callbacks_lock = threading.RLock()
+        self.subscriptions_lock = threading.RLock()
+        # Set once the connection has failed.
+        self._error = None
+
+    def _mkid(self):
+        # Many threads may be sending; two commands with the same id
+        # would leave one of them waiting forever.
+        with self.callbacks_lock:
+            self._id = getattr(self, '_id', 0) + 1
+            return self._id
+
+    def _make_command(self, cmd, data):
+        """Return the id and the encoded message for a command."""
+        data['command'] = cmd
+        data['id'] = self._mkid()
+        data = {k:v for k, v in data.items() if v is not None}
+
+        log.debug('>>>>>>>> sending %s', json.dumps(data, indent=2, cls=RippleEncoder))
+        return data['id'], json.dumps(data, cls=RippleEncoder)
+
+    def _register(self, id, deferred):
+        """Wait for the response to command ``id``. Raises the error the
+        connection failed with, if it did; no response would come.
+        """
+        with self.callbacks_lock:
+            if self._error:
+                raise self._error
+            self.callbacks[id] = deferred
+
+    def _dispatch(self, msg, as_type=None):
+        """Hand a message from the server to whoever is waiting for it.
+
+        ``as_type`` sends a message of our own to the subscriptions for
+        that type of message.
+        """
+        log.debug('<<<<<<<< receiving % s', json.dumps(msg, indent=2))
+
+        type = as_type or msg['type']
+
+        # Response to a regular command
+        if type == 'response':
+            with self.callbacks_lock:
+                deferred = self.callbacks.get(msg['id'])
+                if deferred is None and msg['id'] <= getattr(self, '_id', 0):
+                    # We stopped waiting for this one.
+                    log.debug('discarding response to %s', msg['id'])
+                    return
+            if deferred is not None:
+                # Not while holding the lock: ``on_resolve`` callbacks
+                # may need other locks, which are taken in the opposite
+                # order elsewhere.
+                deferred.resolve(msg)
+                return
+
+        # Else this will be a subscription response
+        with self.subscriptions_lock:
+            if type in self.subscriptions:
+                # Multiple subscriptions may have been issued for
+                # the same type, notify all of them.
+                for queue in self.subscriptions[type]:
+                    queue.put(msg)
+                return
+
+        raise ValueError(
+            'unexpected message from server: %s' % str(msg))
+
+    def _fail_all(self, error):
+        """Notify all callbacks and subscriptions so that exceptions
+        occur in all waiters.
+        """
+        with self.callbacks_lock:
+            self._error = error
+            waiting = list(self.callbacks.values())
+        for deferred in waiting:
+            deferred.resolve(error)
+        with self.subscriptions_lock:
+            # A queue subscribed to several streams is in several lists,
+            # but should see the error only once.
+            queues = []
+            for queue in sum(self.subscriptions.values(), []):
+                if not any(queue is q for q in queues):
+                    queues.append(queue)
+            for queue in queues:
+                queue.put(error)
+
+    def _add_subscription(self, streams, queue):
+        for stream in streams:
+            if not stream in STREAM_MESSAGE_TYPES:
+                raise ValueError(stream)
+        with self.subscriptions_lock:
+            for stream in streams:
+                self.subscriptions.setdefault(
+                    STREAM_MESSAGE_TYPES[stream], []).append(queue)
+
+    def _remove_subscription(self, queue):
+        with self.subscriptions_lock:
+            for queues in self.subscriptions.values():
+                if queue in queues:
+                    queues.remove(queue)
+
+
+class Client(BaseClient):
     """Connection to Ripple network.
 
     This is supposed to be more of a low-level API, representing
@@ -190,159 +391,283 @@ class Client(object):
     # TODO: Better handle keyboard interrupts while waiting:
     #    http://stackoverflow.com/a/14421297/15677
 
-    def __init__(self, url):
-        self.fee_info = FEE_DEFAULTS.copy()
-
-        # These will be used to sync the reading thread with the threads
-        # that are consuming us. Yes, single dict and lock could be used,
-        # but when setting up a subscription we need to wait for a server
-        # ok but can't miss a message afterwards, so a separate lock
-        # allows us to block incoming subscriptions update while still
-        # setting up the callback queue.
-        self.callbacks = {}
-        self.subscriptions = {}
-        self.callbacks_lock = threading.RLock()
-        self.subscriptions_lock = threading.RLock()
+    # With ``reconnect``, how long to wait before connecting again (in
+    # seconds); doubles with every failed attempt, up to the maximum.
+    RECONNECT_MIN_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 30
+
+    def __init__(self, url, connection=None, reconnect=False, connect=None):
+        """If ``reconnect`` is set, a lost connection is established
+        again, rather than failing everything that is waiting on it:
+
+        - Commands that only read something (see
+          ``IDEMPOTENT_COMMANDS``) and are still waiting for a response
+          are sent again; others fail, since we cannot know whether the
+          server got to them.
+        - Subscriptions are made again, and continue on the same queue.
+          A ``ledger`` subscription gets a message of type
+          ``ledgerGap`` with the index of the last ledger we saw
+          (``last_ledger_index``) and the one the server is at now
+          (``ledger_index``), so you can fetch what you missed.
+
+        ``connect`` can be given to open a connection other than with
+        a plain ``websocket.create_connection``; ``connection`` to use
+        an open one (for testing).
+        """
+        BaseClient.__init__(self)
+        self.url = url
+        self.reconnect = reconnect
+        self._connect = connect or (
+            lambda: websocket.create_connection(url, timeout=30))
+
+        # For reconnecting, we need to know what to send again.
+        self._sent = {}         # id -> (cmd, message)
+        self._streams = []
+        self._last_ledger = None
+        self._shutdown = False
+        self._shutdown_event = threading.Event()
+        self.conn_lock = threading.RLock()
 
         # TODO: We need to deal with timeouts (a ping thread?)
-        self.conn = websocket.create_connection(url, timeout=30)
+        self.conn = connection or self._connect()
+        self.connected = True
         # This thread will do the reading in the basis for in turn
         # supporting multiple threads to use *this* class.
         self._read_thread = thread = threading.Thread(target=self._read_proc)
-        thread.setDaemon(True)
+        thread.daemon = True
         thread.start()
 
     def close(self):
         log.debug('client.close()')
-        self._shutdown = True
+        # Under the lock, so that a connection made by _reconnect()
+        # at the same time is either closed here, or not kept there.
+        with self.conn_lock:
+            self._shutdown = True
+            self._shutdown_event.set()
         self.conn.close()
 
-    def _mkid(self):
-        setattr(self, '_id', getattr(self, '_id', 0) + 1)
-        return self._id
-
     def _read_proc(self):
         """Runs the reading thread."""
-        try:
-            while not getattr(self, '_shutdown', False):
-                msg = json.loads(self.conn.recv().decode('utf-8'))
-                log.debug('<<<<<<<< receiving % s', json.dumps(msg, indent=2))
-
-                type = msg['type']
-
-                # Response to a regular command
-                if type == 'response':
-                    with self.callbacks_lock:
-                        if msg['id'] in self.callbacks:
-                            self.callbacks[msg['id']].resolve(msg)
-                            continue
-
-                # Else this will be a subscription response
-                with self.subscriptions_lock:
-                    if type in self.subscriptions:
-                        # Multiple subscriptions may have been issued for
-                        # the same type, notify all of them.
-                        for queue in self.subscriptions[type]:
-                            queue.put(msg)
+        while True:
+            try:
+                while not self._shutdown:
+                    self._dispatch(json.loads(self.conn.recv().decode('utf-8')))
+            except Exception as e:
+                # If we have already shutdown, ignore the error. This is
+                # because by shutting down the socket during a recv(), a
+                # variety of socket-related / SSL errors are to be expected.
+                if self._shutdown:
+                    break
+                if self.reconnect:
+                    log.warning('client: connection lost (%s), reconnecting', e)
+                    if self._reconnect(e):
                         continue
-
-                raise ValueError(
-                    'unexpected message from server: %s' % str(msg))
-        except Exception as e:
-            # If we have already shutdown, ignore the error. This is
-            # because by shutting down the socket during a recv(), a
-            # variety of socket-related / SSL errors are to be expected.
-            if not getattr(self, '_shutdown', False):
-                # Notify all callbacks so that exceptions occur
-                # in all waiters.
-                with self.callbacks_lock:
-                    for deferred in self.callbacks.values():
-                        deferred.resolve(e)
-                with self.subscriptions_lock:
-                    for queues in self.subscriptions.values():
-                        for queue in queues:
-                            queue.put(e)
+                    # Closed in the meantime; what was kept back to be
+                    # sent again would otherwise wait forever.
+                    self._fail_all(e)
+                    break
+                self.connected = False
+                self._fail_all(e)
                 # Also shut down the connection so that the main thread
                 # doesn't keep sending while not getting a response.
                 self.conn.close()
                 # Finally, re-raise the exception in the thread
                 raise
+            break
         log.debug('client.read_proc now shut down')
 
+    def _reconnect(self, error):
+        """Connect again, with exponential backoff, then send again what
+        needs to be. Returns ``False`` if we were closed in the meantime.
+        """
+        self.connected = False
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+        delay = self.RECONNECT_MIN_DELAY
+        while True:
+            if self._shutdown_event.wait(delay):
+                return False
+            delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+            try:
+                conn = self._connect()
+                with self.conn_lock:
+                    if self._shutdown:
+                        conn.close()
+                        return False
+                    self.conn = conn
+                    self._resend(error)
+            except Exception as e:
+                log.warning('client: reconnecting failed: %s', e)
+                continue
+            log.info('client: reconnected')
+            self.connected = True
+            return True
+
+    def _resend(self, error):
+        with self.callbacks_lock:
+            waiting = sorted(self.callbacks.items())
+        for id, deferred in waiting:
+            if deferred.done():
+                continue
+            cmd, message = self._sent.get(id, (None, None))
+            if cmd in IDEMPOTENT_COMMANDS:
+                self.conn.send(message.encode('utf-8'))
+            else:
+                deferred.resolve(error)
+
+        if self._streams:
+            last_ledger = self._last_ledger
+            self.send('subscribe', {'streams': list(self._streams)},
+                      on_resolve=lambda d: self._resubscribed(d, last_ledger))
+
+    def _resubscribed(self, deferred, last_ledger):
+        self.discard(deferred.id)
+        try:
+            result = deferred.get_result()
+        except Exception as e:
+            # There is not much we can do from the reading thread.
+            log.error('client: subscribing again failed: %s', e)
+            result = {}
+        self._process_fee_update(result)
+        if 'ledger' in self._streams:
+            self._dispatch({'type': 'ledgerGap',
+                            'last_ledger_index': last_ledger,
+                            'ledger_index': result.get('ledger_index')},
+                           as_type='ledgerClosed')
+
+    def _dispatch(self, msg, as_type=None):
+        if msg.get('type') == 'ledgerClosed':
+            self._last_ledger = msg['ledger_index']
+        BaseClient._dispatch(self, msg, as_type)
+
     def execute(self, cmd, **data):
         """Send a commad to the server, wait for the result. Sync!
 
         Possible outcomes are from DeferredResponse.wait(): A ripple
         server response or an ResponseError exception.
         """
-        # Prepare the command to send
-        data['command'] = cmd
-        data['id'] = self._mkid()
-        data = {k:v for k, v in data.items() if v is not None}
+        id, deferred = self.send(cmd, data)
+        try:
+            return deferred.wait()
+        finally:
+            self.discard(id)
 
-        log.debug('>>>>>>>> sending %s', json.dumps(data, indent=2, cls=RippleEncoder))
-        self.conn.send(json.dumps(data, cls=RippleEncoder).encode('utf-8'))
+    def send(self, cmd, data, on_resolve=None):
+        """Send a command without waiting for the response. Returns the
+        id of the command, and a :class:`DeferredResponse`.
+
+        Call :meth:`discard` with the id when you are done with it.
+        """
+        # The callback needs to be in place before the response can
+        # possibly arrive.
+        id, message = self._make_command(cmd, dict(data))
+        deferred = DeferredResponse(on_resolve=on_resolve)
+        deferred.id = id
+        self._register(id, deferred)
+        if self.reconnect:
+            self._sent[id] = (cmd, message)
+        try:
+            with self.conn_lock:
+                self.conn.send(message.encode('utf-8'))
+        except:
+            if self.reconnect and cmd in IDEMPOTENT_COMMANDS:
+                # It will go out again once we are reconnected.
+                log.debug('client: %s will be sent after reconnecting', id)
+                return id, deferred
+            self.discard(id)
+            raise
+        return id, deferred
+
+    def discard(self, id):
+        """Stop waiting for the response to command ``id``; if it still
+        comes, it is ignored.
+        """
         with self.callbacks_lock:
-            self.callbacks[data['id']] = DeferredResponse()
-        msg = self.callbacks[data['id']].wait()
-        return msg
+            self.callbacks.pop(id, None)
+            self._sent.pop(id, None)
+
+    def execute_many(self, commands, max_in_flight=100, ordered=True):
+        """Send many commands without waiting for each response in turn.
+
+        ``commands`` is an iterable of ``(cmd, data)`` tuples, with
+        ``data`` a dict of the arguments. Up to ``max_in_flight`` of
+        them are sent before waiting for a response, so a batch costs
+        a few round trips instead of one per command.
+
+        Yields the results in the order of ``commands``, or, with
+        ``ordered=False``, ``(index, result)`` tuples as the responses
+        come in. A command that fails gives a ResponseError *instance*
+        in place of its result, so the rest of the batch is not lost;
+        if the connection fails, that is raised.
+        """
+        commands = enumerate(commands)
+        done = Queue()
+        in_flight = {}   # index -> (id, DeferredResponse)
+        buffered = {}    # results kept back to yield them in order
+        next_index = 0
+        exhausted = False
 
-    def subscribe(self, streams=None):
-        def add_queue(name, queue):
-            queues = self.subscriptions.setdefault(name, [])
-            queues.append(queue)
+        try:
+            while True:
+                # The buffered results count towards the limit, so it
+                # also bounds the memory used when ``ordered``.
+                while not exhausted and len(in_flight) + len(buffered) < max_in_flight:
+                    try:
+                        index, (cmd, data) = next(commands)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    in_flight[index] = self.send(
+                        cmd, data, on_resolve=lambda d, index=index: done.put(index))
+
+                if not in_flight:
+                    break
+
+                index = done.get()
+                id, deferred = in_flight.pop(index)
+                self.discard(id)
+                try:
+                    result = deferred.get_result()
+                except ResponseError as e:
+                    result = e
 
+                if not ordered:
+                    yield index, result
+                    continue
+                buffered[index] = result
+                while next_index in buffered:
+                    yield buffered.pop(next_index)
+                    next_index += 1
+        finally:
+            # If the caller gives up early, we are no longer interested.
+            for id, deferred in in_flight.values():
+                self.discard(id)
+
+    def subscribe(self, streams=None, queue=None):
+        """Returns the server's response, and a queue with the messages.
+
+        ``queue`` lets you pass the queue to use; anything with a
+        ``put()`` method will do.
+        """
         with self.subscriptions_lock:
             result = self.execute('subscribe', streams=streams)
             self._process_fee_update(result)
             # Setup a queue for subscription messages
-            queue = SubscriptionQueue()
-            for stream in streams:
-                if 'ledger' == stream:
-                    add_queue('ledgerClosed', queue)
-                elif 'transactions' == stream:
-                    add_queue('transaction', queue)
-                elif 'server' == stream:
-                    add_queue('serverStatus', queue)
-                else:
-                    raise ValueError(stream)
+            if queue is None:
+                queue = SubscriptionQueue()
+            self._add_subscription(streams, queue)
+            # Remember what to subscribe to again after a reconnect
+            for stream in streams or ():
+                if stream not in self._streams:
+                    self._streams.append(stream)
+            if 'ledger' in (streams or ()) and 'ledger_index' in result:
+                self._last_ledger = result['ledger_index']
 
         return result, queue
 
-    def add_fee(self, tx, amount=None, cushion='1.2'):
-        """Add a fee to the given transaction dict.
-        """
-        if not amount:
-            # https://ripple.com/wiki/Transaction_Fee#Calculating_the_Transaction_Fee
-            # https://ripple.com/wiki/Calculating_the_Transaction_Fee
-            # Note: The ripple client uses a design where every transaction
-            # may have a different cost in fee units, but then just uses
-            # 10 as a default. We'll ignore it.
-            D = Decimal
-            i = lambda k: D(self.fee_info[k])
-            # One fee unit in XRP
-            one_unit = i('fee_base') / i('fee_ref')
-            # Therefore the cost =
-            fee = one_unit * i('base_fee')
-            # Consider the load
-            fee = fee * (i('load_factor') / i('load_base'))
-            # Add a safety cushion
-            amount = int(fee * D(cushion))
-        tx['Fee'] = amount
-
-    def _process_fee_update(self, msg):
-        """Call this with a message like a server_info response. Will
-        affect fee calculations."""
-        i = self.fee_info
-        # Result to a subscribe command will contain those
-        i['load_base'] = msg.get('load_base', i['load_base'])
-        i['load_factor'] = msg.get('load_factor', i['load_factor'])
-
-        # Note: the ledger stream gives us data for fee_ref and fee_base.
-        # The ripple client uses these to calculate the XRP value of a
-        # fee unit, though the Wiki instructions to calculate fees do not
-        # mention it. We'll ignore it for now.
-
     def request_account_info(self, account):
         return self.execute("account_info", account=account)['account_data']
 
@@ -377,6 +702,426 @@ class Client(object):
         raise NotImplementedError()
 
 
+# Errors that say something about the server rather than the request;
+# the request may well work on another one.
+SERVER_ERRORS = ('tooBusy', 'slowDown', 'noNetwork', 'noCurrent', 'noClosed',
+                 'notSynced', 'amendmentBlocked', 'failedToForward')
+
+
+# Commands that only read, and so can safely be sent twice.
+HEDGE_COMMANDS = (
+    'account_info', 'account_lines', 'account_offers', 'account_tx',
+    'book_offers', 'ledger', 'ledger_entry', 'ripple_path_find',
+    'server_info', 'tx')
+
+
+# Commands that can be sent again after reconnecting, without knowing
+# whether the server got them the first time.
+IDEMPOTENT_COMMANDS = HEDGE_COMMANDS + (
+    'fee', 'ping', 'server_state', 'subscribe')
+
+
+def is_server_error(error):
+    """Whether ``error``, raised by :meth:`Client.execute`, means the
+    server could not handle the request (as opposed to a problem with
+    the request itself).
+    """
+    if isinstance(error, ResponseError):
+        return error.response.get('error') in SERVER_ERRORS
+    return True
+
+
+class Endpoint(object):
+    """A connection in a :class:`ClientPool`, and how well it is doing.
+
+    ``rtt`` (in seconds) and ``error_rate`` are exponentially weighted
+    moving averages; ``rtt`` is ``None`` until the first response.
+    They are as of the last request; see :meth:`current`.
+    """
+
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client
+        self.rtt = None
+        self.error_rate = 0.0
+        self.requests = self.errors = 0
+        self.updated = None
+
+    @property
+    def connected(self):
+        return self.client.connected
+
+    def current(self, half_life, now=None):
+        """Return ``(error_rate, rtt)`` as of now.
+
+        While an endpoint gets no requests, nothing new is learned
+        about it, so what we know fades: both halve every ``half_life``
+        seconds. Otherwise, an endpoint that was doing badly would
+        never be tried again, and so never recover.
+        """
+        if self.updated is None or not half_life:
+            return self.error_rate, self.rtt
+        if now is None:
+            now = timer()
+        fade = 0.5 ** (max(now - self.updated, 0) / float(half_life))
+        return (self.error_rate * fade,
+                None if self.rtt is None else self.rtt * fade)
+
+    def record(self, seconds, error, alpha, half_life=None):
+        now = timer()
+        self.error_rate, self.rtt = self.current(half_life, now)
+        self.updated = now
+        self.requests += 1
+        if error:
+            self.errors += 1
+        else:
+            self.rtt = seconds if self.rtt is None else \
+                alpha * seconds + (1 - alpha) * self.rtt
+        self.error_rate = alpha * bool(error) + (1 - alpha) * self.error_rate
+
+    def as_dict(self):
+        return {'url': self.url, 'rtt': self.rtt,
+                'error_rate': self.error_rate, 'requests': self.requests,
+                'errors': self.errors, 'connected': self.connected}
+
+
+class MergedSubscriptionQueue(SubscriptionQueue):
+    """Collects the subscription messages from several connections.
+
+    Every server sends us the same transactions and ledgers; only the
+    first copy of each is kept. An error is only passed on once all of
+    the connections have failed, and a ``ledgerGap`` from a client that
+    reconnected only if the others did not fill the gap.
+    """
+
+    def __init__(self, sources, seen_size=10000):
+        SubscriptionQueue.__init__(self)
+        self.sources = sources
+        self.seen = LRUCache(seen_size)
+        self.failed = 0
+        self.last_ledger = None
+        self.lock = threading.Lock()
+
+    def _key(self, msg):
+        if msg['type'] == 'transaction':
+            return 'tx', msg['transaction']['hash']
+        if msg['type'] == 'ledgerClosed':
+            return 'ledger', msg['ledger_index']
+        # Server status is about the server that sent it.
+        return None
+
+    def put(self, msg, block=True, timeout=None):
+        with self.lock:
+            if isinstance(msg, Exception):
+                self.failed += 1
+                if self.failed < self.sources:
+                    log.warning('pool: a connection failed: %s', msg)
+                    return
+            elif msg['type'] == 'ledgerGap':
+                if self.last_ledger is not None and \
+                        (msg['ledger_index'] or 0) <= self.last_ledger:
+                    return
+                msg = dict(msg, last_ledger_index=self.last_ledger)
+            else:
+                if msg['type'] == 'ledgerClosed':
+                    self.last_ledger = max(
+                        self.last_ledger or 0, msg['ledger_index'])
+                key = self._key(msg)
+                if key is not None:
+                    if key in self.seen:
+                        return
+                    self.seen[key] = True
+        SubscriptionQueue.put(self, msg, block, timeout)
+
+
+class ClientPool(FeeTracker):
+    """Connections to several servers, used as one :class:`Client`.
+
+    ``clients`` are urls, or :class:`Client` instances. For every
+    request, the pool keeps track of how long each server takes to
+    respond and how often it fails (see :class:`Endpoint`):
+
+    - Reads (:meth:`execute`) go to the fastest server that is doing
+      fine, and are tried on the others if it cannot handle them.
+    - Submissions go to the first server (the primary) while it is
+      connected and not overloaded, then to the next one in order.
+    - Subscriptions are made on all the servers; every transaction and
+      ledger comes out of the queue only once.
+
+    ``alpha`` is the weight of a new measurement in the moving averages.
+    A server whose error rate is above ``max_error_rate`` is only used
+    if all others are as bad. As a server that is not used tells us
+    nothing new, its measurements fade by half every ``half_life``
+    seconds, until it gets a request again.
+
+    Reads can also be *hedged*, to cut down on the occasional slow
+    response: if a server has not responded within ``hedge_percentile``
+    of the recent response times for that command, the command is also
+    sent to the next best server, and whichever responds first wins.
+    This is off by default; only ``hedge_commands`` are hedged. See
+    :meth:`hedge_stats` for how often it happens, and helps.
+    """
+
+    # How many response times per command we keep for the percentile,
+    # and how many we need before we start hedging.
+    HEDGE_WINDOW = 200
+    HEDGE_MIN_SAMPLES = 20
+
+    def __init__(self, clients, alpha=0.2, max_error_rate=0.5, half_life=60,
+                 hedge_percentile=None, hedge_commands=HEDGE_COMMANDS):
+        FeeTracker.__init__(self)
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.half_life = half_life
+        self.hedge_percentile = hedge_percentile
+        self.hedge_commands = hedge_commands
+        self.latencies = {}
+        self.hedge_counts = {'requests': 0, 'hedged': 0, 'hedge_wins': 0}
+        self.endpoints = []
+        for client in clients:
+            if isinstance(client, Client):
+                self.endpoints.append(Endpoint(client.url, client))
+            else:
+                self.endpoints.append(Endpoint(client, Client(client)))
+        if not self.endpoints:
+            raise ValueError('Need at least one server')
+        self.lock = threading.Lock()
+
+    def close(self):
+        log.debug('pool.close()')
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+    def ranked(self):
+        """The connected endpoints, best first. Those not measured yet
+        come first, so that every server gets a chance.
+        """
+        now = timer()
+
+        def key(endpoint):
+            error_rate, rtt = endpoint.current(self.half_life, now)
+            return error_rate > self.max_error_rate, rtt or 0
+
+        with self.lock:
+            return sorted([e for e in self.endpoints if e.connected], key=key)
+
+    def stats(self):
+        with self.lock:
+            return [e.as_dict() for e in self.endpoints]
+
+    def hedge_stats(self):
+        """How many requests could have been hedged, how many were, and
+        in how many of those the second server won.
+        """
+        with self.lock:
+            stats = dict(self.hedge_counts)
+        stats['hedge_rate'] = \
+            float(stats['hedged']) / stats['requests'] if stats['requests'] else 0.0
+        stats['win_rate'] = \
+            float(stats['hedge_wins']) / stats['hedged'] if stats['hedged'] else 0.0
+        return stats
+
+    def _observe(self, cmd, seconds):
+        with self.lock:
+            samples = self.latencies.get(cmd)
+            if samples is None:
+                samples = self.latencies[cmd] = deque(maxlen=self.HEDGE_WINDOW)
+            samples.append(seconds)
+
+    def hedge_delay(self, cmd):
+        """How long to wait for a response to ``cmd`` before hedging;
+        ``None`` if there is not enough data yet.
+        """
+        with self.lock:
+            samples = sorted(self.latencies.get(cmd, ()))
+        if len(samples) < self.HEDGE_MIN_SAMPLES:
+            return None
+        index = int(round(self.hedge_percentile / 100.0 * (len(samples) - 1)))
+        return samples[index]
+
+    def _call(self, endpoints, func, *args, **kwargs):
+        """Call ``func(client, ...)`` on the first of ``endpoints`` that
+        can handle it.
+        """
+        error = RippleError('No server is connected')
+        for endpoint in endpoints:
+            start = timer()
+            try:
+                result = func(endpoint.client, *args, **kwargs)
+            except Exception as e:
+                failed = is_server_error(e)
+                with self.lock:
+                    endpoint.record(timer() - start, failed,
+                                    self.alpha, self.half_life)
+                if not failed:
+                    raise
+                log.debug('pool: %s failed on %s', func.__name__, endpoint.url)
+                error = e
+                continue
+            with self.lock:
+                endpoint.record(timer() - start, False,
+                                self.alpha, self.half_life)
+            return result
+        raise error
+
+    def execute(self, cmd, **data):
+        """Run a command on the best server, see :meth:`Client.execute`.
+
+        Meant for reads; if a server fails, the command is tried on the
+        next one. The command may be hedged, see the class docs.
+        """
+        endpoints = self.ranked()
+        if self.hedge_percentile is not None and cmd in self.hedge_commands:
+            with self.lock:
+                self.hedge_counts['requests'] += 1
+            delay = self.hedge_delay(cmd)
+            if delay is not None and len(endpoints) > 1:
+                return self._execute_hedged(endpoints, delay, cmd, data)
+
+        start = timer()
+        result = self._call(endpoints, Client.execute, cmd, **data)
+        self._observe(cmd, timer() - start)
+        return result
+
+    def _execute_hedged(self, endpoints, delay, cmd, data):
+        done = Queue()
+        attempts = []   # (endpoint, id, deferred, start)
+
+        def launch(endpoint):
+            index = len(attempts)
+            start = timer()
+            try:
+                id, deferred = endpoint.client.send(
+                    cmd, data, on_resolve=lambda d: done.put(index))
+            except Exception as e:
+                # Handled like a failure in the response.
+                id, deferred = None, DeferredResponse()
+                deferred.resolve(e)
+                done.put(index)
+            attempts.append((endpoint, id, deferred, start))
+
+        launch(endpoints[0])
+        remaining = list(endpoints[1:])
+        hedged = None   # the attempt that was hedged, by index
+        error = None
+        try:
+            while True:
+                pending = [i for i, a in enumerate(attempts) if not a[2].done()]
+                hedge = hedged is None and len(pending) == 1 and remaining
+                try:
+                    index = done.get(timeout=delay if hedge else None)
+                except Empty:
+                    # Too slow; ask the next server as well.
+                    with self.lock:
+                        self.hedge_counts['hedged'] += 1
+                    hedged = pending[0]
+                    launch(remaining.pop(0))
+                    continue
+
+                endpoint, id, deferred, start = attempts[index]
+                elapsed = timer() - start
+                try:
+                    result = deferred.get_result()
+                except Exception as e:
+                    failed = is_server_error(e)
+                    with self.lock:
+                        endpoint.record(elapsed, failed,
+                                        self.alpha, self.half_life)
+                    if not failed:
+                        raise
+                    error = e
+                    # Wait for the other one; or if there is none, go
+                    # to the next server right away, like _call().
+                    if all(d.done() for _, _, d, _ in attempts):
+                        if not remaining:
+                            break
+                        launch(remaining.pop(0))
+                    continue
+
+                first = attempts[0][2]
+                with self.lock:
+                    endpoint.record(elapsed, False, self.alpha, self.half_life)
+                    if hedged is not None and index > hedged and \
+                            not attempts[hedged][2].done():
+                        self.hedge_counts['hedge_wins'] += 1
+                # What the first attempt took, or would have: the
+                # winner's time would pull the percentile, and with it
+                # the delay, down with every hedge.
+                first_elapsed = timer() - attempts[0][3]
+                if index != 0 and not first.done():
+                    first_elapsed = max(first_elapsed, delay)
+                self._observe(cmd, first_elapsed)
+                return result
+            raise error
+        finally:
+            for endpoint, id, deferred, start in attempts:
+                if id is not None:
+                    endpoint.client.discard(id)
+                if not deferred.done():
+                    # The loser. We don't know how long it would have
+                    # taken, but it is at least this long.
+                    with self.lock:
+                        endpoint.record(timer() - start, False,
+                                        self.alpha, self.half_life)
+
+    def execute_many(self, commands, max_in_flight=100, ordered=True):
+        """See :meth:`Client.execute_many`; all of the commands go to
+        the best server.
+        """
+        endpoints = self.ranked()
+        if not endpoints:
+            raise RippleError('No server is connected')
+        return endpoints[0].client.execute_many(
+            commands, max_in_flight=max_in_flight, ordered=ordered)
+
+    def submit(self, tx_blob=None, tx_json=None, secret=None):
+        """Submit to the primary, or if it fails, the next server."""
+        with self.lock:
+            endpoints = [e for e in self.endpoints if e.connected]
+            # Keep the order, but leave those in trouble for last.
+            now = timer()
+            endpoints.sort(key=lambda e: e.current(self.half_life, now)[0] >
+                           self.max_error_rate)
+        return self._call(endpoints, Client.submit, tx_blob=tx_blob,
+                          tx_json=tx_json, secret=secret)
+
+    def subscribe(self, streams=None, queue=None):
+        """Subscribe on all servers. Returns the response of the first,
+        and a :class:`MergedSubscriptionQueue`.
+        """
+        if queue is None:
+            queue = MergedSubscriptionQueue(len(self.endpoints))
+        results = []
+        for endpoint in self.endpoints:
+            try:
+                result, _ = endpoint.client.subscribe(streams, queue=queue)
+            except Exception as e:
+                if not is_server_error(e):
+                    raise
+                # The queue still needs to know of the failure.
+                queue.put(e)
+                log.warning('pool: subscribe failed on %s: %s', endpoint.url, e)
+                continue
+            results.append(result)
+        if not results:
+            raise RippleError('Subscribing failed on all servers')
+        self._process_fee_update(results[0])
+        return results[0], queue
+
+    def request_account_info(self, account):
+        return self.execute("account_info", account=account)['account_data']
+
+    def find_path_once(self, source, destination, destination_amount,
+                       source_currencies=None):
+        """Use the ``ripple_path_find`` API to find a path"""
+        return self.execute(
+            "ripple_path_find", source_account=source,
+            destination_account=destination,
+            destination_amount=destination_amount,
+            source_currencies=source_currencies
+        )
+
+
 class DeferredTransaction(object):
     """The difference to DeferredResponse is that this one will
     always be resolved with an actual transaction result. However,
@@ -391,7 +1136,12 @@ class DeferredTransaction(object):
         self.result = self.error = None
 
     def wait(self, timeout=None):
-        self.resolved.wait(timeout)
+        if not self.resolved.wait(timeout):
+            raise ResponseTimeout(
+                'Transaction not final after %s seconds' % timeout)
+        return self.get_result()
+
+    def get_result(self):
         if self.error:
             raise TransactionError(self.error, self.result)
         return self.result
@@ -401,33 +1151,173 @@ class DeferredTransaction(object):
         self.error = error
         self.resolved.set()
 
+    def done(self):
+        return self.resolved.is_set()
 
-class Remote(object):
-    """This is supposed to be a more high-level API that ideally
-    will be able to manage multiple server connections, can track
-    the state of submitted transactions etc.
 
-    This is partially async. That is, it blocks while waiting for
-    direct server responses, but is async for transaction handling,
-    where the server cannot be expected to give a final response
-    without significant delay.
+class BaseRemote(object):
+    """What :class:`Remote` and :class:`ripple.aio.AsyncRemote` have in
+    common: the signer, the sequence numbers, and following the
+    transactions we submitted until they are final.
     """
 
-    def __init__(self, url, secret):
+    def __init__(self, secret):
+        # ``secret`` may also be a :class:`Signer`. Either way, the key
+        # is only derived once.
+        if secret and not isinstance(secret, Signer):
+            self.signer = Signer(secret)
+        else:
+            self.signer = secret
         self.secret = secret
         self._sequence_cache = {}
+        # Held while the sequence numbers are fetched, handed out or
+        # given back; PresignedPool reads them from another thread.
+        self._sequence_cache_lock = threading.RLock()
         self._pending_transactions = {}
         self._pending_transactions_lock = threading.RLock()
 
-        # Connect to the client
-        self.client = Client(url)
+    def _process_message(self, msg):
+        """Handle a message from the ``server`` and ``transactions``
+        streams.
+        """
+        if msg['type'] == 'serverStatus':
+            # TODO: Thread: needs to lock!
+            self.client._process_fee_update(msg)
+
+        if msg['type'] == 'transaction':
+            # See if this is a transaction that interests us
+            hash = msg['transaction']['hash']
+            with self._pending_transactions_lock:
+                if hash in self._pending_transactions:
+                    # The JS client, when a transaction comes in,
+                    # doesn't seem to check any field except
+                    # validated, and then just considered the
+                    # transaction a success, which I find a bit
+                    # strange. But do likewise.
+                    if not msg['validated']:
+                        msg = RippleError(
+                            'received non-validated transaction, is '
+                            'this legit? %s' % msg)
+
+                    self._pending_transactions[hash].resolve(msg)
+                    del self._pending_transactions[hash]
+
+    def _fail_pending(self, error):
+        # On error, notify all watches
+        with self._pending_transactions_lock:
+            for transaction in self._pending_transactions.values():
+                transaction.resolve(error)
+
+    def _prepare_transaction(self, account, tx_json, sequence):
+        """Add the sequence number and sign; the fee must be set."""
+        tx_json['Sequence'] = sequence
+
+        # Sign the transaction. Keeping the binary representation
+        # around means it is serialized only once for signing, hashing
+        # and submitting.
+        tx_json = SerializedTransaction(tx_json)
+        sign_transaction(tx_json, self.signer)
+        return tx_json
+
+    def _watch(self, pending):
+        """Start looking out for ``pending`` in the transaction stream.
+
+        This has to happen before it is submitted: the transaction may
+        come in before we get to see the response to the submit.
+        """
+        with self._pending_transactions_lock:
+            self._pending_transactions[pending.hash] = pending
+
+    def _unwatch(self, pending):
+        with self._pending_transactions_lock:
+            self._pending_transactions.pop(pending.hash, None)
+
+    def _process_submit_result(self, account, pending, result):
+        """Resolve ``pending`` based on the server's response to the
+        submit, or keep waiting for the transaction to validate.
+        """
+        with self._pending_transactions_lock:
+            self._pending_transactions.pop(pending.hash, None)
+            if pending.done():
+                # Already seen in the stream
+                return pending
+            return self._process_engine_result(account, pending, result)
+
+    def _process_engine_result(self, account, pending, result):
+        # Let's deal with the result
+        # This is analog to how ripple-client deals with transactions.
+        # Plus, see:
+        #   https://ripple.com/wiki/Transaction_errors
+        #   https://ripple.com/wiki/Robustly_submitting_a_transaction
+        error_code = result['engine_result']
+        error_cat = error_code[:3]
+
+        if error_cat == 'tec':
+            # Fee was claimed, but transaction did not succeed.
+            # Wiki claims this may be a proposed disposition, but JS client
+            # just goes to error and finalizes.
+            pending.resolve(result, error=error_code)
+        elif error_cat == 'tes':
+            # Success - proposed disposition.
+            # JS client will emit an unused proposed event and then will
+            # simply watch the transaction stream to confirm.
+            self._pending_transactions[pending.hash] = pending
+        elif error_cat == 'tef':
+            # 'Failure': JS client will error out the transaction, unless
+            # the message is tefPAST_SEQ: then it will resubmit three
+            # ledgers later with a locally adjusted sequence number to
+            # account for transactions happened in the intermediary.
+            # TODO:  We don't do resubmission for now.
+            pending.resolve(result, error=error_code)
+        elif error_cat == 'ter':
+            # Did not succeed initially, but may still, according to Wiki.
+            # Despite this, the JS client first explicitly fetches a new
+            # sequence number from the server and then resubmits. This
+            # sounds like a potential race condition leading to a double
+            # spend to me.
+            # TODO: Anyway, we don't do resubmission for now.
+            pending.resolve(result, error=error_code)
+        else:
+            # Default - must be tem (malFormed) or tel (local); those are
+            # final failures.
+            # TODO: JS client resubmits on tooBusy one ledger later
+            pending.resolve(result, error=error_code)
+            with self._sequence_cache_lock:
+                self._sequence_cache[account] -= 1
+
+        return pending
+
+
+class Remote(BaseRemote):
+    """This is supposed to be a more high-level API that can manage
+    multiple server connections (pass a list of urls, or a
+    :class:`ClientPool` as ``client`` to configure things like
+    hedging), can track the state of submitted transactions etc.
+
+    This is partially async. That is, it blocks while waiting for
+    direct server responses, but is async for transaction handling,
+    where the server cannot be expected to give a final response
+    without significant delay.
+    """
+
+    def __init__(self, url, secret, client=None):
+        BaseRemote.__init__(self, secret)
+
+        # Connect to the client. With a list of urls, we use them all,
+        # see ClientPool.
+        if client is not None:
+            self.client = client
+        elif isinstance(url, (list, tuple)):
+            self.client = ClientPool(url)
+        else:
+            self.client = Client(url)
         # Start a subscription to transaction updates
         # TODO: Should we only do this once we begin sending payments?
         _, queue = self.client.subscribe(streams=['server', 'transactions'])
 
         # This thread will deal with subscription updates
         self.read_thread = threading.Thread(target=self._read_proc, args=(queue,))
-        self.read_thread.setDaemon(True)
+        self.read_thread.daemon = True
         self.read_thread.start()
 
     def _read_proc(self, queue):
@@ -437,33 +1327,10 @@ class Remote(object):
                     msg = queue.get(timeout=0.2)
                 except Empty:
                     continue
-                if msg['type'] == 'serverStatus':
-                    # TODO: Thread: needs to lock!
-                    self.client._process_fee_update(msg)
-
-                if msg['type'] == 'transaction':
-                    # See if this is a transaction that interests us
-                    hash = msg['transaction']['hash']
-                    with self._pending_transactions_lock:
-                        if hash in self._pending_transactions:
-                            # The JS client, when a transaction comes in,
-                            # doesn't seem to check any field except
-                            # validated, and then just considered the
-                            # transaction a success, which I find a bit
-                            # strange. But do likewise.
-                            if not msg['validated']:
-                                msg = RippleError(
-                                    'received non-validated transaction, is '
-                                    'this legit? %s' % msg)
-
-                            self._pending_transactions[hash].resolve(msg)
-                            del self._pending_transactions[hash]
+                self._process_message(msg)
 
         except Exception as e:
-            # On error, notify all watches
-            with self._pending_transactions_lock:
-                for transaction in self._pending_transactions.values():
-                    transaction.resolve(e)
+            self._fail_pending(e)
             raise
 
         log.debug('remote.read_proc now shut down')
@@ -474,17 +1341,32 @@ class Remote(object):
         self.client.close()
 
     def get_sequence_number(self, account):
-        if not account in self._sequence_cache:
-            # Will update the cache
-            self.account_info(account)
-        current = self._sequence_cache[account]
-        self._sequence_cache[account] += 1
-        return current
+        # Without the lock, two threads finding the cache empty would
+        # both ask the server, and the slower one would reset the cache
+        # to a number the other has already handed out.
+        with self._sequence_cache_lock:
+            if not account in self._sequence_cache:
+                # Will update the cache
+                self.account_info(account)
+            current = self._sequence_cache[account]
+            self._sequence_cache[account] += 1
+            return current
+
+    def peek_sequence_number(self, account):
+        """The sequence number that :meth:`get_sequence_number` will
+        give out next, without using it up.
+        """
+        with self._sequence_cache_lock:
+            if not account in self._sequence_cache:
+                # Will update the cache
+                self.account_info(account)
+            return self._sequence_cache[account]
 
     def account_info(self, account):
-        info = self.client.request_account_info(account)
-        self._sequence_cache[account] = info['Sequence']
-        return info
+        with self._sequence_cache_lock:
+            info = self.client.request_account_info(account)
+            self._sequence_cache[account] = info['Sequence']
+            return info
 
     def send_payment(self, destination, amount, account=None, flags=None,
             destination_tag=None):
@@ -493,11 +1375,11 @@ class Remote(object):
 
         # Determine the sender address
         if not account:
-            if not self.secret:
+            if not self.signer:
                 raise ValueError(
                     'If you do not provide a sender account, you need to '
                     'give a secret so one can be derived.')
-            account = get_ripple_from_secret(self.secret)
+            account = self.signer.account
 
         # If the amount to send does not include an issuer, setting it
         # to the destination address makes ripple pick one.
@@ -540,57 +1422,480 @@ class Remote(object):
         # Add a fee
         self.client.add_fee(tx_json)
 
-        # Add sequence number
-        tx_json['Sequence'] = self.get_sequence_number(account)
+        # Add sequence number, and sign
+        tx_json = self._prepare_transaction(
+            account, tx_json, self.get_sequence_number(account))
 
-        # Sign the transaction
-        sign_transaction(tx_json, self.secret)
+        return self.submit_signed(account, tx_json)
+
+    def submit_signed(self, account, tx_json):
+        """Submit a transaction that is already signed, and has its
+        sequence number from :meth:`get_sequence_number`.
+
+        Returns a DeferredTransaction, like :meth:`submit`.
+        """
         txhash = transaction_hash(tx_json)
 
         # Prepare a deferred result value
         pending = DeferredTransaction(tx_json, txhash)
 
         # Now submit
-        result = self.client.submit(tx_blob=tx_json)
+        self._watch(pending)
+        try:
+            result = self.client.submit(tx_blob=tx_json)
+        except:
+            self._unwatch(pending)
+            raise
+        return self._process_submit_result(account, pending, result)
 
-        # Let's deal with the result
-        # This is analog to how ripple-client deals with transactions.
-        # Plus, see:
-        #   https://ripple.com/wiki/Transaction_errors
-        #   https://ripple.com/wiki/Robustly_submitting_a_transaction
-        error_code = result['engine_result']
-        error_cat = error_code[:3]
 
-        if error_cat == 'tec':
-            # Fee was claimed, but transaction did not succeed.
-            # Wiki claims this may be a proposed disposition, but JS client
-            # just goes to error and finalizes.
-            pending.resolve(result, error=error_code)
-        elif error_cat == 'tes':
-            # Success - proposed disposition.
-            # JS client will emit an unused proposed event and then will
-            # simply watch the transaction stream to confirm.
-            self._pending_transactions[txhash] = pending
-        elif error_cat == 'tef':
-            # 'Failure': JS client will error out the transaction, unless
-            # the message is tefPAST_SEQ: then it will resubmit three
-            # ledgers later with a locally adjusted sequence number to
-            # account for transactions happened in the intermediary.
-            # TODO:  We don't do resubmission for now.
-            pending.resolve(result, error=error_code)
-        elif error_cat == 'ter':
-            # Did not succeed initially, but may still, according to Wiki.
-            # Despite this, the JS client first explicitly fetches a new
-            # sequence number from the server and then resubmits. This
-            # sounds like a potential race condition leading to a double
-            # spend to me.
-            # TODO: Anyway, we don't do resubmission for now.
-            pending.resolve(result, error=error_code)
-        else:
-            # Default - must be tem (malFormed) or tel (local); those are
-            # final failures.
-            # TODO: JS client resubmits on tooBusy one ledger later
-            pending.resolve(result, error=error_code)
-            self._sequence_cache[account] -= 1
+class Test:
 
-        return pending
+    class FakeConnection(object):
+        """Plays the server, in place of a websocket connection.
+
+        ``handlers`` maps commands to functions which return the result,
+        an exception to respond with an error, or ``None`` to not respond
+        at all. With ``hold`` set, responses are held back until that
+        many have come together, then sent in reverse order.
+        """
+
+        def __init__(self, handlers, hold=None):
+            self.handlers = handlers
+            self.hold = hold
+            self.held = []
+            self.messages = Queue()
+            self.sent = []
+
+        def send(self, message):
+            msg = json.loads(message.decode('utf-8'))
+            self.sent.append(msg)
+            result = self.handlers[msg['command']](msg)
+            if result is None:
+                return
+            if isinstance(result, Exception):
+                response = {'id': msg['id'], 'type': 'response',
+                            'status': 'error', 'error': 'oops',
+                            'error_message': str(result)}
+            else:
+                response = {'id': msg['id'], 'type': 'response',
+                            'status': 'success', 'result': result}
+            if not self.hold:
+                self.push(response)
+                return
+            self.held.append(response)
+            if len(self.held) >= self.hold:
+                for response in reversed(self.held):
+                    self.push(response)
+                self.held = []
+
+        def push(self, msg):
+            self.messages.put(json.dumps(msg).encode('utf-8'))
+
+        def recv(self):
+            msg = self.messages.get()
+            if isinstance(msg, Exception):
+                raise msg
+            return msg
+
+        def close(self):
+            self.messages.put(IOError('closed'))
+
+    @staticmethod
+    def account_info(msg):
+        if msg['account'] == 'bad':
+            return ValueError('Account not found.')
+        return {'account_data': {'Account': msg['account']}}
+
+    def test_execute(self):
+        conn = self.FakeConnection({'account_info': self.account_info})
+        client = Client(None, connection=conn)
+        try:
+            assert client.request_account_info('a') == {'Account': 'a'}
+            try:
+                client.execute('account_info', account='bad')
+            except ResponseError as e:
+                assert str(e) == 'Account not found.'
+            else:
+                assert False, 'no error raised'
+            assert not client.callbacks
+
+            try:
+                DeferredResponse().wait(timeout=0.01)
+            except ResponseTimeout:
+                pass
+            else:
+                assert False, 'no timeout'
+        finally:
+            client.close()
+
+    def test_execute_many(self):
+        conn = self.FakeConnection({'account_info': self.account_info}, hold=4)
+        client = Client(None, connection=conn)
+        try:
+            accounts = ['a%d' % i for i in range(10)] + ['bad', 'b']
+            commands = [('account_info', {'account': a}) for a in accounts]
+
+            results = list(client.execute_many(commands, max_in_flight=4))
+            assert len(results) == 12
+            assert [r['account_data']['Account'] for r in results[:10]] == accounts[:10]
+            assert isinstance(results[10], ResponseError)
+            assert results[11]['account_data']['Account'] == 'b'
+            assert not client.callbacks
+            # Never more than four were waiting for a response
+            assert len(conn.sent) == 12
+
+            # As they complete: in reverse within each group of four
+            results = list(client.execute_many(
+                commands[:8], max_in_flight=4, ordered=False))
+            assert [i for i, _ in results] == [3, 2, 1, 0, 7, 6, 5, 4]
+            assert all(r['account_data']['Account'] == accounts[i]
+                       for i, r in results)
+        finally:
+            client.close()
+
+    def test_execute_many_connection_lost(self):
+        conn = self.FakeConnection({
+            'account_info': lambda msg: conn.messages.put(IOError('gone'))})
+        client = Client(None, connection=conn)
+        for attempt in range(2):
+            results = client.execute_many(
+                [('account_info', {'account': 'a'})] * 3)
+            try:
+                next(results)
+            except IOError:
+                pass
+            else:
+                assert False, 'no error raised'
+
+    def test_reconnect(self):
+        ledger = {'index': 5}
+
+        def subscribe(msg):
+            return {'ledger_index': ledger['index'], 'load_base': 256,
+                    'load_factor': 256}
+
+        def connection():
+            return self.FakeConnection({
+                'subscribe': subscribe,
+                # The first server never answers these
+                'account_info': lambda msg: None,
+                'submit': lambda msg: None})
+
+        first, second = connection(), connection()
+        attempts = [first, IOError('refused'), second]
+
+        def connect():
+            conn = attempts.pop(0)
+            if isinstance(conn, Exception):
+                raise conn
+            return conn
+
+        client = Client(None, reconnect=True, connect=connect)
+        client.RECONNECT_MIN_DELAY = 0.01
+        try:
+            result, queue = client.subscribe(['ledger'])
+            assert result['ledger_index'] == 5
+            first.push({'type': 'ledgerClosed', 'ledger_index': 6})
+            assert queue.get(timeout=5)['ledger_index'] == 6
+
+            _, info = client.send('account_info', {'account': 'a'})
+            _, submit = client.send('submit', {'tx_blob': '00'})
+
+            # Lose the connection; the second server is ahead.
+            second.handlers['account_info'] = self.account_info
+            ledger['index'] = 9
+            first.messages.put(IOError('gone'))
+
+            assert info.wait(timeout=5)['account_data'] == {'Account': 'a'}
+            try:
+                submit.wait(timeout=5)
+            except IOError:
+                pass
+            else:
+                assert False, 'no error raised'
+
+            gap = queue.get(timeout=5)
+            assert gap == {'type': 'ledgerGap', 'last_ledger_index': 6,
+                           'ledger_index': 9}
+            second.push({'type': 'ledgerClosed', 'ledger_index': 10})
+            assert queue.get(timeout=5)['ledger_index'] == 10
+            assert client.connected and not attempts
+
+            # What the second server was sent, and with which ids
+            sent = [(m['command'], m['id']) for m in second.sent]
+            assert sent[0] == ('account_info', first.sent[1]['id'])
+            assert sent[1][0] == 'subscribe'
+            assert second.sent[1]['streams'] == ['ledger']
+            assert 'submit' not in [cmd for cmd, _ in sent]
+        finally:
+            client.close()
+
+    def test_close_while_reconnecting(self):
+        import threading
+        from pytest import raises
+        first = self.FakeConnection({'account_info': lambda msg: None})
+        second = self.FakeConnection({})
+        connecting, proceed = threading.Event(), threading.Event()
+
+        def connect():
+            connecting.set()
+            proceed.wait(5)
+            return second
+
+        client = Client(None, connection=first, reconnect=True, connect=connect)
+        client.RECONNECT_MIN_DELAY = 0.01
+        queue = SubscriptionQueue()
+        client._add_subscription(['ledger'], queue)
+        _, info = client.send('account_info', {'account': 'a'})
+        first.messages.put(IOError('gone'))
+
+        # Closed while the new connection is being made
+        assert connecting.wait(5)
+        client.close()
+        proceed.set()
+        client._read_thread.join(5)
+        assert not client._read_thread.is_alive()
+        # The new connection is closed rather than kept
+        assert client.conn is first
+        assert isinstance(second.messages.get(timeout=5), IOError)
+        # Nothing waits forever
+        raises(IOError, info.wait, timeout=5)
+        raises(IOError, queue.get, timeout=5)
+
+        # Closed while waiting to try again
+        def refuse():
+            raise IOError('refused')
+        conn = self.FakeConnection({'account_info': lambda msg: None})
+        client = Client(None, connection=conn, reconnect=True, connect=refuse)
+        client.RECONNECT_MIN_DELAY = 0.01
+        _, info = client.send('account_info', {'account': 'a'})
+        conn.messages.put(IOError('gone'))
+        time.sleep(0.05)
+        client.close()
+        raises(IOError, info.wait, timeout=5)
+        client._read_thread.join(5)
+        assert not client._read_thread.is_alive()
+
+    def test_unique_ids(self):
+        import threading
+        client = BaseClient()
+        ids = []
+
+        def make_ids():
+            ids.extend([client._mkid() for i in range(2000)])
+        threads = [threading.Thread(target=make_ids) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(ids) == list(range(1, 8001))
+
+    def make_pool(self, *handlers):
+        conns = [self.FakeConnection(h) for h in handlers]
+        return conns, ClientPool([Client('wss://s%d' % i, connection=c)
+                                  for i, c in enumerate(conns)])
+
+    def test_pool_routing(self):
+        def slow(msg):
+            time.sleep(0.02)
+            return self.account_info(msg)
+
+        conns, pool = self.make_pool(
+            {'account_info': slow}, {'account_info': self.account_info})
+        try:
+            # Both are tried first, then the faster one is preferred
+            for i in range(6):
+                assert pool.request_account_info('a') == {'Account': 'a'}
+            assert [len(c.sent) for c in conns] == [1, 5]
+            stats = pool.stats()
+            assert stats[0]['rtt'] > stats[1]['rtt']
+            assert [s['url'] for s in stats] == ['wss://s0', 'wss://s1']
+
+            # Errors with the request itself are not the server's fault
+            try:
+                pool.request_account_info('bad')
+            except ResponseError:
+                pass
+            else:
+                assert False, 'no error raised'
+            assert pool.stats()[1]['errors'] == 0
+        finally:
+            pool.close()
+
+    def test_pool_failover(self):
+        def too_busy(conn):
+            def handler(msg):
+                conn.push({'id': msg['id'], 'type': 'response',
+                           'status': 'error', 'error': 'tooBusy'})
+            return handler
+
+        conns, pool = self.make_pool(
+            {'submit': None, 'account_info': None},
+            {'submit': lambda msg: {'engine_result': 'tesSUCCESS'},
+             'account_info': self.account_info})
+        conns[0].handlers['submit'] = too_busy(conns[0])
+        conns[0].handlers['account_info'] = too_busy(conns[0])
+        try:
+            for i in range(3):
+                assert pool.request_account_info('a') == {'Account': 'a'}
+                assert pool.submit(tx_blob='AB')['engine_result'] == 'tesSUCCESS'
+            stats = pool.stats()
+            assert stats[0]['errors'] == stats[0]['requests'] > 0
+            assert stats[0]['error_rate'] > 0.5
+            # Once in trouble, the primary is tried last
+            assert len(conns[0].sent) < 6
+
+            # A lost connection is not used anymore
+            conns[0].messages.put(IOError('gone'))
+            while pool.endpoints[0].connected:
+                time.sleep(0.01)
+            assert pool.submit(tx_blob='AB')['engine_result'] == 'tesSUCCESS'
+            assert pool.ranked() == [pool.endpoints[1]]
+        finally:
+            pool.close()
+
+    def test_pool_recovery(self):
+        conns, pool = self.make_pool({'account_info': self.account_info},
+                                     {'account_info': self.account_info})
+        try:
+            bad, good = pool.endpoints
+            bad.error_rate, bad.rtt, bad.updated = 1.0, 5.0, timer()
+            good.rtt, good.updated = 0.01, timer()
+            assert pool.ranked()[0] is good
+
+            # Once it has not been heard of in a while, it is tried again
+            bad.updated -= 10 * pool.half_life
+            assert pool.ranked()[0] is bad
+            assert pool.request_account_info('a') == {'Account': 'a'}
+            assert len(conns[0].sent) == 1
+            assert bad.error_rate < pool.max_error_rate
+        finally:
+            pool.close()
+
+    def test_pool_hedging_failover(self):
+        def too_busy(conn):
+            def handler(msg):
+                conn.push({'id': msg['id'], 'type': 'response',
+                           'status': 'error', 'error': 'tooBusy'})
+            return handler
+
+        conns, pool = self.make_pool(
+            {}, {}, {'account_info': self.account_info})
+        for conn in conns[:2]:
+            conn.handlers['account_info'] = too_busy(conn)
+        pool.hedge_percentile = 90
+        pool.HEDGE_MIN_SAMPLES = 1
+        pool._observe('account_info', 1)
+        try:
+            # Both attempts fail, then the third server is asked
+            pool.endpoints[2].rtt = 1
+            assert pool.request_account_info('a') == {'Account': 'a'}
+            assert [len(c.sent) for c in conns] == [1, 1, 1]
+            assert [s['errors'] for s in pool.stats()] == [1, 1, 0]
+        finally:
+            pool.close()
+
+    def test_pool_subscribe(self):
+        conns, pool = self.make_pool(
+            {'subscribe': lambda msg: {'load_factor': 512}},
+            {'subscribe': lambda msg: {'load_factor': 512}})
+        try:
+            result, queue = pool.subscribe(['transactions', 'ledger'])
+            assert pool.fee_info['load_factor'] == 512
+            for conn in conns:
+                conn.push({'type': 'transaction', 'transaction': {'hash': 'A'}})
+                conn.push({'type': 'ledgerClosed', 'ledger_index': 5})
+            conns[1].push({'type': 'transaction', 'transaction': {'hash': 'B'}})
+
+            received = [queue.get(timeout=5) for i in range(3)]
+            assert [m.get('ledger_index') or m['transaction']['hash']
+                    for m in received] == ['A', 5, 'B']
+
+            # One connection failing is not an error for the subscription
+            conns[0].messages.put(IOError('gone'))
+            conns[1].push({'type': 'transaction', 'transaction': {'hash': 'C'}})
+            assert queue.get(timeout=5)['transaction']['hash'] == 'C'
+            conns[1].messages.put(IOError('gone'))
+            try:
+                queue.get(timeout=5)
+            except IOError:
+                pass
+            else:
+                assert False, 'no error raised'
+        finally:
+            pool.close()
+
+    def test_remote_with_pool(self):
+        from .serialize import deserialize_object
+        from .sign import Signer
+        signer = Signer('ssq55ueDob4yV3kPVnNQLHB6icwpC')
+
+        def submit(msg):
+            # Both servers see the transaction validated
+            txhash = transaction_hash(deserialize_object(msg['tx_blob']))
+            for conn in conns:
+                conn.push({'type': 'transaction', 'validated': True,
+                           'transaction': {'hash': txhash},
+                           'engine_result': 'tesSUCCESS'})
+            return {'engine_result': 'tesSUCCESS'}
+
+        handlers = {'subscribe': lambda msg: {},
+                    'account_info': lambda msg: {'account_data': {'Sequence': 7}},
+                    'submit': submit}
+        conns, pool = self.make_pool(dict(handlers), dict(handlers))
+        remote = Remote(None, signer, client=pool)
+        try:
+            pending = remote.send_payment(
+                'r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV', '1000000')
+            assert pending.wait(timeout=5)['engine_result'] == 'tesSUCCESS'
+            assert pending.tx['Sequence'] == 7
+            assert len(conns[0].sent) + len(conns[1].sent) == 4
+        finally:
+            remote.close()
+
+    def test_pool_hedging(self):
+        import threading
+
+        def maybe_slow(conn):
+            def handler(msg):
+                if msg['account'] != 'slow':
+                    return self.account_info(msg)
+                response = {'id': msg['id'], 'type': 'response',
+                            'status': 'success',
+                            'result': {'account_data': {'Account': 'late'}}}
+                threading.Timer(0.3, conn.push, (response,)).start()
+            return handler
+
+        conns, pool = self.make_pool({}, {'account_info': self.account_info})
+        conns[0].handlers['account_info'] = maybe_slow(conns[0])
+        pool.hedge_percentile = 90
+        pool.HEDGE_MIN_SAMPLES = 5
+        try:
+            for i in range(10):
+                pool.request_account_info('a')
+            assert pool.hedge_delay('account_info') is not None
+            # Not hedged: not a read
+            assert pool.hedge_delay('submit') is None
+
+            # The first server is the fastest, but not this time.
+            pool.endpoints[0].rtt, pool.endpoints[1].rtt = 0.0001, 0.01
+            delay = pool.hedge_delay('account_info')
+            start = time.time()
+            assert pool.request_account_info('slow') == {'Account': 'slow'}
+            assert time.time() - start < 0.3
+            # What counts is how long the first server took
+            assert pool.latencies['account_info'][-1] >= delay
+            stats = pool.hedge_stats()
+            assert stats['requests'] == 11
+            assert stats['hedged'] >= 1 and stats['hedge_wins'] >= 1
+            assert 0 < stats['hedge_rate'] <= 1 and 0 < stats['win_rate'] <= 1
+
+            # The late response is ignored, the connection is fine
+            time.sleep(0.4)
+            assert pool.endpoints[0].connected
+            assert not pool.endpoints[0].client.callbacks
+            assert pool.endpoints[0].client.execute(
+                'account_info', account='b')['account_data'] == {'Account': 'b'}
+        finally:
+            pool.close()
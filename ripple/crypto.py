@@ -0,0 +1,297 @@
+"""The secp256k1 operations needed for signing, behind an interface so
+that a native implementation can be used where available.
+
+There are two backends:
+
+``PythonBackend``
+    Pure Python, based on python-ecdsa and the precomputed tables from
+    :mod:`ripple.secp256k1`. Always available.
+
+``CoincurveBackend``
+    Uses libsecp256k1 through the ``coincurve`` package, which is an
+    order of magnitude faster. Selected automatically if ``coincurve``
+    can be imported.
+
+Use :func:`set_backend` to choose one explicitly.
+
+Keys are passed around as plain values: the secret exponent as an
+integer, public keys as 33-byte compressed encodings, points as
+``(x, y)`` tuples. Digests are the 32 bytes to be signed; signatures
+are DER encoded and fully canonical (low ``s``).
+"""
+
+from ecdsa import six
+from ecdsa.numbertheory import inverse_mod
+from ecdsa.util import sigencode_der, sigdecode_der, randrange
+from .serialize import to_bytes, from_bytes, LRUCache
+from . import secp256k1
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+
+__all__ = ('get_backend', 'set_backend', 'PythonBackend', 'CoincurveBackend')
+
+
+P = secp256k1.P
+N = secp256k1.N
+
+# How many parsed public keys each backend keeps around for verifying.
+PUBLIC_KEY_CACHE_SIZE = 1024
+
+
+class PythonBackend(object):
+
+    name = 'python'
+
+    def __init__(self):
+        self._public_keys = LRUCache(PUBLIC_KEY_CACHE_SIZE)
+
+    def public_key(self, secret):
+        """Return the compressed public key for a secret exponent."""
+        return self.compress(self.public_point(secret))
+
+    def public_point(self, secret):
+        """Return the public key for a secret exponent as a point."""
+        return secp256k1.generator_multiply(secret)
+
+    def sign(self, secret, digest, k=None):
+        """Sign ``digest``. ``k`` can be given for testing; it is
+        otherwise chosen at random.
+        """
+        number = from_bytes(digest)
+        while True:
+            nonce = k or randrange(N)
+            r = secp256k1.generator_multiply(nonce)[0] % N
+            s = inverse_mod(nonce, N) * (number + secret * r) % N
+            if r and s:
+                break
+            if k:
+                raise ValueError('k=%s does not give a valid signature' % k)
+        return encode_signature(r, s)
+
+    def verify(self, public_key, digest, signature):
+        """Return whether ``signature`` is valid for ``digest``.
+
+        Signatures that are not canonical are accepted too.
+        """
+        try:
+            multiples = self.load_public_key(public_key)
+            r, s = sigdecode_der(signature, N)
+        except Exception:
+            return False
+        if not (0 < r < N and 0 < s < N):
+            return False
+        s_inv = inverse_mod(s, N)
+        u1 = from_bytes(digest) * s_inv % N
+        u2 = r * s_inv % N
+        result = secp256k1.multiply_windowed(multiples, u2)
+        if u1:
+            result = secp256k1.jacobian_add_affine(
+                *(result + secp256k1.generator_multiply(u1)))
+        result = secp256k1.to_affine(*result)
+        return result is not None and result[0] % N == r
+
+    def load_public_key(self, public_key):
+        """Return the public key in the form :meth:`verify` needs it.
+
+        Parsing a public key means decompressing the point, so the
+        result is cached; the same keys tend to show up again and again.
+        Here, we also precompute a few multiples of the point.
+        """
+        public_key = bytes(public_key)
+        loaded = self._public_keys.get(public_key)
+        if loaded is None:
+            loaded = secp256k1.point_multiples(self.decompress(public_key))
+            self._public_keys[public_key] = loaded
+        return loaded
+
+    def compress(self, point):
+        return secp256k1.compress(point)
+
+    def decompress(self, public_key):
+        """Return the point ``(x, y)`` for a public key, which may be
+        compressed or not. Raises ``ValueError`` if it is invalid.
+        """
+        public_key = bytes(public_key)
+        prefix = public_key[:1]
+        if len(public_key) == 65 and prefix == b'\x04':
+            point = (from_bytes(public_key[1:33]), from_bytes(public_key[33:]))
+        elif len(public_key) == 33 and prefix in (b'\x02', b'\x03'):
+            x = from_bytes(public_key[1:])
+            # P % 4 == 3, so the square root is a single exponentiation
+            y = pow((pow(x, 3, P) + secp256k1.CURVE_B) % P, (P + 1) // 4, P)
+            if (y & 1) != (prefix == b'\x03'):
+                y = P - y
+            point = (x, y)
+        else:
+            raise ValueError('Not a valid public key')
+        if not (point[0] < P and point[1] < P and secp256k1.is_on_curve(*point)):
+            raise ValueError('Not a valid public key')
+        return point
+
+
+class CoincurveBackend(PythonBackend):
+
+    name = 'coincurve'
+
+    def __init__(self):
+        if coincurve is None:
+            raise RuntimeError('coincurve is not installed')
+        PythonBackend.__init__(self)
+
+    def public_key(self, secret):
+        return coincurve.PrivateKey(to_bytes(secret, 32)).public_key.format()
+
+    def public_point(self, secret):
+        return coincurve.PrivateKey(to_bytes(secret, 32)).public_key.point()
+
+    def sign(self, secret, digest, k=None):
+        # libsecp256k1 always picks its own nonce (RFC 6979); a fixed k
+        # is only ever wanted by tests, so leave those to Python.
+        if k:
+            return PythonBackend.sign(self, secret, digest, k=k)
+        # The signature is already normalized to a low s.
+        return coincurve.PrivateKey(to_bytes(secret, 32)).sign(
+            digest, hasher=None)
+
+    def verify(self, public_key, digest, signature):
+        # libsecp256k1 rejects a high s; we want to be as lenient as the
+        # Python backend.
+        try:
+            r, s = sigdecode_der(signature, N)
+            return self.load_public_key(public_key).verify(
+                encode_signature(r, s), digest, hasher=None)
+        except Exception:
+            return False
+
+    def load_public_key(self, public_key):
+        public_key = bytes(public_key)
+        loaded = self._public_keys.get(public_key)
+        if loaded is None:
+            loaded = coincurve.PublicKey(public_key)
+            self._public_keys[public_key] = loaded
+        return loaded
+
+    def compress(self, point):
+        return coincurve.PublicKey.from_point(*point).format()
+
+    def decompress(self, public_key):
+        try:
+            return coincurve.PublicKey(bytes(public_key)).point()
+        except Exception:
+            raise ValueError('Not a valid public key')
+
+
+def encode_signature(r, s):
+    """DER encode a signature, making it fully canonical (see
+    :func:`ripple.sign.ecdsa_make_canonical`).
+    """
+    if s > N // 2:
+        s = N - s
+    return sigencode_der(r, s, None)
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the backend in use, selecting the best one available on
+    first use.
+    """
+    global _backend
+    if _backend is None:
+        _backend = CoincurveBackend() if coincurve is not None else PythonBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """Choose the backend, either by name (``"python"``,
+    ``"coincurve"``) or by passing an instance.
+    """
+    global _backend
+    if isinstance(backend, six.string_types):
+        backend = {
+            'python': PythonBackend,
+            'coincurve': CoincurveBackend,
+        }[backend]()
+    _backend = backend
+    return backend
+
+
+def available_backends():
+    """All the backends that can be used on this machine."""
+    backends = [PythonBackend()]
+    if coincurve is not None:
+        backends.append(CoincurveBackend())
+    return backends
+
+
+class Test:
+
+    # Derived from ssq55ueDob4yV3kPVnNQLHB6icwpC, see ripple.sign
+    secret = 0x902981cd5e0c862c53dc4854b6da4cc04179a2a524912d79800ac4c95435564d
+
+    def test_public_key(self):
+        from .sign import root_key_from_seed, parse_seed, ecc_point_to_bytes_compressed
+        key = root_key_from_seed(parse_seed('ssq55ueDob4yV3kPVnNQLHB6icwpC'))
+        expected = ecc_point_to_bytes_compressed(key.privkey.public_key.point, pad=True)
+        for backend in available_backends():
+            assert backend.public_key(self.secret) == expected
+            assert backend.public_point(self.secret) == \
+                (key.privkey.public_key.point.x(), key.privkey.public_key.point.y())
+            assert backend.compress(backend.decompress(expected)) == expected
+
+    def test_sign_verify(self):
+        digest = to_bytes(0xFF00EECC, 32)
+        for backend in available_backends():
+            public_key = backend.public_key(self.secret)
+            signature = backend.sign(self.secret, digest)
+            r, s = sigdecode_der(signature, N)
+            assert s <= N // 2
+
+            for other in available_backends():
+                assert other.verify(public_key, digest, signature)
+                # Not canonical, but still valid
+                assert other.verify(public_key, digest, sigencode_der(r, N - s, None))
+                assert not other.verify(public_key, digest[::-1], signature)
+                assert not other.verify(public_key, digest, b'garbage')
+                assert not other.verify(b'\x02' + b'\xff' * 32, digest, signature)
+
+    def test_decompress(self):
+        backend = PythonBackend()
+        for k in (1, 2, 3, 2**100):
+            point = secp256k1.generator_multiply(k)
+            assert backend.decompress(backend.compress(point)) == point
+            uncompressed = b'\x04' + to_bytes(point[0], 32) + to_bytes(point[1], 32)
+            assert backend.decompress(uncompressed) == point
+        try:
+            backend.decompress(b'\x02' + b'\xff' * 32)
+        except ValueError:
+            pass
+        else:
+            assert False, 'invalid key accepted'
+
+    def test_sign_vectors(self):
+        # All backends pass the signing tests
+        from .sign import Test as SigningTest
+        old = get_backend()
+        try:
+            for backend in available_backends():
+                set_backend(backend)
+                SigningTest().test_wiki_test_vector()
+                SigningTest().test_canonical_signature()
+                SigningTest().test_sign()
+                SigningTest().test_signer()
+        finally:
+            set_backend(old)
+
+    def test_set_backend(self):
+        old = get_backend()
+        try:
+            assert set_backend('python').name == 'python'
+            assert get_backend().name == 'python'
+        finally:
+            set_backend(old)
@@ -0,0 +1,326 @@
+"""Ed25519 signatures, for Ripple keys of that type ("sEd..." secrets,
+public keys prefixed with ``ED``).
+
+If PyNaCl or cryptography is installed, it is used to do the work;
+otherwise, we fall back to the pure Python implementation here, which
+follows the reference code in RFC 8032. Multiplications of the base
+point use a table of precomputed multiples, built on first use.
+
+All keys and signatures are raw bytes: secret keys and public keys are
+32 bytes, signatures 64 bytes.
+"""
+
+import hashlib
+import threading
+from .serialize import to_bytes, from_bytes
+
+try:
+    import nacl.signing
+    import nacl.exceptions
+except ImportError:
+    nacl = None
+
+try:
+    from cryptography.hazmat.primitives.asymmetric import ed25519 as crypto_ed25519
+    from cryptography.exceptions import InvalidSignature
+except ImportError:
+    crypto_ed25519 = None
+
+
+__all__ = ('public_key', 'sign', 'verify')
+
+
+P = 2 ** 255 - 19
+L = 2 ** 252 + 27742317777372353535851937790883648493
+D = -121665 * pow(121666, P - 2, P) % P
+D2 = 2 * D % P
+SQRT_M1 = pow(2, (P - 1) // 4, P)
+
+
+def inverse(x):
+    return pow(x, P - 2, P)
+
+
+def from_le(data):
+    return from_bytes(data[::-1])
+
+
+def to_le(number):
+    return to_bytes(number, 32)[::-1]
+
+
+def sha512_mod_l(*parts):
+    return from_le(hashlib.sha512(b''.join(parts)).digest()) % L
+
+
+# Points are in extended coordinates (X, Y, Z, T), with x = X/Z,
+# y = Y/Z and x*y = T/Z.
+
+IDENTITY = (0, 1, 1, 0)
+
+
+def point_add(p, q):
+    A = (p[1] - p[0]) * (q[1] - q[0]) % P
+    B = (p[1] + p[0]) * (q[1] + q[0]) % P
+    C = p[3] * D2 * q[3] % P
+    D = p[2] * 2 * q[2] % P
+    E, F, G, H = B - A, D - C, D + C, B + A
+    return (E * F % P, G * H % P, F * G % P, E * H % P)
+
+
+def point_double(p):
+    X, Y, Z = p[0], p[1], p[2]
+    A = X * X % P
+    B = Y * Y % P
+    C = 2 * Z * Z % P
+    H = A + B
+    E = H - (X + Y) ** 2
+    G = A - B
+    F = C + G
+    return (E * F % P, G * H % P, F * G % P, E * H % P)
+
+
+def point_multiply(s, p):
+    q = IDENTITY
+    while s > 0:
+        if s & 1:
+            q = point_add(q, p)
+        p = point_double(p)
+        s >>= 1
+    return q
+
+
+def point_equal(p, q):
+    # x1 / z1 == x2 / z2  <==>  x1 * z2 == x2 * z1
+    return (p[0] * q[2] - q[0] * p[2]) % P == 0 and \
+        (p[1] * q[2] - q[1] * p[2]) % P == 0
+
+
+def recover_x(y, sign):
+    if y >= P:
+        return None
+    x2 = (y * y - 1) * inverse(D * y * y + 1)
+    if x2 == 0:
+        return None if sign else 0
+    x = pow(x2, (P + 3) // 8, P)
+    if (x * x - x2) % P != 0:
+        x = x * SQRT_M1 % P
+    if (x * x - x2) % P != 0:
+        return None
+    if (x & 1) != sign:
+        x = P - x
+    return x
+
+
+def point_compress(p):
+    z_inv = inverse(p[2])
+    x = p[0] * z_inv % P
+    y = p[1] * z_inv % P
+    return to_le(y | ((x & 1) << 255))
+
+
+def point_decompress(data):
+    if len(data) != 32:
+        return None
+    y = from_le(data)
+    sign = y >> 255
+    y &= (1 << 255) - 1
+    x = recover_x(y, sign)
+    if x is None:
+        return None
+    return (x, y, 1, x * y % P)
+
+
+G_Y = 4 * inverse(5) % P
+G = (recover_x(G_Y, 0), G_Y, 1, recover_x(G_Y, 0) * G_Y % P)
+
+
+class BaseTable(object):
+    """Multiples of the base point, for 8-bit windows of the scalar
+    (compare :class:`ripple.secp256k1.FixedBaseTable`).
+
+    Entries are stored as ``(y + x, y - x, 2 * d * x * y)``, which
+    makes adding them cheaper.
+    """
+
+    window = 8
+
+    def __init__(self):
+        points = []
+        base = G
+        for i in range(256 // self.window):
+            current = base
+            for j in range(2 ** self.window - 1):
+                points.append(current)
+                current = point_add(current, base)
+            base = current
+
+        # Convert to affine coordinates with a single inversion
+        # (Montgomery's trick).
+        products = []
+        acc = 1
+        for point in points:
+            acc = acc * point[2] % P
+            products.append(acc)
+        acc_inv = inverse(acc)
+        entries = [None] * len(points)
+        for i in range(len(points) - 1, -1, -1):
+            X, Y, Z, T = points[i]
+            z_inv = acc_inv * products[i - 1] % P if i else acc_inv
+            acc_inv = acc_inv * Z % P
+            x = X * z_inv % P
+            y = Y * z_inv % P
+            entries[i] = ((y + x) % P, (y - x) % P, D2 * x * y % P)
+
+        size = 2 ** self.window - 1
+        self.rows = [entries[i:i + size] for i in range(0, len(entries), size)]
+
+    def multiply(self, s):
+        mask = 2 ** self.window - 1
+        X, Y, Z, T = IDENTITY
+        for row in self.rows:
+            digit = s & mask
+            s >>= self.window
+            if digit:
+                ypx, ymx, t2d = row[digit - 1]
+                A = (Y - X) * ymx % P
+                B = (Y + X) * ypx % P
+                C = T * t2d % P
+                D = 2 * Z
+                E, F, G, H = B - A, D - C, D + C, B + A
+                X, Y, Z, T = E * F % P, G * H % P, F * G % P, E * H % P
+            if not s:
+                break
+        return X, Y, Z, T
+
+
+_base_table = None
+_base_table_lock = threading.Lock()
+
+
+def base_multiply(s):
+    global _base_table
+    if _base_table is None:
+        with _base_table_lock:
+            if _base_table is None:
+                _base_table = BaseTable()
+    return _base_table.multiply(s % L)
+
+
+def expand_secret(secret):
+    h = hashlib.sha512(secret).digest()
+    a = from_le(h[:32])
+    a &= (1 << 254) - 8
+    a |= 1 << 254
+    return a, h[32:]
+
+
+def python_public_key(secret):
+    a, _ = expand_secret(secret)
+    return point_compress(base_multiply(a))
+
+
+def python_sign(secret, message):
+    a, prefix = expand_secret(secret)
+    A = point_compress(base_multiply(a))
+    r = sha512_mod_l(prefix, message)
+    R = point_compress(base_multiply(r))
+    h = sha512_mod_l(R, A, message)
+    s = (r + h * a) % L
+    return R + to_le(s)
+
+
+def python_verify(public_key, message, signature):
+    if len(public_key) != 32 or len(signature) != 64:
+        return False
+    A = point_decompress(public_key)
+    R = point_decompress(signature[:32])
+    if A is None or R is None:
+        return False
+    s = from_le(signature[32:])
+    if s >= L:
+        return False
+    h = sha512_mod_l(signature[:32], public_key, message)
+    return point_equal(base_multiply(s), point_add(R, point_multiply(h, A)))
+
+
+if nacl is not None:
+    NATIVE = 'nacl'
+
+    def public_key(secret):
+        return bytes(nacl.signing.SigningKey(secret).verify_key)
+
+    def sign(secret, message):
+        return nacl.signing.SigningKey(secret).sign(message).signature
+
+    def verify(public_key, message, signature):
+        try:
+            nacl.signing.VerifyKey(public_key).verify(message, signature)
+        except (nacl.exceptions.BadSignatureError, ValueError, TypeError):
+            return False
+        return True
+
+elif crypto_ed25519 is not None:
+    NATIVE = 'cryptography'
+
+    def public_key(secret):
+        from cryptography.hazmat.primitives import serialization
+        return crypto_ed25519.Ed25519PrivateKey.from_private_bytes(
+            secret).public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+    def sign(secret, message):
+        return crypto_ed25519.Ed25519PrivateKey.from_private_bytes(
+            secret).sign(message)
+
+    def verify(public_key, message, signature):
+        try:
+            crypto_ed25519.Ed25519PublicKey.from_public_bytes(
+                public_key).verify(signature, message)
+        except (InvalidSignature, ValueError):
+            return False
+        return True
+
+else:
+    NATIVE = None
+    public_key = python_public_key
+    sign = python_sign
+    verify = python_verify
+
+
+class Test:
+
+    # RFC 8032, section 7.1, tests 1 and 3
+    vectors = [
+        ('9d61b19deffd5a60ba844af492ec2cc44449c5697b326919703bac031cae7f60',
+         'd75a980182b10ab7d54bfed3c964073a0ee172f3daa62325af021a68f707511a',
+         '',
+         'e5564300c360ac729086e2cc806e828a84877f1eb8e5d974d873e065224901555fb8821590a33bacc61e39701cf9b46bd25bf5f0595bbe24655141438e7a100b'),
+        ('c5aa8df43f9f837bedb7442f31dcb7b166d38535076f094b85ce3a2e0b4458f7',
+         'fc51cd8e6218a1a38da47ed00230f0580816ed13ba3303ac5deb911548908025',
+         'af82',
+         '6291d657deec24024827e69c3abe01a30ce548a284743a445e3680d7db5ac3ac18ff9b538d16f290ae67f760984dc6594a7c15e9716ed28dc027beceea1ec40a'),
+    ]
+
+    def implementations(self):
+        yield python_public_key, python_sign, python_verify
+        if NATIVE:
+            yield public_key, sign, verify
+
+    def test_vectors(self):
+        from binascii import unhexlify
+        for secret, public, message, signature in self.vectors:
+            secret, public, message, signature = map(
+                unhexlify, (secret, public, message, signature))
+            for get_public_key, do_sign, do_verify in self.implementations():
+                assert get_public_key(secret) == public
+                assert do_sign(secret, message) == signature
+                assert do_verify(public, message, signature)
+                assert not do_verify(public, message + b'x', signature)
+                assert not do_verify(public, message, signature[:-1] + b'\0')
+
+    def test_point_double(self):
+        p = point_multiply(12345, G)
+        assert point_equal(point_double(p), point_add(p, p))
+        assert point_equal(base_multiply(12345), p)
+        assert point_equal(base_multiply(L - 1), point_multiply(L - 1, G))
@@ -0,0 +1,280 @@
+"""Sign transactions ahead of time, so that sending one does not have
+to wait for the signing.
+"""
+
+import logging
+import threading
+from .serialize import SerializedTransaction
+from .sign import sign_transaction
+
+
+__all__ = ('PresignedPool',)
+
+
+log = logging.getLogger('ripple.presign')
+log.addHandler(logging.NullHandler())
+
+
+class PresignedPool(object):
+    """Keeps a reservoir of signed copies of a transaction template.
+
+    For the next ``depth`` sequence numbers of the account, a background
+    thread signs ``template`` once for every fee level in ``fees`` (in
+    drops). :meth:`submit` then only needs to pick the right one and
+    send it off.
+
+    ``remote`` is a :class:`ripple.client.Remote`; its signer is used,
+    and sequence numbers are taken from it, so transactions sent through
+    the remote directly and through this pool can be mixed. Signed
+    transactions whose sequence number has been used up in the meantime
+    are thrown away.
+
+    Note that a ``LastLedgerSequence`` in the template will make the
+    signed transactions expire like any other.
+    """
+
+    def __init__(self, remote, template, fees, depth=5, start=True):
+        self.remote = remote
+        self.signer = remote.signer
+        self.account = template.get('Account') or self.signer.account
+        self.template = dict(template, Account=self.account)
+        self.fees = sorted(int(fee) for fee in fees)
+        self.depth = depth
+
+        # How often we had a transaction ready, and how often not.
+        self.hits = self.misses = 0
+
+        # (sequence, fee) -> signed SerializedTransaction
+        self._entries = {}
+        # Sequence numbers below this one have been used up.
+        self._used = 0
+        self._condition = threading.Condition()
+        self._wanted = True
+        self._shutdown = False
+        self._thread = None
+        if start:
+            self.start()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._entries)
+
+    def start(self):
+        """Start the background thread which keeps the reservoir full."""
+        self._thread = threading.Thread(target=self._fill_proc)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+
+    def _fill_proc(self):
+        try:
+            while True:
+                with self._condition:
+                    while not self._wanted and not self._shutdown:
+                        self._condition.wait()
+                    if self._shutdown:
+                        break
+                    self._wanted = False
+                self.fill()
+        except Exception:
+            # The pool still works without the thread, it just has to
+            # sign on demand.
+            log.exception('presign.fill_proc failed')
+        log.debug('presign.fill_proc now shut down')
+
+    def fill(self):
+        """Sign everything that is missing from the reservoir. Returns
+        the number of transactions signed.
+
+        This is what the background thread does; you can also call it
+        yourself, if you did not start one.
+        """
+        count = 0
+        while not self._shutdown:
+            sequence = self.remote.peek_sequence_number(self.account)
+            with self._condition:
+                self._invalidate(sequence)
+                missing = [(seq, fee)
+                           for seq in range(sequence, sequence + self.depth)
+                           for fee in self.fees
+                           if (seq, fee) not in self._entries]
+            if not missing:
+                break
+
+            # Signing happens outside the lock, so take() is never
+            # held up by it.
+            seq, fee = missing[0]
+            tx = self._sign(seq, fee)
+            with self._condition:
+                # take() may have used the sequence in the meantime.
+                if seq >= self._used:
+                    self._entries[(seq, fee)] = tx
+            count += 1
+        return count
+
+    def _invalidate(self, sequence):
+        """Drop all entries with a sequence number below ``sequence``."""
+        for key in [k for k in self._entries if k[0] < sequence]:
+            del self._entries[key]
+
+    def _sign(self, sequence, fee):
+        tx = SerializedTransaction(self.template)
+        tx['Sequence'] = sequence
+        tx['Fee'] = fee
+        return sign_transaction(tx, self.signer)
+
+    def take(self, fee=None):
+        """Use up the next sequence number, and return a signed
+        transaction for it.
+
+        The transaction has the lowest of our fee levels that is at
+        least ``fee``; the default is what the remote's client would
+        currently charge. If there is no such transaction ready, one is
+        signed right away.
+        """
+        if fee is None:
+            probe = {}
+            self.remote.client.add_fee(probe)
+            fee = probe['Fee']
+        fee = int(fee)
+        levels = [level for level in self.fees if level >= fee]
+
+        sequence = self.remote.get_sequence_number(self.account)
+        with self._condition:
+            tx = None
+            for level in levels:
+                tx = self._entries.get((sequence, level))
+                if tx is not None:
+                    break
+            # All other fee levels for this sequence are now useless.
+            self._used = max(self._used, sequence + 1)
+            self._invalidate(sequence + 1)
+            self._wanted = True
+            self._condition.notify_all()
+
+        if tx is None:
+            self.misses += 1
+            tx = self._sign(sequence, levels[0] if levels else fee)
+        else:
+            self.hits += 1
+        return tx
+
+    def submit(self, fee=None):
+        """Send a transaction from the reservoir, see :meth:`take`.
+        Returns a DeferredTransaction, like ``Remote.submit()``.
+        """
+        return self.remote.submit_signed(self.account, self.take(fee))
+
+
+class Test:
+
+    class FakeRemote(object):
+        """Just enough of a Remote to work offline."""
+
+        def __init__(self, signer, sequence):
+            self.signer = signer
+            self.sequence = sequence
+            self.submitted = []
+            remote = self
+
+            class client(object):
+                @staticmethod
+                def add_fee(tx):
+                    tx['Fee'] = remote.fee
+            self.client = client
+            self.fee = 12
+
+        def peek_sequence_number(self, account):
+            return self.sequence
+
+        def get_sequence_number(self, account):
+            self.sequence += 1
+            return self.sequence - 1
+
+        def submit_signed(self, account, tx):
+            self.submitted.append(tx)
+            return tx
+
+    template = {"TransactionType": "Payment",
+                "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+                "Amount": "200000000"}
+
+    def make_pool(self, **kw):
+        from .sign import Signer
+        remote = self.FakeRemote(Signer('ssq55ueDob4yV3kPVnNQLHB6icwpC'), 10)
+        return remote, PresignedPool(remote, self.template, **kw)
+
+    def test_fill_and_take(self):
+        from .sign import verify_transaction
+        remote, pool = self.make_pool(fees=[10, 15, 20], depth=3, start=False)
+        assert pool.fill() == 9
+        assert len(pool) == 9
+        assert pool.fill() == 0
+
+        tx = pool.take()   # fee 12, so level 15
+        assert (tx['Sequence'], tx['Fee']) == (10, 15)
+        assert tx['Account'] == remote.signer.account
+        assert verify_transaction(tx)
+        # The other levels for that sequence are gone
+        assert len(pool) == 6
+
+        tx = pool.submit(fee=20)
+        assert (tx['Sequence'], tx['Fee']) == (11, 20)
+        assert remote.submitted == [tx]
+        assert (pool.hits, pool.misses) == (2, 0)
+
+        # Sequence numbers used elsewhere invalidate our entries
+        remote.sequence = 13
+        assert pool.fill() == 9
+        assert sorted(set(seq for seq, _ in pool._entries)) == [13, 14, 15]
+
+        # Above our highest level, we have to sign right away
+        tx = pool.take(fee=50)
+        assert (tx['Sequence'], tx['Fee']) == (13, 50)
+        assert verify_transaction(tx)
+        assert (pool.hits, pool.misses) == (2, 1)
+
+    def test_background_thread(self):
+        import time
+        remote, pool = self.make_pool(fees=[12], depth=2)
+        try:
+            for _ in range(3):
+                deadline = time.time() + 10
+                while len(pool) < 2 and time.time() < deadline:
+                    time.sleep(0.01)
+                assert len(pool) == 2
+                pool.take()
+            assert pool.hits == 3
+        finally:
+            pool.close()
+
+    def test_cold_cache(self):
+        # The fill thread and take() both find that the remote does not
+        # know the sequence number yet; it must be fetched only once.
+        import time
+        from .client import Client, Remote, Test as ClientTest
+        from .sign import Signer
+
+        def account_info(msg):
+            time.sleep(0.05)
+            return {'account_data': {'Sequence': 10}}
+        conn = ClientTest.FakeConnection({
+            'subscribe': lambda msg: {},
+            'account_info': account_info,
+            'submit': lambda msg: {'engine_result': 'tesSUCCESS'}})
+        remote = Remote(None, Signer('ssq55ueDob4yV3kPVnNQLHB6icwpC'),
+                        client=Client(None, connection=conn))
+        pool = PresignedPool(remote, self.template, fees=[12], depth=2)
+        try:
+            sequences = [pool.take(fee=12)['Sequence'] for _ in range(3)]
+            assert sequences == [10, 11, 12]
+            assert [m['command'] for m in conn.sent].count('account_info') == 1
+        finally:
+            pool.close()
+            remote.close()
@@ -0,0 +1,369 @@
+"""Point arithmetic on the secp256k1 curve, fast enough for signing.
+
+python-ecdsa multiplies the generator like any other point: about 256
+doublings and 128 additions per signature. Since signing only ever
+multiplies the generator, we precompute a table of its multiples once
+per process, which reduces the multiplication to one point addition
+per window of the scalar.
+
+Points are kept in Jacobian coordinates ``(X, Y, Z)`` during the
+computation (``Z == 0`` is the point at infinity), so that only a
+single modular inversion is needed at the end. The table itself is
+stored in affine coordinates ``(x, y)``.
+
+Note that, like python-ecdsa, none of this is constant-time.
+"""
+
+import os
+import pickle
+import sys
+import threading
+from ecdsa import curves
+from ecdsa.numbertheory import inverse_mod
+from .serialize import write_cache_file, to_bytes
+
+
+__all__ = ('FixedBaseTable', 'generator_table', 'generator_multiply',
+           'generator_multiply_jacobian')
+
+
+P = curves.SECP256k1.curve.p()
+N = curves.SECP256k1.order
+CURVE_B = curves.SECP256k1.curve.b()
+G = (curves.SECP256k1.generator.x(), curves.SECP256k1.generator.y())
+
+INFINITY = (1, 1, 0)
+
+
+def jacobian_double(X, Y, Z):
+    """Double a point (this is ``dbl-2009-l``, for ``a = 0``)."""
+    if not Y or not Z:
+        return INFINITY
+    A = X * X % P
+    B = Y * Y % P
+    C = B * B % P
+    D = 2 * ((X + B) ** 2 - A - C) % P
+    E = 3 * A
+    X3 = (E * E - 2 * D) % P
+    Y3 = (E * (D - X3) - 8 * C) % P
+    Z3 = 2 * Y * Z % P
+    return X3, Y3, Z3
+
+
+def jacobian_add_affine(X1, Y1, Z1, x2, y2):
+    """Add the affine point ``(x2, y2)`` to a Jacobian point."""
+    if not Z1:
+        return x2, y2, 1
+    Z1Z1 = Z1 * Z1 % P
+    H = (x2 * Z1Z1 - X1) % P
+    R = (y2 * Z1 * Z1Z1 - Y1) % P
+    if not H:
+        if not R:
+            return jacobian_double(X1, Y1, Z1)
+        return INFINITY
+    HH = H * H % P
+    HHH = H * HH % P
+    V = X1 * HH % P
+    X3 = (R * R - HHH - 2 * V) % P
+    Y3 = (R * (V - X3) - Y1 * HHH) % P
+    Z3 = Z1 * H % P
+    return X3, Y3, Z3
+
+
+def to_affine(X, Y, Z):
+    """Convert a Jacobian point to affine coordinates; returns ``None``
+    for the point at infinity.
+    """
+    if not Z:
+        return None
+    z_inv = inverse_mod(Z, P)
+    z_inv2 = z_inv * z_inv % P
+    return X * z_inv2 % P, Y * z_inv2 * z_inv % P
+
+
+def batch_to_affine(points):
+    """Convert many Jacobian points to affine coordinates with a single
+    modular inversion (Montgomery's trick).
+
+    None of the points may be the point at infinity.
+    """
+    # Running products of all the Z coordinates
+    products = []
+    acc = 1
+    for X, Y, Z in points:
+        acc = acc * Z % P
+        products.append(acc)
+
+    acc_inv = inverse_mod(acc, P)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        X, Y, Z = points[i]
+        z_inv = acc_inv * products[i - 1] % P if i else acc_inv
+        acc_inv = acc_inv * Z % P
+        z_inv2 = z_inv * z_inv % P
+        result[i] = (X * z_inv2 % P, Y * z_inv2 * z_inv % P)
+    return result
+
+
+def compress(point):
+    """The 33-byte compressed encoding of an affine point."""
+    x, y = point
+    return (b'\x03' if y & 1 else b'\x02') + to_bytes(x, 32)
+
+
+def is_on_curve(x, y):
+    return (y * y - x * x * x - CURVE_B) % P == 0
+
+
+class FixedBaseTable(object):
+    """Precomputed multiples of a point, for fast multiplication of
+    that point by any scalar.
+
+    The scalar is split into windows of ``window`` bits. For window
+    ``i``, the table holds ``j * 2**(window*i) * point`` for every
+    possible digit ``j``, so multiplying needs no doublings at all.
+    """
+
+    def __init__(self, point, window=8, rows=None):
+        self.point = point
+        self.window = window
+        self.rows = rows if rows is not None else self.build(point, window)
+
+    @staticmethod
+    def build(point, window):
+        digits = 2 ** window
+        num_rows = (N.bit_length() + window - 1) // window
+
+        points = []
+        base = point
+        for i in range(num_rows):
+            x, y = base
+            current = (x, y, 1)
+            points.append(current)
+            for j in range(digits - 2):
+                current = jacobian_add_affine(*(current + base))
+                points.append(current)
+            # digits * base is where the next row starts.
+            base = to_affine(*jacobian_add_affine(*(current + base)))
+
+        affine = batch_to_affine(points)
+        return [affine[i:i + digits - 1]
+                for i in range(0, len(affine), digits - 1)]
+
+    def multiply(self, k):
+        """Return ``k * point`` in affine coordinates, or ``None`` for
+        the point at infinity.
+        """
+        return to_affine(*self.multiply_jacobian(k))
+
+    def multiply_jacobian(self, k):
+        """Return ``k * point`` in Jacobian coordinates, for when you
+        want to convert many results with :func:`batch_to_affine`.
+        """
+        k %= N
+        mask = 2 ** self.window - 1
+        window = self.window
+        X, Y, Z = INFINITY
+        for row in self.rows:
+            digit = k & mask
+            k >>= window
+            if not digit:
+                continue
+            x, y = row[digit - 1]
+            if not Z:
+                X, Y, Z = x, y, 1
+                continue
+            # This is jacobian_add_affine(), inlined as it is the hot
+            # loop of signing.
+            Z1Z1 = Z * Z % P
+            H = (x * Z1Z1 - X) % P
+            R = (y * Z * Z1Z1 - Y) % P
+            if not H:
+                X, Y, Z = jacobian_add_affine(X, Y, Z, x, y)
+                continue
+            HH = H * H % P
+            HHH = H * HH % P
+            V = X * HH % P
+            X = (R * R - HHH - 2 * V) % P
+            Y = (R * (V - X) - Y * HHH) % P
+            Z = Z * H % P
+        return X, Y, Z
+
+    def is_valid(self):
+        """Sanity check the table, for instance after loading it from
+        disk.
+        """
+        digits = 2 ** self.window
+        num_rows = (N.bit_length() + self.window - 1) // self.window
+        if len(self.rows) != num_rows or self.rows[0][0] != self.point:
+            return False
+        for row in self.rows:
+            if len(row) != digits - 1:
+                return False
+            for x, y in row:
+                if not is_on_curve(x, y):
+                    return False
+        # Spot check the last entry; it depends on all the others
+        return self.rows[-1][-1] == to_affine(*multiply_slow(
+            self.point, (digits - 1) << (self.window * (num_rows - 1))))
+
+
+def multiply_slow(point, k):
+    """Multiply any point by double-and-add; returns Jacobian."""
+    x, y = point
+    result = INFINITY
+    for bit in bin(k)[2:]:
+        result = jacobian_double(*result)
+        if bit == '1':
+            result = jacobian_add_affine(*(result + (x, y)))
+    return result
+
+
+def point_multiples(point, window=4):
+    """Return ``[point, 2*point, ..., (2**window - 1)*point]``, in affine
+    coordinates, for :func:`multiply_windowed`.
+    """
+    x, y = point
+    current = (x, y, 1)
+    points = [current]
+    for i in range(2 ** window - 2):
+        current = jacobian_add_affine(*(current + point))
+        points.append(current)
+    return batch_to_affine(points)
+
+
+def multiply_windowed(multiples, k, window=4):
+    """Multiply a point by ``k``, given its :func:`point_multiples`;
+    returns Jacobian.
+
+    Compared to :func:`multiply_slow`, this needs one addition per
+    window instead of one per bit, which is worth it if the same point
+    is used over and over (a public key, when verifying).
+    """
+    mask = 2 ** window - 1
+    shift = ((k.bit_length() + window - 1) // window) * window
+    X, Y, Z = INFINITY
+    while shift > 0:
+        shift -= window
+        if Z:
+            # This is jacobian_double(), inlined. The result is never
+            # the point at infinity: the point's order is prime.
+            for i in range(window):
+                A = X * X % P
+                B = Y * Y % P
+                C = B * B % P
+                D = 2 * ((X + B) ** 2 - A - C) % P
+                E = 3 * A
+                Z = 2 * Y * Z % P
+                X = (E * E - 2 * D) % P
+                Y = (E * (D - X) - 8 * C) % P
+        digit = (k >> shift) & mask
+        if digit:
+            X, Y, Z = jacobian_add_affine(X, Y, Z, *multiples[digit - 1])
+    return X, Y, Z
+
+
+# Bump this when the pickled format changes.
+TABLE_CACHE_VERSION = 1
+
+_generator_table = None
+_generator_table_lock = threading.Lock()
+
+
+def generator_table(window=8, cache_dir=None):
+    """Return the table for the curve's generator, building it on first
+    use.
+
+    Building takes a fraction of a second. If ``cache_dir`` is given
+    (you could pass :data:`ripple.serialize.CACHE_DIR`), the table is
+    stored there and loaded by the next process.
+    """
+    global _generator_table
+    table = _generator_table
+    if table is not None and table.window == window:
+        return table
+
+    with _generator_table_lock:
+        table = _generator_table
+        if table is not None and table.window == window:
+            return table
+
+        table = cache_file = None
+        if cache_dir:
+            cache_file = os.path.join(cache_dir, 'secp256k1-w%d-%d-%d.pickle' % (
+                window, TABLE_CACHE_VERSION, sys.version_info[0]))
+            try:
+                with open(cache_file, 'rb') as f:
+                    table = FixedBaseTable(G, window, pickle.load(f))
+                if not table.is_valid():
+                    table = None
+            except Exception:
+                # Missing, or broken; in any case, we'll write a new one.
+                table = None
+
+        if table is None:
+            table = FixedBaseTable(G, window)
+            if cache_file:
+                write_cache_file(cache_file, table.rows)
+
+        _generator_table = table
+        return table
+
+
+def generator_multiply(k):
+    """Return ``k * G`` in affine coordinates."""
+    return generator_table().multiply(k)
+
+
+def generator_multiply_jacobian(k):
+    """Return ``k * G`` in Jacobian coordinates."""
+    return generator_table().multiply_jacobian(k)
+
+
+class Test:
+
+    def test_generator_multiply(self):
+        generator = curves.SECP256k1.generator
+        for k in (1, 2, 3, 255, 256, 2**128 + 1, N - 1,
+                  0x902981cd5e0c862c53dc4854b6da4cc04179a2a524912d79800ac4c95435564d):
+            point = generator * k
+            assert generator_multiply(k) == (point.x(), point.y())
+        assert generator_multiply(0) is None
+        assert generator_multiply(N) is None
+
+    def test_small_window(self):
+        table = FixedBaseTable(G, window=4)
+        assert table.is_valid()
+        point = curves.SECP256k1.generator * 123456789
+        assert table.multiply(123456789) == (point.x(), point.y())
+        assert to_affine(*multiply_slow(G, 123456789)) == (point.x(), point.y())
+
+    def test_multiply_windowed(self):
+        multiples = point_multiples(G)
+        for k in (1, 15, 16, 17, 123456789, N - 1):
+            assert to_affine(*multiply_windowed(multiples, k)) == \
+                to_affine(*multiply_slow(G, k))
+
+    def test_batch_to_affine(self):
+        points = [multiply_slow(G, k) for k in (1, 5, 17)]
+        assert batch_to_affine(points) == [to_affine(*p) for p in points]
+
+    def test_cache(self, tmpdir):
+        global _generator_table
+        old = _generator_table
+        try:
+            _generator_table = None
+            table = generator_table(window=4, cache_dir=str(tmpdir))
+            assert len(tmpdir.listdir()) == 1
+
+            _generator_table = None
+            loaded = generator_table(window=4, cache_dir=str(tmpdir))
+            assert loaded is not table
+            assert loaded.rows == table.rows
+
+            # A broken cache file is ignored
+            tmpdir.listdir()[0].write_binary(b'garbage')
+            _generator_table = None
+            assert generator_table(window=4, cache_dir=str(tmpdir)).rows == table.rows
+        finally:
+            _generator_table = old
@@ -1,244 +1,396 @@
-from binascii import hexlify
+from collections import OrderedDict
 from io import BytesIO
 from decimal import Decimal
 from hashlib import sha256
+import hashlib
+import json
+import os
+import pickle
+import pkgutil
+import re
+import struct
+import sys
+import threading
 import types
 import six
-from six.moves import filter
 from six.moves import map
 from six.moves import zip
 import binascii
 
 
-__all__ = ('serialize_object',)
+__all__ = ('serialize_object', 'serialize_into', 'serialize_many',
+           'serialize_to', 'deserialize_object')
 
 
 ##############################################################################
-# The following are copied close to verbatim from the ripple-lib JavaScript
-# source code. We possible could define the types in a simpler way in Python,
-# but I want to make it easy to update these structures as the JS lib changes.
-
-
-# From ripple-lib:binformat.js:exports.ledger
-LEDGER_ENTRY_TYPES = {
-    'AccountRoot': [97],
-    'Contract': [99],
-    'DirectoryNode': [100],
-    'Features': [102],
-    'GeneratorMap': [103],
-    'LedgerHashes': [104],
-    'Nickname': [110],
-    'Offer': [111],
-    'RippleState': [114],
-    'FeeSettings': [115]
-}
+# The protocol tables: which fields exist, their types and codes, and
+# so on. These are compiled from a rippled-style ``definitions.json``, by
+# default the one that ships with this package; see load_definitions()
+# at the end of this module, which fills them in.
+#
+# They are always updated in place, so it is safe to import them.
 
 
-# From ripple-lib:binformat.js:exports.ter
-TRANSACTION_RESULT_VALUES = {
-    'tesSUCCESS': 0,
-    'tecCLAIM': 100,
-    'tecPATH_PARTIAL': 101,
-    'tecUNFUNDED_ADD': 102,
-    'tecUNFUNDED_OFFER': 103,
-    'tecUNFUNDED_PAYMENT': 104,
-    'tecFAILED_PROCESSING': 105,
-    'tecDIR_FULL': 121,
-    'tecINSUF_RESERVE_LINE': 122,
-    'tecINSUF_RESERVE_OFFER': 123,
-    'tecNO_DST': 124,
-    'tecNO_DST_INSUF_XRP': 125,
-    'tecNO_LINE_INSUF_RESERVE': 126,
-    'tecNO_LINE_REDUNDANT': 127,
-    'tecPATH_DRY': 128,
-    'tecUNFUNDED': 129,
-    'tecMASTER_DISABLED': 130,
-    'tecNO_REGULAR_KEY': 131,
-    'tecOWNERS': 132
-}
+# Name -> [code]
+LEDGER_ENTRY_TYPES = {}
 
+# Name -> code
+TRANSACTION_RESULT_VALUES = {}
 
-# From ripple-lib:binformat.js:exports.tx, manually constructed
-TRANSACTION_TYPES = {
-    'AccountSet': 3,
-    'TrustSet': 20,
-    'OfferCreate': 7,
-    'OfferCancel': 8,
-    'SetRegularKey': 5,
-    'Payment': 0,
-    'Contract': 9,
-    'RemoveContract': 10,
-    'EnableFeature': 100,
-    'SetFee': 101
-}
+# Name -> code
+TRANSACTION_TYPES = {}
 
+# Defines the types the binary format supports, by type code, as the
+# name of the respective TypeSerializers/TypeDeserializers function.
+TYPES_MAP = []
 
-# From ripple-lib:serializedtypes.js
-# Defines the types the binary format supports and the bits
-# representing those types.
-TYPES_MAP = [
-    None,
-
-    # Common:
-    'STInt16',    # 1
-    'STInt32',    # 2
-    'STInt64',    # 3
-    'STHash128',  # 4
-    'STHash256',  # 5
-    'STAmount',   # 6
-    'STVL',       # 7
-    'STAccount',  # 8
-
-    # 9-13 reserved
-    None,    # 9
-    None,    # 10
-    None,    # 11
-    None,    # 12
-    None,    # 13
-
-    'STObject',   # 14
-    'STArray',    # 15
-
-    # 'Uncommon':
-    'STInt8',     # 16
-    'STHash160',  # 17
-    'STPathSet',  # 18
-    'STVector256' # 19
-]
-
-
-# From ripple-lib:serializedtypes.js
-FIELDS_MAP = {
-    # Common types
-    1: {# Int16
-        1: 'LedgerEntryType',
-        2: 'TransactionType'
-    },
-    2: {# Int32
-        2: 'Flags', 3: 'SourceTag', 4: 'Sequence', 5: 'PreviousTxnLgrSeq',
-        6: 'LedgerSequence',
-        7: 'CloseTime', 8: 'ParentCloseTime', 9: 'SigningTime',
-        10: 'Expiration', 11: 'TransferRate',
-        12: 'WalletSize', 13: 'OwnerCount', 14: 'DestinationTag',
-        # Skip 15
-        16: 'HighQualityIn', 17: 'HighQualityOut', 18: 'LowQualityIn',
-        19: 'LowQualityOut',
-        20: 'QualityIn', 21: 'QualityOut', 22: 'StampEscrow', 23: 'BondAmount',
-        24: 'LoadFee',
-        25: 'OfferSequence', 26: 'FirstLedgerSequence',
-        27: 'LastLedgerSequence', 28: 'TransactionIndex',
-        29: 'OperationLimit', 30: 'ReferenceFeeUnits', 31: 'ReserveBase',
-        32: 'ReserveIncrement',
-        33: 'SetFlag', 34: 'ClearFlag',
-    },
-    3: {#  Int64
-        1: 'IndexNext', 2: 'IndexPrevious', 3: 'BookNode', 4: 'OwnerNode',
-        5: 'BaseFee', 6: 'ExchangeRate', 7: 'LowNode', 8: 'HighNode'
-    },
-    4: {# Hash128
-        1: 'EmailHash'
-    },
-    5: {# Hash256
-        1: 'LedgerHash', 2: 'ParentHash', 3: 'TransactionHash',
-        4: 'AccountHash', 5: 'PreviousTxnID',
-        6: 'LedgerIndex', 7: 'WalletLocator', 8: 'RootIndex',
-        16: 'BookDirectory', 17: 'InvoiceID',
-        18: 'Nickname', 19: 'Feature'
-    },
-    6: {# Amount
-        1: 'Amount', 2: 'Balance', 3: 'LimitAmount', 4: 'TakerPays',
-        5: 'TakerGets', 6: 'LowLimit',
-        7: 'HighLimit', 8: 'Fee', 9: 'SendMax', 16: 'MinimumOffer',
-        17: 'RippleEscrow'
-    },
-    7: {# VL
-        1: 'PublicKey', 2: 'MessageKey', 3: 'SigningPubKey', 4: 'TxnSignature',
-        5: 'Generator',
-        6: 'Signature', 7: 'Domain', 8: 'FundCode', 9: 'RemoveCode',
-        10: 'ExpireCode', 11: 'CreateCode'
-    },
-    8: {# Account
-        1: 'Account', 2: 'Owner', 3: 'Destination', 4: 'Issuer', 7: 'Target',
-        8: 'RegularKey'
-    },
-    14: {# Object
-         1: None,  # end of Object
-         2: 'TransactionMetaData', 3: 'CreatedNode', 4: 'DeletedNode',
-         5: 'ModifiedNode',
-         6: 'PreviousFields', 7: 'FinalFields', 8: 'NewFields',
-         9: 'TemplateEntry',
-    },
-    15: {# Array
-         1: None, # end of Array
-         2: 'SigningAccounts', 3: 'TxnSignatures', 4: 'Signatures',
-         5: 'Template',
-         6: 'Necessary', 7: 'Sufficient', 8: 'AffectedNodes',
-    },
-
-    # Uncommon types
-    16: {# Int8
-         1: 'CloseResolution', 2: 'TemplateEntryType', 3: 'TransactionResult'
-    },
-    17: {# Hash160
-         1: 'TakerPaysCurrency', 2: 'TakerPaysIssuer', 3: 'TakerGetsCurrency',
-         4: 'TakerGetsIssuer'
-    },
-    18: {# PathSet
-         1: 'Paths'
-    },
-    19: {# Vector256
-         1: 'Indexes', 2: 'Hashes', 3: 'Features'
-    }
-}
+# Type code -> {field code -> field name}
+FIELDS_MAP = {}
 
+# Field name -> [type code, field code]
+INVERSE_FIELDS_MAP = {}
 
-INVERSE_FIELDS_MAP = {
-    field_name : [type_bit, field_bit]
-    for type_bit, fields in FIELDS_MAP.items()
-    for field_bit, field_name in fields.items()
-}
+# Used by the deserializer to turn the integer codes back into names.
+INVERSE_LEDGER_ENTRY_TYPES = {}
+INVERSE_TRANSACTION_TYPES = {}
+INVERSE_TRANSACTION_RESULT_VALUES = {}
+
+# Field name -> the header bytes that precede its value.
+FIELD_HEADERS = {}
+
+# Field name -> the key that fields are sorted by.
+FIELD_ORDINALS = {}
+
+# Fields which are not included in the data that is signed.
+NON_SIGNING_FIELDS = set()
+
+# Fields whose value may be given by name rather than by numeric code.
+FIELD_VALUE_NAMES = {}
+
+# Type code -> encoder and decoder functions.
+TYPE_ENCODERS = []
+TYPE_DECODERS = []
 
 
 def serialize_object(obj, hex=True):
     """This is your main entry point to serialize something."""
-    stream = BytesIO()
-    TypeSerializers.STObject(stream, obj, no_marker=True)
-    stream.seek(0)
-    bytes = stream.getvalue()
+    buf = bytearray()
+    serialize_into(buf, obj)
     if hex:
-        return fmt_hex(bytes)
-    return bytes
+        return fmt_hex(buf)
+    return bytes(buf)
+
+
+def serialize_into(buf, obj, offset=0):
+    """Serialize ``obj`` into ``buf``, starting at ``offset``, and
+    return the offset where the data written ends.
+
+    ``buf`` may be a ``bytearray``, which will grow as needed, or a
+    ``memoryview`` (which raises a ``ValueError`` if it is too small).
+    This lets you reuse the same buffer for many objects::
+
+        buf = bytearray()
+        end = serialize_into(buf, tx)
+        blob = memoryview(buf)[:end]
+    """
+    stream = BufferWriter(buf, offset)
+    if isinstance(obj, SerializedTransaction):
+        stream.write(obj.to_bytes())
+    else:
+        TypeSerializers.STObject(stream, obj, no_marker=True)
+    return stream.tell()
+
+
+def serialize_to(stream, obj, signing=False):
+    """Serialize ``obj`` into ``stream``, which can be anything with a
+    ``write()`` method, or a ``hashlib`` object.
+
+    Writing to a hash object directly means the binary representation
+    is never held in memory as a whole. If ``signing`` is set, fields
+    that are not signed are left out.
+    """
+    if not hasattr(stream, 'write'):
+        stream = HashWriter(stream)
+    if isinstance(obj, SerializedTransaction):
+        stream.write(obj.to_bytes(signing=signing))
+    elif signing:
+        write = stream.write
+        for name, header, encode in object_plan(obj):
+            if name not in NON_SIGNING_FIELDS:
+                write(header)
+                encode(stream, obj[name])
+    else:
+        TypeSerializers.STObject(stream, obj, no_marker=True)
+
+
+class HashWriter(object):
+    """A stream that feeds everything written to it into one or more
+    ``hashlib`` objects.
+    """
+
+    def __init__(self, *hashes):
+        self.hashes = hashes
+        if len(hashes) == 1:
+            self.write = hashes[0].update
+
+    def write(self, data):
+        for hash in self.hashes:
+            hash.update(data)
+
+
+def serialize_many(objs, buf=None):
+    """Serialize all of ``objs`` back-to-back into a single buffer.
+
+    Returns a 2-tuple ``(buf, offsets)``, with ``offsets`` holding the
+    start of each object plus the end of the last one, such that the
+    i-th object is ``buf[offsets[i]:offsets[i+1]]``.
+
+    ``buf`` can be given to reuse a bytearray; it will be truncated.
+    """
+    if buf is None:
+        buf = bytearray()
+    else:
+        del buf[:]
+    stream = BufferWriter(buf)
+    offsets = [0]
+    for obj in objs:
+        if isinstance(obj, SerializedTransaction):
+            stream.write(obj.to_bytes())
+        else:
+            TypeSerializers.STObject(stream, obj, no_marker=True)
+        offsets.append(stream.tell())
+    return buf, offsets
+
+
+class BufferWriter(object):
+    """A stream that writes into a ``bytearray`` or ``memoryview``,
+    beginning at ``offset``.
+
+    This is what the type serializers write to; all they need is a
+    ``write()`` method.
+    """
+
+    def __init__(self, buf, offset=0):
+        if offset > len(buf):
+            raise ValueError('offset %d is outside of the buffer' % offset)
+        self.buf = buf
+        self.pos = offset
+        if isinstance(buf, bytearray) and offset == len(buf):
+            # We are appending to the end; let the bytearray do the
+            # bookkeeping, it's quite a bit faster.
+            self.write = buf.extend
+
+    def write(self, data):
+        end = self.pos + len(data)
+        try:
+            self.buf[self.pos:end] = data
+        except ValueError:
+            # A memoryview can't be resized
+            raise ValueError('buffer too small, needs at least %d bytes' % end)
+        self.pos = end
+
+    def tell(self):
+        if 'write' in self.__dict__:
+            return len(self.buf)
+        return self.pos
 
 
 def serialize_field(stream, name, value):
     """Binary encode field ``name`` with ``value``, append to ``stream``.
     """
-    type_bits, field_bits = INVERSE_FIELDS_MAP[name]
+    stream.write(FIELD_HEADERS[name])
+    field_encoder(name)(stream, value)
+
+
+def field_header(type_bits, field_bits):
+    """Return the tag byte(s) that precede a field in the binary format.
+    """
     tag_byte = (type_bits << 4 if type_bits < 16 else 0) | \
                (field_bits if field_bits < 16 else 0)
+    header = bytearray([tag_byte])
+    if type_bits >= 16:
+        header.append(type_bits)
+    if field_bits >= 16:
+        header.append(field_bits)
+    return bytes(header)
 
-    if name == 'LedgerEntryType' and isinstance(value, six.string_types):
-        value = LEDGER_ENTRY_TYPES[value][0]
-
-    if name == 'TransactionType' and isinstance(value, six.string_types):
-        value = TRANSACTION_TYPES[value]
 
-    if name == 'TransactionResult' and isinstance(value, six.string_types):
-        value = TRANSACTION_RESULT_VALUES[value]
+_field_encoders = {}
 
-    if hasattr(value, '__json__'):
-        # This indicates it's from our datastructures module, and we
-        # need to save the raw value it represents (ex: Amount object).
-        value = value.__json__()
+def field_encoder(name):
+    """Return a function ``(stream, value)`` that writes the value of
+    field ``name``, without the header.
 
-    TypeSerializers.STInt8(stream, tag_byte)
-    if type_bits >= 16:
-        TypeSerializers.STInt8(stream, type_bits)
-    if field_bits >= 16:
-        TypeSerializers.STInt8(stream, field_bits)
+    The type lookup and the special casing of certain fields is done
+    once here, rather than for every value serialized.
+    """
+    try:
+        return _field_encoders[name]
+    except KeyError:
+        pass
+
+    type_bits, _ = INVERSE_FIELDS_MAP[name]
+    encode = TYPE_ENCODERS[type_bits]
+    value_names = FIELD_VALUE_NAMES.get(name)
+
+    def func(stream, value):
+        if value_names is not None and \
+                isinstance(value, six.string_types):
+            value = value_names[value]
+        if hasattr(value, '__json__'):
+            # This indicates it's from our datastructures module, and we
+            # need to save the raw value it represents (ex: Amount object).
+            value = value.__json__()
+        encode(stream, value)
+
+    _field_encoders[name] = func
+    return func
+
+
+# There are only so many shapes of objects; if we ever hold this many,
+# something is generating arbitrary keys, and we start over.
+MAX_OBJECT_PLANS = 1024
+_object_plans = {}
+
+def object_plan(keys):
+    """Return the serialization plan for an object with the given keys.
+
+    The plan is a tuple of ``(name, header, encoder)``, in the order the
+    fields need to be written, with lower case (non-serializable) names
+    removed. Plans are cached by the set of keys, so objects of the same
+    shape, say a series of Payments, do not need to sort their keys or
+    look up their field types again.
+    """
+    cache_key = frozenset(keys)
+    try:
+        return _object_plans[cache_key]
+    except KeyError:
+        pass
+
+    # Ignore lower case field names - non-serializable by convention
+    names = sort_fields([k for k in cache_key if not k.islower()])
+    plan = tuple(
+        (name, FIELD_HEADERS[name], field_encoder(name)) for name in names)
+
+    if len(_object_plans) >= MAX_OBJECT_PLANS:
+        _object_plans.clear()
+    _object_plans[cache_key] = plan
+    return plan
+
+
+class SerializedTransaction(dict):
+    """A transaction dict that keeps the binary encoding of each of
+    its fields around.
+
+    When a field is replaced, only that one field is encoded again,
+    so re-signing a transaction with a new ``Sequence``, ``Fee`` or
+    ``LastLedgerSequence`` does not need to serialize the rest of it::
+
+        tx = SerializedTransaction(tx_json)
+        sign_transaction(tx, secret)
+        tx['Sequence'] += 1
+        sign_transaction(tx, secret)
+        blob = tx.to_bytes()
+
+    The blobs are cached until the next change. Note that values need
+    to be replaced, not modified in place, for the change to be seen.
+    """
 
-    type_name = TYPES_MAP[type_bits]
-    getattr(TypeSerializers, type_name)(stream, value)
+    def __init__(self, *a, **kw):
+        dict.__init__(self, *a, **kw)
+        self._segments = {}
+        self._names = None
+        self._blobs = {}
+        for name, value in self.items():
+            self._encode(name, value)
+
+    def _encode(self, name, value):
+        self._blobs.clear()
+        if name.islower():
+            # Non-serializable by convention
+            return
+        buf = bytearray(FIELD_HEADERS[name])
+        field_encoder(name)(BufferWriter(buf, len(buf)), value)
+        self._segments[name] = bytes(buf)
+
+    def _forget(self, name):
+        self._blobs.clear()
+        self._segments.pop(name, None)
+        self._names = None
+
+    def __setitem__(self, name, value):
+        # Encode first: a value that cannot be encoded must not be kept
+        # next to the segment of the old one.
+        self._encode(name, value)
+        if name not in self:
+            self._names = None
+        dict.__setitem__(self, name, value)
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        self._forget(name)
+
+    def update(self, *a, **kw):
+        for name, value in dict(*a, **kw).items():
+            self[name] = value
+
+    def setdefault(self, name, value=None):
+        if name not in self:
+            self[name] = value
+        return self[name]
+
+    def pop(self, name, *default):
+        if name not in self:
+            return dict.pop(self, name, *default)
+        value = dict.pop(self, name)
+        self._forget(name)
+        return value
+
+    def popitem(self):
+        name, value = dict.popitem(self)
+        self._forget(name)
+        return name, value
+
+    def clear(self):
+        dict.clear(self)
+        self._segments.clear()
+        self._blobs.clear()
+        self._names = None
+
+    def copy(self):
+        copy = SerializedTransaction.__new__(SerializedTransaction)
+        dict.__init__(copy, self)
+        copy._segments = self._segments.copy()
+        copy._names = self._names
+        copy._blobs = self._blobs.copy()
+        return copy
+
+    def __reduce__(self):
+        # Pickling a dict subclass would fill in the items before
+        # __init__() has set up the caches; encode them again instead.
+        return SerializedTransaction, (dict(self),)
+
+    def to_bytes(self, signing=False):
+        """Return the binary representation of the transaction.
+
+        If ``signing`` is set, fields that are not signed (i.e. the
+        ``TxnSignature``) are left out.
+        """
+        try:
+            return self._blobs[signing]
+        except KeyError:
+            pass
+
+        if self._names is None:
+            self._names = [name for name, _, _ in object_plan(self)]
+        segments = self._segments
+        if signing:
+            blob = b''.join([segments[name] for name in self._names
+                             if name not in NON_SIGNING_FIELDS])
+        else:
+            blob = b''.join([segments[name] for name in self._names])
+        self._blobs[signing] = blob
+        return blob
 
 
 def serialize_hex(stream, hexstring):
@@ -255,11 +407,28 @@ def serialize_bytes(stream, bytes):
     stream.write(bytes)
 
 
+def hex_or_bytes(value):
+    """Hashes and other binary values are given to us hex-encoded,
+    but callers holding the raw bytes can pass those as well.
+    """
+    if isinstance(value, (bytearray, memoryview)) or \
+            (six.PY3 and isinstance(value, bytes)):
+        return value
+    return decode_hex(value)
+
+
+def fixed_length(value, num_bytes):
+    """Like :func:`hex_or_bytes`, but validates the length."""
+    data = hex_or_bytes(value)
+    if len(data) != num_bytes:
+        raise ValueError('expected %d bytes, got %d' % (num_bytes, len(data)))
+    return data
+
+
 def UInt160(value):
     # In ripple-lib, UInt160 is an address. We simply use a string.
     # This helper is the equivalent of UInt160.to_bytes().
-    bytes = RippleBaseDecoder.decode(value, 25) # = 20 bytes w/o header??
-    return bytes
+    return decode_account_id(value)
 
 
 def serialize_varint(stream, val):
@@ -276,14 +445,14 @@ def serialize_varint(stream, val):
     assert val >= 0
 
     bytes = bytearray()
-    if val < 192:
+    if val <= 192:
         bytes.append(val)
     elif val <= 12480:
         val -= 193
-        bytes.append([193 + rshift(val,  8), val & 0xff])
+        bytes.extend([193 + rshift(val,  8), val & 0xff])
     elif val <= 918744:
         val -= 12481
-        bytes.append([
+        bytes.extend([
             241 + rshift(val, 16),
             rshift(val, 8) & 0xff,
             val & 0xff
@@ -294,6 +463,9 @@ def serialize_varint(stream, val):
     stream.write(bytes)
 
 
+UINT64 = struct.Struct('>Q')
+
+
 class AllStatic(type):
     def __new__(cls, name, bases, attrs):
         for key, value in attrs.items():
@@ -307,66 +479,85 @@ class TypeSerializers:
 
     __metaclass__ = AllStatic
     def byte_writer(num_bytes):
+        pack = struct.Struct({1: '>B', 2: '>H', 4: '>I'}[num_bytes]).pack
         def func(stream, value):
-            stream.write(to_bytes(int(value), num_bytes))
+            try:
+                stream.write(pack(int(value)))
+            except struct.error:
+                raise ValueError(
+                    '%s does not fit into %d bytes' % (value, num_bytes))
         return func
 
     STInt8 = byte_writer(1)
     STInt16 = byte_writer(2)
     STInt32 = byte_writer(4)
 
+    def STInt64(stream, value):
+        # rippled gives these to us as a hex string
+        if isinstance(value, six.string_types):
+            value = int(value, 16)
+        elif not isinstance(value, six.integer_types):
+            stream.write(fixed_length(value, 8))
+            return
+        if not 0 <= value <= 0xffffffffffffffff:
+            raise ValueError('%s does not fit into 8 bytes' % value)
+        stream.write(UINT64.pack(value))
+
+    def hash_writer(num_bytes):
+        def func(stream, value):
+            stream.write(fixed_length(value, num_bytes))
+        return func
+
+    STHash128 = hash_writer(16)
+    STHash160 = hash_writer(20)
+    STHash256 = hash_writer(32)
+
+    def STVector256(stream, value):
+        # A list of 256 bit hashes, written as one variable length field
+        data = b''.join([fixed_length(h, 32) for h in value])
+        serialize_bytes(stream, data)
+
     def STAccount(stream, value):
         serialize_bytes(stream, UInt160(value))
 
     def STAmount(stream, amount):
         if isinstance(amount, dict):
             # non-XRP
-            hi = 0
-
-            # First bit: non-native
-            hi |= 1 << 31
-
-            negative, value, offset = parse_non_native_amount(amount['value'])
-            if not value == 0:
-                # Second bit: non-negative?
-                if not negative:
-                    hi |= 1 << 30
-                # Next eight bits: offset/exponent
-                hi |= ((97 + offset) & 0xff) << 22
-
-            # Remaining 52 bits: mantissa
-            # Merge the manually constructed high-bits into the value
-            value = value | (hi<<32)
+            value = amount['value']
+            if not isinstance(value, six.string_types):
+                value = '%s' % value
+            bits = _amount_cache.get(value)
+            if bits is None:
+                bits = UINT64.pack(non_native_amount_bits(value))
+                _amount_cache[value] = bits
 
             # Write Amount
-            stream.write(to_bytes(value, 8))
+            stream.write(bits)
             # Write Currency
             TypeSerializers.STCurrency(stream, amount['currency'])
             # Write Issuer
-            stream.write(
-                RippleBaseDecoder.decode(amount['issuer'], 25))
+            stream.write(UInt160(amount['issuer']))
         else:
             # XRP - only support int notation for now, not floats.
             amount = int(amount)
 
-            # Make a 64 bit hex string
-            amount_hex = '%x' % abs(amount)
-            assert len(amount_hex) <= 16
-            amount_hex = amount_hex.zfill(16)
-
-            amount_bytes = bytearray(decode_hex(amount_hex))
-
-            # Clear first bit to indicate XRP
-            amount_bytes[0] &= 0x3f
-            # Clear second bit to indicate negative
+            # First bit clear to indicate XRP, second bit set unless
+            # negative, then 62 bits for the drops.
+            drops = abs(amount)
+            if drops > 0x3fffffffffffffff:
+                raise ValueError('XRP amount out of range: %s' % amount)
             if amount >= 0:
-                amount_bytes[0] |= 0x40
-
-            stream.write(amount_bytes)
+                drops |= 1 << 62
+            stream.write(UINT64.pack(drops))
 
     def STCurrency(stream, value):
         # https://ripple.com/wiki/Currency_Format
         value = value.upper()
+        if len(value) == 40:
+            # A non-standard currency code, given as 160 bits of hex,
+            # which is how the deserializer returns them as well.
+            stream.write(decode_hex(value))
+            return
         assert len(value) == 3 and value.isalnum()
 
         if value == 'XRP':
@@ -421,52 +612,351 @@ class TypeSerializers:
 
     def STVL(stream, value):
         # A variable length string, hex-encoded
-        serialize_hex(stream, value)
+        serialize_bytes(stream, hex_or_bytes(value))
 
     def STObject(stream, value, no_marker=False):
-        # Ignore lower case field names - non-serializable by convention
-        keys = filter(lambda k: not k.islower(), value.keys())
-
-        # Keys need to be sorted
-        keys = sort_fields(list(keys))
-
-        for key in keys:
-            serialize_field(stream, key, value[key])
+        write = stream.write
+        for name, header, encode in object_plan(value):
+            write(header)
+            encode(stream, value[name])
         if not no_marker:
             TypeSerializers.STInt8(stream, 0xe1)  # Object ending marker
 
+    def STArray(stream, value):
+        # Each element is an object wrapped in a field, like
+        # {"CreatedNode": {...}}
+        for element in value:
+            if len(element) != 1:
+                raise ValueError(
+                    'array elements need to have exactly one key: %s' % element)
+            for name, obj in element.items():
+                serialize_field(stream, name, obj)
+        TypeSerializers.STInt8(stream, 0xf1)  # Array ending marker
+
 
 def sort_fields(keys):
-    def sort_key(a):
-        type_bits, field_bits = INVERSE_FIELDS_MAP[a]
-        return type_bits, field_bits
     keys = keys[:]
-    keys.sort(key=sort_key)
+    keys.sort(key=FIELD_ORDINALS.__getitem__)
     return keys
 
 
+def deserialize_object(data):
+    """The reverse of :func:`serialize_object`.
+
+    ``data`` is a binary blob as rippled gives it to you when asked for
+    ``binary: true``: a ``tx_blob``, the binary ``meta`` or a ledger
+    entry. It may be given as bytes, or a memoryview of some buffer; a
+    hex string is accepted as well. Returns the same dict structure
+    that the server would give you in JSON mode.
+    """
+    if isinstance(data, six.text_type):
+        data = decode_hex(data)
+    return TypeDeserializers.STObject(BinaryParser(data), no_marker=True)
+
+
+class BinaryParser(object):
+    """Reads the binary format from a buffer.
+
+    Works on a memoryview of the data given, which means slicing out
+    the individual values does not copy anything.
+
+    In ripple-lib, this is ``binary/binary-parser.js``.
+    """
+
+    def __init__(self, data):
+        self.view = memoryview(data)
+        self.pos = 0
+        self.length = len(self.view)
+
+    def end(self):
+        return self.pos >= self.length
+
+    def read(self, num_bytes):
+        start = self.pos
+        end = start + num_bytes
+        if end > self.length:
+            raise ValueError('unexpected end of data at byte %d' % start)
+        self.pos = end
+        return self.view[start:end]
+
+    def read_struct(self, fmt):
+        if self.pos + fmt.size > self.length:
+            raise ValueError('unexpected end of data at byte %d' % self.pos)
+        value, = fmt.unpack_from(self.view, self.pos)
+        self.pos += fmt.size
+        return value
+
+    def read_uint8(self):
+        if self.pos >= self.length:
+            raise ValueError('unexpected end of data at byte %d' % self.pos)
+        value = six.indexbytes(self.view, self.pos)
+        self.pos += 1
+        return value
+
+    def read_varint(self):
+        """The reverse of :func:`serialize_varint`."""
+        b1 = self.read_uint8()
+        if b1 <= 192:
+            return b1
+        elif b1 <= 240:
+            b2 = self.read_uint8()
+            return 193 + (b1 - 193) * 256 + b2
+        elif b1 <= 254:
+            b2 = self.read_uint8()
+            b3 = self.read_uint8()
+            return 12481 + (b1 - 241) * 65536 + b2 * 256 + b3
+        raise ValueError('Invalid variable length indicator.')
+
+    def read_vl(self):
+        return self.read(self.read_varint())
+
+    def read_field_header(self):
+        """Returns a ``(type_bits, field_bits)`` tuple, the reverse
+        of the tag byte(s) written by :func:`serialize_field`.
+        """
+        tag_byte = self.read_uint8()
+        type_bits = tag_byte >> 4
+        field_bits = tag_byte & 0x0f
+        if type_bits == 0:
+            type_bits = self.read_uint8()
+        if field_bits == 0:
+            field_bits = self.read_uint8()
+        return type_bits, field_bits
+
+
+def deserialize_field(parser):
+    """Read the next field from ``parser``, return a (name, value) tuple.
+    """
+    type_bits, field_bits = parser.read_field_header()
+    try:
+        name = FIELDS_MAP[type_bits][field_bits]
+        decode = TYPE_DECODERS[type_bits]
+    except (KeyError, IndexError):
+        name = decode = None
+    if not name or not decode:
+        raise ValueError('unknown field (type %d, field %d) at byte %d' % (
+            type_bits, field_bits, parser.pos))
+
+    value = decode(parser)
+
+    # The reverse of the special cases in serialize_field()
+    if name == 'LedgerEntryType':
+        value = INVERSE_LEDGER_ENTRY_TYPES.get(value, value)
+    elif name == 'TransactionType':
+        value = INVERSE_TRANSACTION_TYPES.get(value, value)
+    elif name == 'TransactionResult':
+        value = INVERSE_TRANSACTION_RESULT_VALUES.get(value, value)
+
+    return name, value
+
+
+# Markers which end an STObject or STArray, as (type_bits, field_bits).
+OBJECT_END_MARKER = (14, 1)
+ARRAY_END_MARKER = (15, 1)
+
+
+class TypeDeserializers:
+    # The reverse of TypeSerializers. Each of these reads a value
+    # from a BinaryParser.
+
+    __metaclass__ = AllStatic
+
+    def struct_reader(fmt):
+        fmt = struct.Struct(fmt)
+        def func(parser):
+            return parser.read_struct(fmt)
+        return func
+
+    STInt8 = struct_reader('>B')
+    STInt16 = struct_reader('>H')
+    STInt32 = struct_reader('>I')
+
+    def STInt64(parser):
+        # rippled represents these as a hex string in JSON
+        return fmt_hex(parser.read(8))
+
+    def hash_reader(num_bytes):
+        def func(parser):
+            return fmt_hex(parser.read(num_bytes))
+        return func
+
+    STHash128 = hash_reader(16)
+    STHash160 = hash_reader(20)
+    STHash256 = hash_reader(32)
+
+    def STAccount(parser):
+        return encode_account_id(bytes(parser.read_vl()))
+
+    def STAmount(parser):
+        value = parser.read_struct(UINT64)
+        if not value & (1 << 63):
+            # XRP: Second bit indicates positive, 62 bits of drops
+            drops = value & 0x3fffffffffffffff
+            if not value & (1 << 62):
+                drops = -drops
+            return '%d' % drops
+
+        # Non-XRP: 8 bits exponent, 54 bits mantissa
+        mantissa = value & 0x3fffffffffffff
+        if mantissa == 0:
+            amount = '0'
+        else:
+            offset = ((value >> 54) & 0xff) - 97
+            negative = not value & (1 << 62)
+            amount = format_non_native_amount(negative, mantissa, offset)
+        return {
+            'value': amount,
+            'currency': TypeDeserializers.STCurrency(parser),
+            'issuer': encode_account_id(bytes(parser.read(20)))
+        }
+
+    def STCurrency(parser):
+        data = parser.read(20)
+        code = data[12:15]
+        if not any(six.iterbytes(data[:12])) and \
+                not any(six.iterbytes(data[15:])):
+            if not any(six.iterbytes(code)):
+                return 'XRP'
+            try:
+                return bytes(code).decode('ascii')
+            except UnicodeDecodeError:
+                # Not a code we can show as text; like a non-standard
+                # one, give all of it as hex.
+                pass
+        return fmt_hex(data)
+
+    def STPathSet(parser):
+        typeBoundary = 0xff
+        typeEnd = 0x00
+        typeAccount = 0x01
+        typeCurrency = 0x10
+        typeIssuer = 0x20
+
+        paths = []
+        path = []
+        while True:
+            type = parser.read_uint8()
+            if type == typeEnd or type == typeBoundary:
+                paths.append(path)
+                if type == typeEnd:
+                    break
+                path = []
+                continue
+
+            entry = {'type': type, 'type_hex': '%016X' % type}
+            if type & typeAccount:
+                entry['account'] = encode_account_id(bytes(parser.read(20)))
+            if type & typeCurrency:
+                entry['currency'] = TypeDeserializers.STCurrency(parser)
+            if type & typeIssuer:
+                entry['issuer'] = encode_account_id(bytes(parser.read(20)))
+            path.append(entry)
+        return paths
+
+    def STVector256(parser):
+        data = parser.read_vl()
+        return [fmt_hex(data[i:i+32]) for i in range(0, len(data), 32)]
+
+    def STVL(parser):
+        return fmt_hex(parser.read_vl())
+
+    def STObject(parser, no_marker=False):
+        obj = {}
+        while not (no_marker and parser.end()):
+            if not no_marker:
+                # Peek for the end marker
+                pos = parser.pos
+                if parser.read_field_header() == OBJECT_END_MARKER:
+                    break
+                parser.pos = pos
+            name, value = deserialize_field(parser)
+            obj[name] = value
+        return obj
+
+    def STArray(parser):
+        result = []
+        while True:
+            pos = parser.pos
+            if parser.read_field_header() == ARRAY_END_MARKER:
+                break
+            parser.pos = pos
+            # Each element is an object wrapped in a field, like
+            # {"CreatedNode": {...}}
+            name, value = deserialize_field(parser)
+            result.append({name: value})
+        return result
+
+
+# The mantissa of a non-native amount is normalized to 16 digits,
+# the exponent to -96..80.
+AMOUNT_MIN_MANTISSA = 10**15
+AMOUNT_MAX_MANTISSA = 10**16 - 1
+AMOUNT_MIN_OFFSET = -96
+AMOUNT_MAX_OFFSET = 80
+
+AMOUNT_RE = re.compile(r'^([-+]?)(\d*)(?:\.(\d*))?(?:[eE]([-+]?\d+))?$')
+
 def parse_non_native_amount(string):
     """Like ``Amount.parse_human()`` in ripple-lib, will parse the
     given value into an integer and exponent offset.
-    """
-    amount = Decimal(string)
-    # This will remove trailing zeros
-    amount = amount.normalize()
 
-    parts = amount.as_tuple()
-    offset = parts.exponent
+    Returns ``(sign, mantissa, offset)``, with ``sign`` being 1 for a
+    negative value. Digits beyond the 16 that fit into the mantissa
+    are truncated, like rippled does.
+    """
+    match = AMOUNT_RE.match(string.strip())
+    if not match or not (match.group(2) or match.group(3)):
+        raise ValueError('Not a valid amount: %r' % string)
+    sign_char, integer, fraction, exponent = match.groups()
+    sign = 1 if sign_char == '-' else 0
+
+    digits = (integer + (fraction or '')).lstrip('0')
+    if not digits:
+        # This is special cased
+        return sign, 0, -100
+    offset = int(exponent or 0) - len(fraction or '')
 
     # Shift everything such that '10' because '1000000....'
-    value = ''.join(map(str, parts.digits))
-    full_value = value.ljust(len('9999999999999999'), '0')
-    offset -= len(full_value) - len(value)
-    full_value = int(full_value)
+    num_digits = len(digits)
+    if num_digits <= 16:
+        mantissa = int(digits) * 10**(16 - num_digits)
+    else:
+        mantissa = int(digits[:16])
+    offset += num_digits - 16
+
+    if offset < AMOUNT_MIN_OFFSET:
+        # Too small to be represented, rippled makes this a zero.
+        return sign, 0, -100
+    if offset > AMOUNT_MAX_OFFSET:
+        raise ValueError('Amount out of range: %r' % string)
+    return sign, mantissa, offset
 
-    # This is special cased
-    if full_value == 0:
-        offset = -100
 
-    return parts.sign, full_value, offset
+def non_native_amount_bits(string):
+    """Return the 64 bit word representing the value of a non-native
+    amount.
+    """
+    negative, mantissa, offset = parse_non_native_amount(string)
+
+    # First bit: non-native
+    bits = 1 << 63
+    if mantissa:
+        # Second bit: non-negative?
+        if not negative:
+            bits |= 1 << 62
+        # Next eight bits: offset/exponent; remaining 54 bits: mantissa
+        bits |= (97 + offset) << 54 | mantissa
+    return bits
+
+
+def format_non_native_amount(negative, mantissa, offset):
+    """The reverse of :func:`parse_non_native_amount`, returns the
+    string notation of the value.
+    """
+    amount = Decimal(mantissa).scaleb(offset).normalize()
+    if negative:
+        amount = -amount
+    return '{0:f}'.format(amount)
 
 
 def to_bytes(number, length=None, endianess='big'):
@@ -482,6 +972,14 @@ def to_bytes(number, length=None, endianess='big'):
     Alternative implementation here:
        https://github.com/nederhoed/python-bitcoinaddress/blob/c3db56f0a2d4b2a069198e2db22b7f607158518c/bitcoinaddress/__init__.py#L26
     """
+    if six.PY3:
+        if not length:
+            length = max(1, (number.bit_length() + 7) // 8)
+        try:
+            return number.to_bytes(length, endianess)
+        except OverflowError:
+            raise ValueError('number of large for {} bytes'.format(length))
+
     h = '%x' % number
     s = ('0'*(len(h) % 2) + h)
     if length:
@@ -494,6 +992,8 @@ def to_bytes(number, length=None, endianess='big'):
 
 def from_bytes(bytes):
     """Reverse of to_bytes()."""
+    if six.PY3:
+        return int.from_bytes(bytes, 'big')
     # binascii works on all versions of Python, the hex encoding does not
     return int(binascii.hexlify(bytes), 16)
 
@@ -542,8 +1042,15 @@ class RippleBaseDecoder(object):
         """Decode a base encoded string with the Ripple alphabet."""
         n = 0
         base = len(cls.alphabet)
-        for char in encoded:
-            n = n * base + cls.alphabet.index(char)
+        index = cls.index
+        try:
+            for char in encoded:
+                digit = index[ord(char)]
+                if digit < 0:
+                    raise IndexError()
+                n = n * base + digit
+        except IndexError:
+            raise ValueError('Not a valid base58 string: %r' % encoded)
         return to_bytes(n, pad_length, 'big')
 
     @classmethod
@@ -569,7 +1076,7 @@ class RippleBaseDecoder(object):
     def encode_base(cls, data):
         # https://github.com/jgarzik/python-bitcoinlib/blob/master/bitcoin/base58.py
         # Convert big-endian bytes to integer
-        n = int(hexlify(data).decode('utf8'), 16)
+        n = from_bytes(data)
 
         # Divide that integer into base58
         res = []
@@ -589,6 +1096,298 @@ class RippleBaseDecoder(object):
         return cls.alphabet[0] * pad + res
 
 
+# Reverse lookup table for the alphabet, indexed by the ordinal of the
+# character, so decoding needs no search through the alphabet string.
+RippleBaseDecoder.index = [-1] * 256
+for i, char in enumerate(RippleBaseDecoder.alphabet):
+    RippleBaseDecoder.index[ord(char)] = i
+del i, char
+
+
+class LRUCache(object):
+    """A dict-like cache holding at most ``maxsize`` entries; when full,
+    the least recently used entry is evicted.
+
+    Threadsafe.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+# The same counterparties tend to show up again and again, so we keep
+# the results of the account address codec around.
+ACCOUNT_CACHE_SIZE = 4096
+_account_ids = LRUCache(ACCOUNT_CACHE_SIZE)
+_account_addresses = LRUCache(ACCOUNT_CACHE_SIZE)
+
+# The same amounts tend to be sent over and over, so we keep the
+# binary representation of the most recently used values.
+AMOUNT_CACHE_SIZE = 1024
+_amount_cache = LRUCache(AMOUNT_CACHE_SIZE)
+
+
+def decode_account_id(address):
+    """Decode a classic address like ``r3kmLJN5D28dH...`` to the
+    20 byte AccountID, verifying the checksum.
+
+    Raises a ``ValueError`` if the address is not valid.
+    """
+    account_id = _account_ids.get(address)
+    if account_id is not None:
+        return account_id
+
+    decoded = RippleBaseDecoder.decode_base(address, 25)
+    if len(decoded) != 25 or decoded[:1] != b'\x00' or \
+            not RippleBaseDecoder.verify_checksum(decoded):
+        raise ValueError('Not a valid account address: %r' % address)
+    account_id = decoded[1:21]
+
+    _account_ids[address] = account_id
+    _account_addresses[account_id] = address
+    return account_id
+
+
+def encode_account_id(account_id):
+    """Encode a 20 byte AccountID as a classic address; the reverse of
+    :func:`decode_account_id`.
+    """
+    address = _account_addresses.get(account_id)
+    if address is not None:
+        return address
+
+    address = RippleBaseDecoder.encode(account_id)
+
+    _account_addresses[account_id] = address
+    _account_ids[address] = account_id
+    return address
+
+
+##############################################################################
+# Loading the protocol definitions
+
+
+# rippled's names for the types, and the functions we (de)serialize them with.
+DEFINITION_TYPE_NAMES = {
+    'UInt8': 'STInt8',
+    'UInt16': 'STInt16',
+    'UInt32': 'STInt32',
+    'UInt64': 'STInt64',
+    'Hash128': 'STHash128',
+    'Hash160': 'STHash160',
+    'Hash256': 'STHash256',
+    'Amount': 'STAmount',
+    'Blob': 'STVL',
+    'AccountID': 'STAccount',
+    'STObject': 'STObject',
+    'STArray': 'STArray',
+    'PathSet': 'STPathSet',
+    'Vector256': 'STVector256',
+}
+
+
+# A place to cache compiled definitions (and other expensive to build
+# tables), if you want to. Nothing is cached unless asked for: the cache
+# files are pickles, so whoever can write the directory can run code in
+# the processes that read it. At import, the definitions are cached only
+# if the environment variable RIPPLE_PYTHON_CACHE_DIR names a directory.
+CACHE_DIR = os.environ.get('RIPPLE_PYTHON_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or
+    os.path.expanduser(os.path.join('~', '.cache')),
+    'ripple-python')
+
+# Change this when the format of compile_definitions() changes.
+DEFINITIONS_CACHE_VERSION = 1
+
+
+def load_definitions(filename=None, cache_dir=None):
+    """Load the protocol definitions (fields, types, transaction types
+    and so on) from a rippled-style ``definitions.json`` file.
+
+    By default, the file that ships with this package is used; this
+    happens when the module is imported. Call this with your own file
+    to track changes to the network before we get around to updating
+    ours.
+
+    If ``cache_dir`` is given (you could pass :data:`CACHE_DIR`), the
+    compiled tables are cached there, keyed by the contents of the
+    file, so startup does not need to repeat the work. Only use a
+    directory that no one else can write to.
+    """
+    if filename is None:
+        data = pkgutil.get_data('ripple', 'definitions.json')
+    else:
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+    compiled = cache_file = None
+    if cache_dir:
+        key = hashlib.sha1(data)
+        key.update(('%s:%s' % (
+            DEFINITIONS_CACHE_VERSION, sys.version_info[0])).encode('ascii'))
+        cache_file = os.path.join(
+            cache_dir, 'definitions-%s.pickle' % key.hexdigest())
+        try:
+            with open(cache_file, 'rb') as f:
+                compiled = pickle.load(f)
+        except Exception:
+            # Missing, or broken; in any case, we'll write a new one.
+            pass
+
+    if compiled is None:
+        compiled = compile_definitions(json.loads(data.decode('utf-8')))
+        if cache_file:
+            write_cache_file(cache_file, compiled)
+
+    install_definitions(compiled)
+
+
+def write_cache_file(cache_file, data):
+    # Write to a temporary file first, so that concurrent processes
+    # never see a partial cache file. Failure is not a problem, the
+    # caller will just have to build the data again next time.
+    temp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        with open(temp_file, 'wb') as f:
+            pickle.dump(data, f, 2)
+        os.rename(temp_file, cache_file)
+    except (IOError, OSError):
+        try:
+            os.unlink(temp_file)
+        except OSError:
+            pass
+
+
+def compile_definitions(definitions):
+    """Derive the lookup tables we need from a parsed
+    ``definitions.json``.
+
+    The result consists of builtin types only, such that it can be
+    pickled; :func:`install_definitions` then makes it active.
+    """
+    type_codes = definitions['TYPES']
+
+    types_map = [None] * (1 + max(
+        type_codes[name] for name in DEFINITION_TYPE_NAMES))
+    for name, code in type_codes.items():
+        if name in DEFINITION_TYPE_NAMES:
+            types_map[code] = DEFINITION_TYPE_NAMES[name]
+
+    fields_map = {}
+    inverse_fields_map = {}
+    field_headers = {}
+    field_ordinals = {}
+    non_signing_fields = []
+    for name, info in definitions['FIELDS']:
+        type_code = type_codes[info['type']]
+        field_code = info['nth']
+        if not info['isSerialized'] or \
+                not 0 <= type_code < len(types_map) or \
+                not types_map[type_code]:
+            continue
+        if (type_code, field_code) in (OBJECT_END_MARKER, ARRAY_END_MARKER):
+            # These are not fields you can set, they are handled by the
+            # STObject/STArray (de)serializers.
+            continue
+
+        fields_map.setdefault(type_code, {})[field_code] = name
+        inverse_fields_map[name] = [type_code, field_code]
+        field_headers[name] = field_header(type_code, field_code)
+        field_ordinals[name] = (type_code << 16) | field_code
+        if not info['isSigningField']:
+            non_signing_fields.append(name)
+
+    return {
+        'types_map': types_map,
+        'fields_map': fields_map,
+        'inverse_fields_map': inverse_fields_map,
+        'field_headers': field_headers,
+        'field_ordinals': field_ordinals,
+        'non_signing_fields': non_signing_fields,
+        'ledger_entry_types': {
+            name: [code] for name, code in
+            definitions['LEDGER_ENTRY_TYPES'].items() if code >= 0},
+        'transaction_types': {
+            name: code for name, code in
+            definitions['TRANSACTION_TYPES'].items() if code >= 0},
+        'transaction_results': dict(definitions['TRANSACTION_RESULTS']),
+    }
+
+
+def install_definitions(compiled):
+    """Make the definitions returned by :func:`compile_definitions`
+    the active ones.
+    """
+    def replace(table, new):
+        table.clear()
+        table.update(new)
+
+    TYPES_MAP[:] = compiled['types_map']
+    replace(FIELDS_MAP, compiled['fields_map'])
+    replace(INVERSE_FIELDS_MAP, compiled['inverse_fields_map'])
+    replace(FIELD_HEADERS, compiled['field_headers'])
+    replace(FIELD_ORDINALS, compiled['field_ordinals'])
+    replace(NON_SIGNING_FIELDS, compiled['non_signing_fields'])
+
+    replace(LEDGER_ENTRY_TYPES, compiled['ledger_entry_types'])
+    replace(TRANSACTION_TYPES, compiled['transaction_types'])
+    replace(TRANSACTION_RESULT_VALUES, compiled['transaction_results'])
+    replace(INVERSE_LEDGER_ENTRY_TYPES, {
+        codes[0]: name for name, codes in LEDGER_ENTRY_TYPES.items()})
+    replace(INVERSE_TRANSACTION_TYPES, {
+        code: name for name, code in TRANSACTION_TYPES.items()})
+    replace(INVERSE_TRANSACTION_RESULT_VALUES, {
+        code: name for name, code in TRANSACTION_RESULT_VALUES.items()})
+    replace(FIELD_VALUE_NAMES, {
+        'LedgerEntryType': {
+            name: codes[0] for name, codes in LEDGER_ENTRY_TYPES.items()},
+        'TransactionType': TRANSACTION_TYPES,
+        'TransactionResult': TRANSACTION_RESULT_VALUES,
+    })
+
+    TYPE_ENCODERS[:] = [
+        getattr(TypeSerializers, name) if name else None for name in TYPES_MAP]
+    TYPE_DECODERS[:] = [
+        getattr(TypeDeserializers, name) if name else None for name in TYPES_MAP]
+
+    # Anything derived from the old tables is no longer valid
+    _field_encoders.clear()
+    _object_plans.clear()
+
+
+load_definitions(cache_dir=os.environ.get('RIPPLE_PYTHON_CACHE_DIR') or None)
+
+
 def call_encoder(func, *a, **kw):
     """Test/debug helper to make the stream-based encoder API
     more accessible.
@@ -636,6 +1435,21 @@ class Test:
 
         # This is special cased
         assert p('0') == (0, 0, -100)
+        assert p('0.000') == (0, 0, -100)
+
+        assert p('1e3') == (0, 1000000000000000, -12)
+        assert p('-.5') == (1, 5000000000000000, -16)
+        assert p('1.2E-3') == (0, 1200000000000000, -18)
+        # Digits beyond 16 are truncated
+        assert p('12345678901234567890') == (0, 1234567890123456, 4)
+        # Underflow becomes zero
+        assert p('1e-200') == (0, 0, -100)
+
+        from pytest import raises
+        raises(ValueError, p, '1e200')
+        raises(ValueError, p, 'abc')
+        raises(ValueError, p, '.')
+        raises(ValueError, p, '1.2.3')
 
     def test_amount(self):
         from pytest import raises
@@ -647,6 +1461,9 @@ class Test:
         assert sa('1') == '4000000000000001'
         assert sa('-1') == '0000000000000001'
         raises(ValueError, sa, '1.1')  # we could support floats, but don't for now
+        assert sa('100000000000000000') == '416345785D8A0000'
+        assert sa(-100000000000000000) == '016345785D8A0000'
+        raises(ValueError, sa, 2**62)
 
         # Non-XRP
 
@@ -668,6 +1485,15 @@ class Test:
             'currency': 'USD'}) == \
                '80000000000000000000000000000000000000005553440000000000550FC62003E785DC231A1058A05E56E3F09CF4E6'
 
+        # Repeated values are served from the cache, different notations
+        # of the same value give the same result.
+        for value in ('-21.00100', '-21.001', '-2100100e-5', Decimal('-21.001')):
+            assert sa({
+                "value": value,
+                'issuer': 'r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV',
+                'currency': 'USD'}) == \
+                   '94C77607A27E28000000000000000000000000005553440000000000550FC62003E785DC231A1058A05E56E3F09CF4E6'
+
     def test_vl_data(self):
         s = call_encoder(TypeSerializers.STVL)
         assert s('02AE75B908F0A95F740A7BFA96057637E5C2170BC8DAD13B2F7B52AE75FAEBEFCF') == \
@@ -694,3 +1520,300 @@ class Test:
         "Sequence":1}) == \
             '120000240000000161D6871AFD498D00000000000000000000000000005553440000000000550FC62003E785DC231A1058A05E56E3F09CF4E668400000000000000A811450F97A072F1C4357F1AD84566A609479D927C9428314550FC62003E785DC231A1058A05E56E3F09CF4E6'
 
+
+    def test_varint(self):
+        s = call_encoder(serialize_varint)
+        assert s(0) == '00'
+        assert s(192) == 'C0'
+        assert s(193) == 'C100'
+        assert s(12480) == 'F0FF'
+        assert s(12481) == 'F10000'
+        assert s(918744) == 'FED417'
+
+        for value in (0, 1, 192, 193, 500, 12480, 12481, 918744):
+            assert BinaryParser(decode_hex(s(value))).read_varint() == value
+
+    def test_deserialize(self):
+        tx = {
+            "TransactionType": "Payment",
+            "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+            "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+            "Amount": {"value": "-21.001", 'issuer': 'r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV', 'currency': 'USD'},
+            "SendMax": "-1",
+            "Fee": "10",
+            "Sequence": 1,
+            "SigningPubKey": "02AE75B908F0A95F740A7BFA96057637E5C2170BC8DAD13B2F7B52AE75FAEBEFCF",
+            "Paths": [[
+                {"account": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV", "type": 1, "type_hex": "0000000000000001"},
+                {"currency": "XRP", "type": 16, "type_hex": "0000000000000010"}
+            ], [
+                {"currency": "USD", "issuer": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV", "type": 48, "type_hex": "0000000000000030"},
+            ]]
+        }
+        blob = serialize_object(tx, hex=False)
+        assert deserialize_object(blob) == tx
+        assert deserialize_object(memoryview(blob)) == tx
+        assert deserialize_object(serialize_object(tx)) == tx
+
+        # Binary metadata, as rippled gives it to us.
+        meta = deserialize_object(decode_hex(
+            '201C00000001F8E3110061'
+            '5501EC8A5B78F0F9F4DEBE6D0D34B4FC1F9CE4E2B1D5B34AA5D92CB3CB2E2AD4D8'
+            'E1F1031000'))
+        assert meta == {
+            'TransactionIndex': 1,
+            'TransactionResult': 'tesSUCCESS',
+            'AffectedNodes': [{'CreatedNode': {
+                'LedgerEntryType': 'AccountRoot',
+                'PreviousTxnID': '01EC8A5B78F0F9F4DEBE6D0D34B4FC1F9CE4E2B1D5B34AA5D92CB3CB2E2AD4D8'}}]}
+
+        from pytest import raises
+        # Truncated data
+        raises(ValueError, deserialize_object, blob[:-1])
+        # ...in the middle of a fixed size field
+        raises(ValueError, deserialize_object, '12000024000000')
+
+        # A standard currency code that is not ASCII
+        code = '0' * 24 + 'FF8081' + '0' * 10
+        path = {'Paths': [[{'currency': code, 'type': 16, 'type_hex': '0000000000000010'}]]}
+        assert deserialize_object(serialize_object(path)) == path
+
+    def test_object_plan(self):
+        # Plans are shared by objects of the same shape, no matter the
+        # order of the keys, and skip lower case keys.
+        plan = object_plan(['Sequence', 'TransactionType', 'hash', 'Fee'])
+        assert [name for name, _, _ in plan] == \
+            ['TransactionType', 'Sequence', 'Fee']
+        assert object_plan(['hash', 'Fee', 'TransactionType', 'Sequence']) is plan
+
+        # Headers for fields with type or field codes >= 16
+        assert fmt_hex(FIELD_HEADERS['TransactionResult']) == '0310'
+        assert fmt_hex(FIELD_HEADERS['LastLedgerSequence']) == '201B'
+        assert fmt_hex(FIELD_HEADERS['Paths']) == '0112'
+
+    def test_account_codec(self):
+        from pytest import raises
+        address = 'r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV'
+        account_id = decode_hex('550FC62003E785DC231A1058A05E56E3F09CF4E6')
+        assert decode_account_id(address) == account_id
+        assert encode_account_id(account_id) == address
+        # Served from the cache the second time around
+        assert decode_account_id(address) == account_id
+
+        # Works the same for the version byte padding ('r' is zero)
+        assert decode_account_id('rrrrrrrrrrrrrrrrrrrrrhoLvTp') == bytes(bytearray(20))
+        assert encode_account_id(bytes(bytearray(20))) == 'rrrrrrrrrrrrrrrrrrrrrhoLvTp'
+
+        # Bad checksum, bad characters, wrong length
+        raises(ValueError, decode_account_id, 'r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocW')
+        raises(ValueError, decode_account_id, 'r3kmLJN5D28dHuH8vZNUZpMC43pEHpao0V')
+        raises(ValueError, decode_account_id, 'r3kmLJN5D28dHuH8vZNUZpMC43pEH')
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        assert cache.get('a') == 1
+        cache['c'] = 3
+        # 'b' was least recently used
+        assert 'b' not in cache
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        assert len(cache) == 2
+
+    def test_serialize_into(self):
+        from pytest import raises
+        tx = {"TransactionType": "Payment", "Fee": "10", "Sequence": 1}
+        expected = serialize_object(tx, hex=False)
+
+        # Append to a bytearray, starting at an offset
+        buf = bytearray(b'XX')
+        end = serialize_into(buf, tx, 2)
+        assert end == len(expected) + 2
+        assert bytes(buf[2:end]) == expected
+
+        # Overwrite part of a bytearray
+        buf = bytearray(b'X' * 40)
+        end = serialize_into(buf, tx, 1)
+        assert bytes(buf[1:end]) == expected
+        assert len(buf) == 40 and buf[end:] == b'X' * (40 - end)
+
+        # Write into a memoryview
+        view = memoryview(bytearray(len(expected)))
+        assert serialize_into(view, tx) == len(expected)
+        assert view.tobytes() == expected
+        raises(ValueError, serialize_into, view[:-1], tx)
+
+        buf, offsets = serialize_many([tx, {"Sequence": 2}, tx])
+        assert len(offsets) == 4
+        assert bytes(buf[offsets[0]:offsets[1]]) == expected
+        assert fmt_hex(buf[offsets[1]:offsets[2]]) == '2400000002'
+        assert bytes(buf[offsets[2]:offsets[3]]) == expected
+
+        # Integers out of range
+        raises(ValueError, serialize_object, {"Sequence": 2**32})
+
+    def test_serialize_to(self):
+        tx = {"TransactionType": "Payment", "Fee": "10", "Sequence": 1,
+              "TxnSignature": "ABCD"}
+        stream = BytesIO()
+        serialize_to(stream, tx)
+        assert stream.getvalue() == serialize_object(tx, hex=False)
+
+        hash = sha256()
+        serialize_to(hash, tx)
+        assert hash.digest() == sha256(serialize_object(tx, hex=False)).digest()
+
+        hash1, hash2 = sha256(), sha256()
+        serialize_to(HashWriter(hash1, hash2), tx, signing=True)
+        unsigned = serialize_object(
+            {"TransactionType": "Payment", "Fee": "10", "Sequence": 1}, hex=False)
+        assert hash1.digest() == hash2.digest() == sha256(unsigned).digest()
+        hash = sha256()
+        serialize_to(hash, SerializedTransaction(tx), signing=True)
+        assert hash.digest() == hash1.digest()
+
+    def test_serialized_transaction(self):
+        tx = {
+            "TransactionType": "Payment",
+            "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+            "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+            "Amount": {"value": "200000000", 'issuer': 'r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV', 'currency': 'USD'},
+            "Fee": "10",
+            "Sequence": 1,
+            "hash": "ignored"}
+        stx = SerializedTransaction(tx)
+        assert stx == tx
+        assert stx.to_bytes() == serialize_object(tx, hex=False)
+        assert serialize_object(stx) == serialize_object(tx)
+
+        # Replacing a field only encodes that one field again
+        account = stx._segments['Account']
+        stx['Sequence'] = tx['Sequence'] = 2
+        stx.update(Fee="12")
+        tx['Fee'] = "12"
+        assert stx._segments['Account'] is account
+        assert stx.to_bytes() == serialize_object(tx, hex=False)
+
+        # Adding and removing fields
+        stx['TxnSignature'] = tx['TxnSignature'] = 'ABCD'
+        assert stx.to_bytes() == serialize_object(tx, hex=False)
+        unsigned = dict(tx)
+        del unsigned['TxnSignature']
+        assert stx.to_bytes(signing=True) == serialize_object(unsigned, hex=False)
+        del stx['Fee']
+        del tx['Fee']
+        assert stx.to_bytes() == serialize_object(tx, hex=False)
+        assert stx.copy().to_bytes() == stx.to_bytes()
+
+        # A value that cannot be encoded leaves the transaction as it was
+        from pytest import raises
+        blob = stx.to_bytes()
+        raises(Exception, stx.__setitem__, 'Sequence', 'not a number')
+        raises(Exception, stx.__setitem__, 'Fee', 'not a number')
+        assert stx['Sequence'] == 2 and 'Fee' not in stx
+        assert stx.to_bytes() == blob
+
+        # It can be sent to other processes
+        import pickle
+        loaded = pickle.loads(pickle.dumps(stx))
+        assert type(loaded) is SerializedTransaction
+        assert loaded == stx
+        assert loaded.to_bytes() == stx.to_bytes()
+
+    def test_hash_types(self):
+        from pytest import raises
+        h = '01EC8A5B78F0F9F4DEBE6D0D34B4FC1F9CE4E2B1D5B34AA5D92CB3CB2E2AD4D8'
+        s = call_encoder(TypeSerializers.STHash256)
+        assert s(h) == h
+        assert s(decode_hex(h)) == h
+        assert s(bytearray(decode_hex(h))) == h
+        raises(ValueError, s, h[:-2])
+
+        assert call_encoder(TypeSerializers.STHash128, '00' * 16) == '00' * 16
+        assert call_encoder(TypeSerializers.STHash160, b'\xff' * 20) == 'FF' * 20
+
+        s = call_encoder(TypeSerializers.STInt64)
+        assert s('1') == '0000000000000001'
+        assert s('00000000000000FF') == '00000000000000FF'
+        assert s(2**64-1) == 'FFFFFFFFFFFFFFFF'
+        assert s(b'\x00' * 7 + b'\x01') == '0000000000000001'
+        raises(ValueError, s, 2**64)
+
+        s = call_encoder(TypeSerializers.STVector256)
+        assert s([h, decode_hex(h)]) == '40' + h + h
+        assert s([]) == '00'
+
+        assert call_encoder(TypeSerializers.STVL, b'\x01\x02') == '020102'
+
+    def test_array(self):
+        meta = {
+            'TransactionIndex': 1,
+            'TransactionResult': 'tesSUCCESS',
+            'AffectedNodes': [{'CreatedNode': {
+                'LedgerEntryType': 'AccountRoot',
+                'PreviousTxnID': '01EC8A5B78F0F9F4DEBE6D0D34B4FC1F9CE4E2B1D5B34AA5D92CB3CB2E2AD4D8'}}]}
+        assert serialize_object(meta) == \
+            '201C00000001F8E3110061' \
+            '5501EC8A5B78F0F9F4DEBE6D0D34B4FC1F9CE4E2B1D5B34AA5D92CB3CB2E2AD4D8' \
+            'E1F1031000'
+
+        from pytest import raises
+        raises(ValueError, serialize_object, {'AffectedNodes': [{}]})
+
+    def test_definitions(self):
+        # Transaction types beyond those in the original tables
+        for tx in [{
+            "TransactionType": "EscrowCreate",
+            "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+            "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+            "Amount": "10000", "CancelAfter": 533257958, "FinishAfter": 533171558,
+            "Condition": "A0258020E3B0C44298FC1C149AFBF4C8996FB92427AE41E4649B934CA495991B7852B855810100",
+        }, {
+            "TransactionType": "PaymentChannelClaim",
+            "Channel": "C1AE6DDDEEC05CF2978C0BAD6FE302948E9533691DC749DCDD3B9E5992CA6198",
+            "Balance": "1000000", "Amount": "1000000",
+            "Signature": "30440220718D264EF05CAED7C781FF6DE298DCAC68D002562C9BF3A07C1E721B420C0DAB02203A5A4779EF4D2CCC7BC3EF886676D803A9981B928D3B8ACA483B80ECA3CD7B9B",
+            "PublicKey": "32D2471DB72B27E3310F355BB33E339BF26F8392D5A93D3BC0FC3B566612DA0F0A",
+        }, {
+            "TransactionType": "SignerListSet",
+            "SignerQuorum": 3,
+            "SignerEntries": [
+                {"SignerEntry": {"Account": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV", "SignerWeight": 2}},
+                {"SignerEntry": {"Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi", "SignerWeight": 1}}],
+        }]:
+            assert deserialize_object(serialize_object(tx)) == tx
+
+        assert 'TxnSignature' in NON_SIGNING_FIELDS
+        assert 'Signers' in NON_SIGNING_FIELDS
+        assert 'Sequence' not in NON_SIGNING_FIELDS
+
+    def test_load_definitions(self, tmpdir, monkeypatch):
+        definitions = json.loads(
+            pkgutil.get_data('ripple', 'definitions.json').decode('utf-8'))
+        definitions['FIELDS'].append(["TestField", {
+            "nth": 99, "isVLEncoded": False, "isSerialized": True,
+            "isSigningField": True, "type": "UInt32"}])
+        filename = str(tmpdir.join('definitions.json'))
+        with open(filename, 'w') as f:
+            json.dump(definitions, f)
+
+        try:
+            cache_dir = str(tmpdir.join('cache'))
+            load_definitions(filename, cache_dir=cache_dir)
+            assert serialize_object({'TestField': 1}) == '206300000001'
+            assert deserialize_object('206300000001') == {'TestField': 1}
+
+            # The compiled tables were cached, and can be loaded again
+            assert len(os.listdir(cache_dir)) == 1
+            load_definitions(filename, cache_dir=cache_dir)
+            assert serialize_object({'TestField': 1}) == '206300000001'
+
+            # Without a cache_dir, nothing is written anywhere
+            def no_writing(*args):
+                assert False, 'cache written'
+            monkeypatch.setattr(sys.modules[__name__], 'write_cache_file', no_writing)
+            load_definitions(filename)
+            assert serialize_object({'TestField': 1}) == '206300000001'
+        finally:
+            load_definitions()
+        assert 'TestField' not in FIELD_HEADERS
@@ -7,24 +7,40 @@ See also:
 """
 
 import hashlib
-from binascii import hexlify
-from ecdsa import curves, SigningKey, six
-from ecdsa.util import sigencode_der
+import multiprocessing
+from io import BytesIO
+from binascii import hexlify, unhexlify
+from ecdsa import curves, ellipticcurve, SigningKey, VerifyingKey, six
+from ecdsa.ecdsa import Private_key
+from ecdsa.util import sigencode_der, sigdecode_der
 from .serialize import (
-    to_bytes, from_bytes, RippleBaseDecoder, serialize_object, fmt_hex)
+    to_bytes, from_bytes, RippleBaseDecoder, serialize_object, fmt_hex,
+    encode_account_id, SerializedTransaction, NON_SIGNING_FIELDS,
+    serialize_to, object_plan, HashWriter)
+from .crypto import get_backend
+from .instrument import timed
+from . import secp256k1
+from . import ed25519
 
 
-__all__ = ('sign_transaction', 'signature_for_transaction')
+__all__ = ('sign_transaction', 'signature_for_transaction', 'Signer',
+           'sign_transactions', 'verify_transaction', 'verify_many',
+           'derive_accounts', 'write_accounts', 'sign_claim', 'verify_claim',
+           'verify_claims')
 
 
 tfFullyCanonicalSig = 0x80000000
 
 
+@timed('sign_transaction')
 def sign_transaction(transaction, secret, flag_canonical=True):
     """High-level signing function.hexlify
 
     - Adds a signature (``TxnSignature``) field to the transaction object.
     - By default will set the ``FullyCanonicalSig`` flag to ``
+
+    ``secret`` may also be a :class:`Signer`, which saves deriving the
+    key again if you sign many transactions.
     """
     if flag_canonical:
         transaction['Flags'] = transaction.get('Flags', 0) | tfFullyCanonicalSig
@@ -42,18 +58,216 @@ def signature_for_transaction(transaction, secret):
     can insert into as ``TxSignature`` into the transaction structure
     you submit.
     """
-    seed = parse_seed(secret)
-    key = root_key_from_seed(seed)
+    signer = secret if isinstance(secret, Signer) else Signer(secret)
 
     # Apparently the pub key is required to be there.
-    transaction['SigningPubKey'] = fmt_hex(ecc_point_to_bytes_compressed(
-        key.privkey.public_key.point, pad=True))
+    transaction['SigningPubKey'] = signer.public_key_hex
+
+    if signer.key_type == 'ed25519':
+        # Ed25519 signs the data itself, rather than a hash of it.
+        return fmt_hex(ed25519.sign(
+            signer.private_key, create_signing_data(transaction)))
 
     # Convert the transaction to a binary representation
     signing_hash = create_signing_hash(transaction)
 
     # Create a hex-formatted signature.
-    return fmt_hex(ecdsa_sign(key, signing_hash))
+    return fmt_hex(ecdsa_sign(signer.key, signing_hash))
+
+
+class Signer(object):
+    """Derives the key for a secret once, and keeps it around to sign
+    any number of transactions.
+
+    Deriving the key from the secret is much more expensive than the
+    signing itself.
+
+    Both secp256k1 and ed25519 ("sEd...") secrets are supported; see
+    ``key_type``. For the former, ``key`` is the ECDSA key from
+    :func:`root_key_from_seed`, for the latter, ``private_key`` holds
+    the raw ed25519 secret key.
+    """
+
+    def __init__(self, secret):
+        self.secret = secret
+        seed, self.key_type = decode_seed(secret)
+        if self.key_type == 'ed25519':
+            self.key = None
+            self.private_key = first_half_of_sha512(seed)
+            self.public_key = ED25519_PREFIX + ed25519.public_key(self.private_key)
+        else:
+            self.key = root_key_from_seed(seed)
+            self.private_key = to_bytes(self.key.privkey.secret_multiplier, 32)
+            self.public_key = ecc_point_to_bytes_compressed(
+                self.key.privkey.public_key.point, pad=True)
+        self.public_key_hex = fmt_hex(self.public_key)
+        self.account = get_ripple_from_pubkey(self.public_key)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.account)
+
+    def __reduce__(self):
+        # Pickle only the secret; the key is derived again on the other
+        # side (i.e. once per worker process).
+        return (self.__class__, (self.secret,))
+
+    def sign(self, transaction, flag_canonical=True):
+        """Sign ``transaction``, see :func:`sign_transaction`."""
+        return sign_transaction(transaction, self, flag_canonical)
+
+    def sign_claim(self, channel_id, amount_drops):
+        """Sign a payment channel claim, see :func:`sign_claim`."""
+        return sign_claim(channel_id, amount_drops, self)
+
+
+def sign_transactions(transactions, secret, workers=None, chunksize=64):
+    """Sign many transactions, using multiple processes.
+
+    Yields a ``(tx_blob, tx_id)`` tuple for every transaction, in the
+    same order as ``transactions``, as soon as it is available. The
+    transactions need to be complete, including the ``Sequence``; they
+    are not modified.
+
+    ``workers`` defaults to the number of CPUs; each of them derives
+    the key only once, then signs ``chunksize`` transactions at a time.
+    With ``workers=1``, everything happens in this process.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers <= 1:
+        signer = secret if isinstance(secret, Signer) else Signer(secret)
+        return (_sign_and_serialize(signer, tx) for tx in transactions)
+
+    return _imap_in_pool(
+        _sign_in_worker, transactions, workers, chunksize,
+        initializer=_init_signing_worker, initargs=(secret,))
+
+
+def _imap_in_pool(func, iterable, workers, chunksize, **kwargs):
+    """Like ``Pool.imap``, but takes care of the pool itself."""
+    pool = multiprocessing.Pool(workers, **kwargs)
+    try:
+        for result in pool.imap(func, iterable, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _sign_and_serialize(signer, transaction):
+    transaction = SerializedTransaction(transaction)
+    signer.sign(transaction)
+    return (fmt_hex(transaction.to_bytes()),
+            hash_transaction(transaction, HASH_TX_ID))
+
+
+_worker_signer = None
+
+def _init_signing_worker(secret):
+    global _worker_signer
+    _worker_signer = secret if isinstance(secret, Signer) else Signer(secret)
+
+
+def _sign_in_worker(transaction):
+    return _sign_and_serialize(_worker_signer, transaction)
+
+
+def verify_transaction(transaction, testnet=False):
+    """Check that the ``TxnSignature`` of the transaction was made with
+    the key in ``SigningPubKey``.
+
+    Returns ``False`` for transactions without a (single) signature.
+    """
+    try:
+        public_key = unhexlify(transaction['SigningPubKey'])
+        signature = unhexlify(transaction['TxnSignature'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    if public_key[:1] == ED25519_PREFIX:
+        return ed25519.verify(
+            public_key[1:], create_signing_data(transaction, testnet=testnet),
+            signature)
+    signing_hash = create_signing_hash(transaction, testnet=testnet)
+    return get_backend().verify(public_key, unhexlify(signing_hash), signature)
+
+
+def verify_many(transactions, workers=None, chunksize=64, testnet=False):
+    """Verify many transactions, using multiple processes.
+
+    Yields the result of :func:`verify_transaction` for every
+    transaction, in order. See :func:`sign_transactions` for
+    ``workers`` and ``chunksize``.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    verify = _verify_testnet if testnet else verify_transaction
+    if workers <= 1:
+        return (verify(tx) for tx in transactions)
+    return _imap_in_pool(verify, transactions, workers, chunksize)
+
+
+def _verify_testnet(transaction):
+    return verify_transaction(transaction, testnet=True)
+
+
+def sign_claim(channel_id, amount_drops, secret):
+    """Sign a claim for ``amount_drops`` of the XRP in the payment
+    channel ``channel_id`` (the hex id of the channel's ledger entry).
+
+    This is what the receiving side of a channel gets for every payment,
+    and redeems later with a ``PaymentChannelClaim`` transaction. As with
+    :func:`sign_transaction`, pass a :class:`Signer` rather than the
+    secret when you sign many. Returns the signature as hex.
+    """
+    signer = secret if isinstance(secret, Signer) else Signer(secret)
+    data = create_claim_data(channel_id, amount_drops)
+    if signer.key_type == 'ed25519':
+        return fmt_hex(ed25519.sign(signer.private_key, data))
+    return fmt_hex(get_backend().sign(
+        signer.key.privkey.secret_multiplier, first_half_of_sha512(data)))
+
+
+def verify_claim(channel_id, amount_drops, signature, public_key):
+    """Check a claim signed with :func:`sign_claim`; ``public_key`` is
+    the ``PublicKey`` of the channel.
+
+    The parsed public key is cached by the backend, so verifying many
+    claims for the same channel only parses it once.
+    """
+    try:
+        data = create_claim_data(channel_id, amount_drops)
+        public_key = unhexlify(public_key) \
+            if isinstance(public_key, six.string_types) else bytes(public_key)
+        signature = unhexlify(signature)
+    except (TypeError, ValueError):
+        return False
+    if public_key[:1] == ED25519_PREFIX:
+        return ed25519.verify(public_key[1:], data, signature)
+    return get_backend().verify(
+        public_key, first_half_of_sha512(data), signature)
+
+
+def verify_claims(claims, workers=None, chunksize=64):
+    """Verify many claims; each is a ``(channel_id, amount_drops,
+    signature, public_key)`` tuple.
+
+    Yields the result of :func:`verify_claim` for each, in order. See
+    :func:`sign_transactions` for ``workers`` and ``chunksize``.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1:
+        return (_verify_claim_tuple(claim) for claim in claims)
+    return _imap_in_pool(_verify_claim_tuple, claims, workers, chunksize)
+
+
+def _verify_claim_tuple(claim):
+    return verify_claim(*claim)
 
 
 def parse_seed(secret):
@@ -66,9 +280,39 @@ def parse_seed(secret):
     client when creating an account.
     """
     assert secret[0] == 's'
-    return RippleBaseDecoder.decode(secret)
+    seed, key_type = decode_seed(secret)
+    if key_type != 'secp256k1':
+        raise ValueError('This is an %s secret, use Signer' % key_type)
+    return seed
+
 
+# The version bytes of an ed25519 seed; it makes the encoded secret
+# begin with "sEd".
+ED25519_SEED_PREFIX = b'\x01\xe1\x4b'
+SECP256K1_SEED_PREFIX = b'\x21'
 
+# Marks an ed25519 public key; secp256k1 ones start with 0x02 or 0x03.
+ED25519_PREFIX = b'\xed'
+
+
+def decode_seed(secret):
+    """Decode a secret, return a 2-tuple of the 16-byte seed and the
+    key type (``"secp256k1"`` or ``"ed25519"``).
+    """
+    try:
+        decoded = RippleBaseDecoder.decode_base(secret)
+    except ValueError:
+        decoded = b''
+    if len(decoded) > 4 and RippleBaseDecoder.verify_checksum(decoded):
+        payload = decoded[:-4]
+        if len(payload) == 19 and payload[:3] == ED25519_SEED_PREFIX:
+            return payload[3:], 'ed25519'
+        if len(payload) == 17 and payload[:1] == SECP256K1_SEED_PREFIX:
+            return payload[1:], 'secp256k1'
+    raise ValueError('Not a valid secret')
+
+
+@timed('root_key_from_seed')
 def root_key_from_seed(seed):
     """This derives your master key the given seed.
 
@@ -84,43 +328,130 @@ def root_key_from_seed(seed):
         if curves.SECP256k1.order >= private_gen:
             break
 
-    public_gen = curves.SECP256k1.generator * private_gen
+    x, y = secp256k1.generator_multiply(private_gen)
+    public_gen = ellipticcurve.Point(
+        curves.SECP256k1.curve, x, y, curves.SECP256k1.order)
 
     # Now that we have the private and public generators, we apparently
     # have to calculate a secret from them that can be used as a ECDSA
     # signing key.
-    secret = i = 0
-    public_gen_compressed = ecc_point_to_bytes_compressed(public_gen)
-    while True:
-        secret = from_bytes(first_half_of_sha512(
-            b"".join([
-                public_gen_compressed, to_bytes(0, 4), to_bytes(i, 4)])))
-        i += 1
-        if curves.SECP256k1.order >= secret:
-            break
+    secret = family_tweak(ecc_point_to_bytes_compressed(public_gen), 0)
     secret = (secret + private_gen) % curves.SECP256k1.order
 
     # The ECDSA signing key object will, given this secret, then expose
     # the actual private and public key we are supposed to work with.
-    key = SigningKey.from_secret_exponent(secret, curves.SECP256k1)
+    key = signing_key_from_secret(secret)
     # Attach the generators as supplemental data
     key.private_gen = private_gen
     key.public_gen = public_gen
     return key
 
 
-def ecdsa_sign(key, signing_hash, **kw):
+def signing_key_from_secret(secret):
+    """Return the same as ``SigningKey.from_secret_exponent(secret,
+    curves.SECP256k1)``, but with the public key from the backend (see
+    :mod:`ripple.crypto`); python-ecdsa's own point multiplication is
+    the slowest part of deriving a key.
+    """
+    curve = curves.SECP256k1
+    x, y = get_backend().public_point(secret)
+    point = ellipticcurve.Point(curve.curve, x, y, curve.order)
+
+    # What from_secret_exponent() does, minus the multiplication.
+    key = SigningKey(_error__please_use_generate=True)
+    key.curve = curve
+    key.default_hashfunc = hashlib.sha1
+    key.baselen = curve.baselen
+    try:
+        key.verifying_key = VerifyingKey.from_public_point(
+            point, curve, validate_point=False)
+    except TypeError:
+        # python-ecdsa before 0.14 always checks the point
+        key.verifying_key = VerifyingKey.from_public_point(point, curve)
+    key.privkey = Private_key(key.verifying_key.pubkey, secret)
+    key.privkey.order = curve.order
+    return key
+
+
+def family_tweak(public_gen_compressed, index):
+    """What is added to the private generator to get the secret of the
+    account with the given index; index 0 is the root key.
+    """
+    i = 0
+    while True:
+        tweak = from_bytes(first_half_of_sha512(
+            b"".join([
+                public_gen_compressed, to_bytes(index, 4), to_bytes(i, 4)])))
+        i += 1
+        if curves.SECP256k1.order >= tweak:
+            return tweak
+
+
+def derive_accounts(secret, start=0, count=1, include_private=False,
+                    batch_size=256):
+    """Derive the accounts ``start`` to ``start + count - 1`` of the
+    account family of a (secp256k1) secret.
+
+    Yields ``(index, account, public_key_hex)`` tuples; if you ask for
+    it with ``include_private``, the private key is added as a fourth
+    element, in hex.
+
+    The generators are derived only once (pass a :class:`Signer` to
+    reuse those of its key), and the point arithmetic for ``batch_size``
+    accounts at a time shares a single modular inversion.
+    """
+    signer = secret if isinstance(secret, Signer) else Signer(secret)
+    if signer.key_type != 'secp256k1':
+        raise ValueError('Only secp256k1 secrets have account families')
+    private_gen = signer.key.private_gen
+    public_gen = (signer.key.public_gen.x(), signer.key.public_gen.y())
+    public_gen_compressed = ecc_point_to_bytes_compressed(signer.key.public_gen)
+    order = curves.SECP256k1.order
+
+    stop = start + count
+    for batch_start in range(start, stop, batch_size):
+        indices = range(batch_start, min(batch_start + batch_size, stop))
+        tweaks = [family_tweak(public_gen_compressed, index) for index in indices]
+        # public key = public_gen + tweak * G
+        points = secp256k1.batch_to_affine([
+            secp256k1.jacobian_add_affine(*(
+                secp256k1.generator_multiply_jacobian(tweak) + public_gen))
+            for tweak in tweaks])
+
+        for index, tweak, point in zip(indices, tweaks, points):
+            public_key = secp256k1.compress(point)
+            result = (index, get_ripple_from_pubkey(public_key),
+                      fmt_hex(public_key))
+            if include_private:
+                result += (fmt_hex(to_bytes((tweak + private_gen) % order, 32)),)
+            yield result
+
+
+def write_accounts(fileobj, secret, start=0, count=1, include_private=False):
+    """Write the accounts from :func:`derive_accounts` to ``fileobj``,
+    one per line, as comma separated values. Returns the number of
+    accounts written.
+    """
+    written = 0
+    for row in derive_accounts(secret, start, count, include_private):
+        fileobj.write(','.join(map(str, row)) + '\n')
+        written += 1
+    return written
+
+
+@timed('ecdsa_sign')
+def ecdsa_sign(key, signing_hash, k=None):
     """Sign the given data. The key is the secret returned by
     :func:`root_key_from_seed`.
 
     The data will be a binary coded transaction.
+
+    The actual work is done by the backend from :mod:`ripple.crypto`;
+    the result is a fully canonical, DER encoded signature. ``k`` can
+    be given for testing; it is otherwise chosen at random.
     """
-    r, s = key.sign_number(int(signing_hash, 16), **kw)
-    r, s = ecdsa_make_canonical(r, s)
-    # Encode signature in DER format, as in
-    # ``sjcl.ecc.ecdsa.secretKey.prototype.encodeDER``
-    der_coded = sigencode_der(r, s, None)
-    return der_coded
+    return get_backend().sign(
+        key.privkey.secret_multiplier, to_bytes(int(signing_hash, 16), 32), k=k)
 
 
 def ecdsa_make_canonical(r, s):
@@ -132,48 +463,104 @@ def ecdsa_make_canonical(r, s):
     # For a canonical signature we want the lower of two possible values for s
     # 0 < s <= n/2
     N = curves.SECP256k1.order
-    if not N / 2 >= s:
+    if not N // 2 >= s:
         s = N - s
     return r, s
 
 
 def get_ripple_from_pubkey(pubkey):
     """Given a public key, determine the Ripple address.
+
+    This works the same for secp256k1 and (``ED``-prefixed) ed25519
+    public keys.
     """
     ripemd160 = hashlib.new('ripemd160')
     ripemd160.update(hashlib.sha256(pubkey).digest())
-    return RippleBaseDecoder.encode(ripemd160.digest())
+    return encode_account_id(ripemd160.digest())
 
 
 def get_ripple_from_secret(seed):
     """Another helper. Returns the first ripple address from the secret."""
-    key = root_key_from_seed(parse_seed(seed))
-    pubkey = ecc_point_to_bytes_compressed(key.privkey.public_key.point, pad=True)
-    return get_ripple_from_pubkey(pubkey)
+    return Signer(seed).account
 
 
 # From ripple-lib:hashprefixes.js
 HASH_TX_ID = 0x54584E00; # 'TXN'
 HASH_TX_SIGN = 0x53545800  # 'STX'
 HASH_TX_SIGN_TESTNET = 0x73747800 # 'stx'
+HASH_PAYMENT_CHANNEL_CLAIM = 0x434C4D00  # 'CLM'
 
+@timed('create_signing_hash')
 def create_signing_hash(transaction, testnet=False):
     """This is the actual value to be signed.
 
     It consists of a prefix and the binary representation of the
-    transaction.
+    transaction, without the signature itself.
     """
     prefix = HASH_TX_SIGN_TESTNET if testnet else HASH_TX_SIGN
-    return hash_transaction(transaction, prefix)
+    return hash_transaction(transaction, prefix, signing=True)
 
 
-def hash_transaction(transaction, prefix):
+def create_signing_data(transaction, testnet=False):
+    """What is signed by an ed25519 key: the prefix and the binary
+    representation of the transaction, without the signature.
+    """
+    prefix = HASH_TX_SIGN_TESTNET if testnet else HASH_TX_SIGN
+    stream = BytesIO()
+    stream.write(to_bytes(prefix, 4))
+    serialize_to(stream, transaction, signing=True)
+    return stream.getvalue()
+
+
+def create_claim_data(channel_id, amount_drops):
+    """What is signed for a payment channel claim: the prefix, the
+    channel id and the amount as a 64-bit integer.
+    """
+    if isinstance(channel_id, six.string_types):
+        channel_id = unhexlify(channel_id)
+    if len(channel_id) != 32:
+        raise ValueError('Not a valid channel id')
+    amount_drops = int(amount_drops)
+    if not 0 <= amount_drops < 2 ** 64:
+        raise ValueError('Not a valid amount: %s' % amount_drops)
+    return b''.join([to_bytes(HASH_PAYMENT_CHANNEL_CLAIM, 4), bytes(channel_id),
+                     to_bytes(amount_drops, 8)])
+
+
+def hash_transaction(transaction, prefix, signing=False):
     """Create a hash of the transaction and the prefix.
+
+    If ``signing`` is set, fields which are not signed are left out.
+    The transaction is serialized straight into the hash function.
     """
-    binary = first_half_of_sha512(
-        to_bytes(prefix, 4) +
-        serialize_object(transaction, hex=False))
-    return hexlify(binary).upper()
+    hash = hashlib.sha512(to_bytes(prefix, 4))
+    serialize_to(hash, transaction, signing=signing)
+    return hexlify(hash.digest()[:256//8]).upper()
+
+
+def signing_hash_and_id(transaction, testnet=False):
+    """Return both the signing hash and the transaction id (the hash
+    :func:`ripple.client.transaction_hash` gives you) of a signed
+    transaction, serializing it only once.
+    """
+    signing_hash = hashlib.sha512(to_bytes(
+        HASH_TX_SIGN_TESTNET if testnet else HASH_TX_SIGN, 4))
+    tx_id = hashlib.sha512(to_bytes(HASH_TX_ID, 4))
+
+    if isinstance(transaction, SerializedTransaction):
+        signing_hash.update(transaction.to_bytes(signing=True))
+        tx_id.update(transaction.to_bytes())
+    else:
+        # Fields that are signed go to both hashes.
+        both = HashWriter(signing_hash, tx_id)
+        id_only = HashWriter(tx_id)
+        for name, header, encode in object_plan(transaction):
+            stream = id_only if name in NON_SIGNING_FIELDS else both
+            stream.write(header)
+            encode(stream, transaction[name])
+
+    return (hexlify(signing_hash.digest()[:256//8]).upper(),
+            hexlify(tx_id.digest()[:256//8]).upper())
 
 
 def first_half_of_sha512(*bytes):
@@ -231,13 +618,210 @@ class Test:
             expected = expected + 'L'
         assert hex(key.privkey.secret_multiplier) == expected
 
+    def test_signing_key_from_secret(self):
+        # The public key from the backend is the one python-ecdsa computes
+        key = root_key_from_seed(parse_seed('ssq55ueDob4yV3kPVnNQLHB6icwpC'))
+        expected = SigningKey.from_secret_exponent(
+            key.privkey.secret_multiplier, curves.SECP256k1)
+        assert key.to_string() == expected.to_string()
+        assert key.get_verifying_key().to_string() == \
+            expected.get_verifying_key().to_string()
+
     def test_ripple_from_secret(self):
         assert get_ripple_from_secret('shHM53KPZ87Gwdqarm1bAmPeXg8Tn') ==\
                'rhcfR9Cg98qCxHpCcPBmMonbDBXo84wyTn'
 
+    def test_derive_accounts(self):
+        accounts = list(derive_accounts(
+            'ssq55ueDob4yV3kPVnNQLHB6icwpC', count=5, include_private=True,
+            batch_size=2))
+        assert [a[0] for a in accounts] == [0, 1, 2, 3, 4]
+        # Index 0 is the root key
+        signer = Signer('ssq55ueDob4yV3kPVnNQLHB6icwpC')
+        assert accounts[0][1:] == (
+            signer.account, signer.public_key_hex, fmt_hex(signer.private_key))
+        assert len(set(a[1] for a in accounts)) == 5
+
+        # The private and public keys match
+        for index, account, public_key, private_key in accounts:
+            key = SigningKey.from_secret_exponent(
+                int(private_key, 16), curves.SECP256k1)
+            assert fmt_hex(ecc_point_to_bytes_compressed(
+                key.privkey.public_key.point, pad=True)) == public_key
+            assert get_ripple_from_pubkey(unhexlify(public_key)) == account
+
+        # A range in the middle gives the same result
+        assert list(derive_accounts(signer, start=3, count=2)) == \
+            [a[:3] for a in accounts[3:]]
+
+        stream = six.StringIO()
+        assert write_accounts(stream, signer, count=2) == 2
+        assert stream.getvalue().splitlines()[1] == ','.join(map(str, accounts[1][:3]))
+
+    def test_ed25519_seed(self):
+        from pytest import raises
+        # From the ripple-keypairs test fixtures
+        seed, key_type = decode_seed('sEdSKaCy2JT7JaM7v95H9SxkhP9wS2r')
+        assert key_type == 'ed25519'
+        assert seed == bytes(bytearray(range(1, 17)))
+        assert decode_seed('ssq55ueDob4yV3kPVnNQLHB6icwpC')[1] == 'secp256k1'
+        raises(ValueError, parse_seed, 'sEdSKaCy2JT7JaM7v95H9SxkhP9wS2r')
+        raises(ValueError, decode_seed, 'sEdSKaCy2JT7JaM7v95H9SxkhP9wS2s')
+
+        signer = Signer('sEdSKaCy2JT7JaM7v95H9SxkhP9wS2r')
+        assert fmt_hex(signer.private_key) == \
+            'B4C4E046826BD26190D09715FC31F4E6A728204EADD112905B08B14B7F15C4F3'
+        assert signer.public_key_hex == \
+            'ED01FA53FA5A7E77798F882ECE20B1ABC00BB358A9E55A202D0D0676BD0CE37A63'
+        assert signer.account == 'rLUEXYuLiQptky37CqLcm9USQpPiz5rkpD'
+        assert get_ripple_from_secret('sEdSKaCy2JT7JaM7v95H9SxkhP9wS2r') == \
+            'rLUEXYuLiQptky37CqLcm9USQpPiz5rkpD'
+        assert fmt_hex(ed25519.sign(signer.private_key, b'test message')) == \
+            'CB199E1BFD4E3DAA105E4832EEDFA36413E1F44205E4EFB9E27E826044C21E3E' \
+            '2E848BBC8195E8959BADF887599B7310AD1B7047EF11B682E0D068F73749750E'
+
+    def test_ed25519_sign(self):
+        signer = Signer('sEdSKaCy2JT7JaM7v95H9SxkhP9wS2r')
+        tx = {"TransactionType": "Payment",
+              "Account": signer.account,
+              "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+              "Amount": "200000000", "Fee": "10", "Sequence": 1}
+        signed = sign_transaction(dict(tx), 'sEdSKaCy2JT7JaM7v95H9SxkhP9wS2r')
+        assert signed['SigningPubKey'] == signer.public_key_hex
+        assert len(signed['TxnSignature']) == 128
+        # ed25519 signatures are deterministic
+        assert signer.sign(dict(tx)) == signed
+        assert SerializedTransaction(signer.sign(SerializedTransaction(tx))) == signed
+
+        assert verify_transaction(signed)
+        assert not verify_transaction(dict(signed, Fee="11"))
+        assert not verify_transaction(signed, testnet=True)
+        assert create_signing_data(signed)[4:] == \
+            serialize_object(dict(tx, Flags=signed['Flags'],
+                                  SigningPubKey=signer.public_key_hex), hex=False)
+
+    def test_signer(self):
+        signer = Signer('shHM53KPZ87Gwdqarm1bAmPeXg8Tn')
+        assert signer.account == 'rhcfR9Cg98qCxHpCcPBmMonbDBXo84wyTn'
+
+        tx = {"TransactionType": "Payment",
+              "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+              "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+              "Amount": "200000000", "Fee": "10", "Sequence": 1}
+        signed = signer.sign(dict(tx))
+        assert signed['SigningPubKey'] == signer.public_key_hex
+        assert signer.key.get_verifying_key().verify_digest(
+            unhexlify(signed['TxnSignature']),
+            unhexlify(create_signing_hash(signed)), sigdecode=sigdecode_der)
+
+        # Same result as signing with the secret
+        other = sign_transaction(dict(tx), 'shHM53KPZ87Gwdqarm1bAmPeXg8Tn')
+        assert other['SigningPubKey'] == signed['SigningPubKey']
+        assert create_signing_hash(other) == create_signing_hash(signed)
+
+    def test_sign_transactions(self):
+        from .serialize import deserialize_object
+        signer = Signer('ssq55ueDob4yV3kPVnNQLHB6icwpC')
+        txs = [{"TransactionType": "Payment",
+                "Account": signer.account,
+                "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+                "Amount": "200000000", "Fee": "10", "Sequence": seq}
+               for seq in range(1, 8)]
+
+        for workers in (1, 2):
+            results = list(sign_transactions(
+                txs, 'ssq55ueDob4yV3kPVnNQLHB6icwpC', workers=workers,
+                chunksize=3))
+            assert len(results) == len(txs)
+            for seq, (tx_blob, tx_id) in enumerate(results, 1):
+                tx = deserialize_object(tx_blob)
+                assert tx['Sequence'] == seq
+                assert hash_transaction(tx, HASH_TX_ID) == tx_id
+                assert get_backend().verify(
+                    signer.public_key, unhexlify(create_signing_hash(tx)),
+                    unhexlify(tx['TxnSignature']))
+        # The input is left alone
+        assert 'TxnSignature' not in txs[0]
+
+    def test_verify_transaction(self):
+        tx = {"TransactionType": "Payment",
+              "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+              "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+              "Amount": "200000000", "Fee": "10", "Sequence": 1}
+        assert not verify_transaction(tx)
+        sign_transaction(tx, 'ssq55ueDob4yV3kPVnNQLHB6icwpC')
+        assert verify_transaction(tx)
+        assert verify_transaction(SerializedTransaction(tx))
+        assert not verify_transaction(tx, testnet=True)
+
+        tampered = dict(tx, Amount="200000001")
+        assert not verify_transaction(tampered)
+        assert not verify_transaction(dict(tx, TxnSignature='XY'))
+
+        for workers in (1, 2):
+            assert list(verify_many([tx, tampered, tx], workers=workers)) == \
+                [True, False, True]
+
+    def test_claims(self):
+        channel = '5DB01B7FFED6B67E6B0414DED11E051D2EE2B7619CE0EAA6286D67A3A4D5BDB3'
+        assert create_claim_data(channel, 1000000) == unhexlify(
+            '434C4D00' + channel + '00000000000F4240')
+
+        for secret in ('ssq55ueDob4yV3kPVnNQLHB6icwpC',
+                       'sEdSKaCy2JT7JaM7v95H9SxkhP9wS2r'):
+            signer = Signer(secret)
+            signature = signer.sign_claim(channel, 1000000)
+            assert verify_claim(channel, 1000000, signature, signer.public_key_hex)
+            assert verify_claim(channel, 1000000, sign_claim(
+                channel, '1000000', secret), signer.public_key_hex)
+            assert verify_claim(unhexlify(channel), '1000000', signature,
+                                signer.public_key)
+            assert not verify_claim(channel, 1000001, signature, signer.public_key)
+            assert not verify_claim(channel[::-1], 1000000, signature, signer.public_key)
+            assert not verify_claim(channel, 1000000, 'XY', signer.public_key)
+            assert not verify_claim(channel[2:], 1000000, signature, signer.public_key)
+
+            claims = [(channel, 10, signer.sign_claim(channel, 10), signer.public_key_hex),
+                      (channel, 11, signer.sign_claim(channel, 10), signer.public_key_hex)]
+            for workers in (1, 2):
+                assert list(verify_claims(claims, workers=workers)) == [True, False]
+
     def test_signing_hash(self):
         assert create_signing_hash({"TransactionType": "Payment"}) == \
             b'903C926641095B392A123D4CCD19E060DD8A603C91DDFF254AC9AD3B986C10CF'
+        # The signature is not part of what is signed
+        assert create_signing_hash({"TransactionType": "Payment", "TxnSignature": "AB"}) == \
+            b'903C926641095B392A123D4CCD19E060DD8A603C91DDFF254AC9AD3B986C10CF'
+
+    def test_sign_serialized_transaction(self):
+        tx = {"TransactionType": "Payment",
+              "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+              "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+              "Amount": "200000000", "Fee": "10", "Sequence": 1}
+        stx = SerializedTransaction(tx)
+        sign_transaction(tx, 'ssq55ueDob4yV3kPVnNQLHB6icwpC')
+        sign_transaction(stx, 'ssq55ueDob4yV3kPVnNQLHB6icwpC')
+        assert create_signing_hash(stx) == create_signing_hash(tx)
+        # Signatures differ (random k), compare against a plain copy
+        assert hash_transaction(stx, HASH_TX_ID) == \
+            hash_transaction(dict(stx), HASH_TX_ID)
+
+        # Re-signing after a change in sequence
+        stx['Sequence'] = tx['Sequence'] = 2
+        sign_transaction(tx, 'ssq55ueDob4yV3kPVnNQLHB6icwpC')
+        sign_transaction(stx, 'ssq55ueDob4yV3kPVnNQLHB6icwpC')
+        assert create_signing_hash(stx) == create_signing_hash(tx)
+        assert stx.to_bytes() == serialize_object(dict(stx), hex=False)
+
+    def test_signing_hash_and_id(self):
+        tx = {"TransactionType": "Payment",
+              "Account": "r3P9vH81KBayazSTrQj6S25jW6kDb779Gi",
+              "Destination": "r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV",
+              "Amount": "200000000", "Fee": "10", "Sequence": 1}
+        sign_transaction(tx, 'ssq55ueDob4yV3kPVnNQLHB6icwpC')
+        expected = (create_signing_hash(tx), hash_transaction(tx, HASH_TX_ID))
+        assert signing_hash_and_id(tx) == expected
+        assert signing_hash_and_id(SerializedTransaction(tx)) == expected
 
     def test_der_encoding(self):
         # This simply verifies that the DER encoder from the ECDSA lib
@@ -272,3 +856,9 @@ class Test:
         key = root_key_from_seed(parse_seed('ssq55ueDob4yV3kPVnNQLHB6icwpC'))
         assert hexlify(ecdsa_sign(key, 'FF00EECC', k=3)) == \
             b'3045022100f9308a019258c31049344f85f89d5229b531c845836f99b08601f113bce036f902205f6d58be6182b9a1e04fcec36f75668deafad2e4336b48770ee5c559d3518301'
+
+        # Same as what python-ecdsa computes without the tables.
+        for k in (12345, curves.SECP256k1.order - 2, 2**200 + 77):
+            r, s = key.sign_number(int('FF00EECC', 16), k=k)
+            assert ecdsa_sign(key, 'FF00EECC', k=k) == \
+                sigencode_der(*ecdsa_make_canonical(r, s) + (None,))
@@ -2,7 +2,7 @@
 from __future__ import print_function
 import json
 import sys
-from ripple import sign_transaction
+from ripple import Signer
 from ripple.sign import create_signing_hash
 from ripple.serialize import serialize_object
 
@@ -14,9 +14,9 @@ def main(argv):
         print('Example: rsign.py ssq55ueDob4yV3kPVnNQLHB6icwpC \'{"TransactionType":"Payment","Account":"r3P9vH81KBayazSTrQj6S25jW6kDb779Gi","Destination":"r3kmLJN5D28dHuH8vZNUZpMC43pEHpaocV","Amount":"200000000","Fee":"10","Sequence":1}\'')
         return 1
 
-    secret = argv[1]
+    signer = Signer(argv[1])
     tx = json.loads(argv[2])
-    signed_tx = sign_transaction(tx.copy(), secret)
+    signed_tx = signer.sign(tx.copy())
 
     # For compatibility with rsign.js, comparing the output is
     # otherwise quite confusing.
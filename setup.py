@@ -20,8 +20,13 @@ setup(
     url="https://github.com/miracle2k/ripple-python",
     license='BSD',
     packages=find_packages(),
+    package_data={'ripple': ['definitions.json']},
     zip_safe=True,
     install_requires=install_requires,
+    extras_require={
+        'native': ['coincurve', 'PyNaCl'],
+        'asyncio': ['websockets'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Programming Language :: Python :: 3.3',
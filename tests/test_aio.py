@@ -0,0 +1,6 @@
+import sys
+
+# ripple.aio needs async/await (and asyncio.run()), which older Pythons
+# cannot even parse; see the "asyncio" environment in tox.ini.
+if sys.version_info >= (3, 7):
+    from ripple.aio import Test as TestAsync
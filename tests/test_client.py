@@ -0,0 +1 @@
+from ripple.client import Test as TestClient
@@ -0,0 +1 @@
+from ripple.crypto import Test as TestCrypto
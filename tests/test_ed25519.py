@@ -0,0 +1 @@
+from ripple.ed25519 import Test as TestEd25519
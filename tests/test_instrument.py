@@ -0,0 +1 @@
+from ripple.instrument import Test as TestInstrument
@@ -0,0 +1 @@
+from ripple.presign import Test as TestPresignedPool
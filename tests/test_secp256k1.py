@@ -0,0 +1 @@
+from ripple.secp256k1 import Test as TestSecp256k1
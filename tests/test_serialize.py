@@ -1 +1,23 @@
 from ripple.serialize import Test as TestSerializing
+
+
+import glob
+from os import path
+from ripple.serialize import serialize_object, deserialize_object
+from .test_transaction_parsing import open_transaction
+
+
+def test_corpus_roundtrip():
+    """The transactions and metadata we have on file survive a trip
+    through the binary format unchanged.
+    """
+    for filename in glob.glob(path.join(path.dirname(__file__), 'transactions', '*.json')):
+        data = open_transaction(filename)
+        meta = data.get('metaData') or data.get('meta') or data.get('metadata')
+        data = data.get('transaction', data)
+        tx = {k: v for k, v in data.items() if k[0].isupper() and k != 'metaData'}
+
+        for obj in (tx, meta):
+            blob = serialize_object(obj, hex=False)
+            decoded = deserialize_object(blob)
+            assert serialize_object(decoded, hex=False) == blob
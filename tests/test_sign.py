@@ -1 +1,33 @@
+import glob
+from os import path
 from ripple.sign import Test as TestSigning
+from ripple.sign import verify_transaction, verify_many
+from .test_transaction_parsing import open_transaction
+
+
+def corpus_transactions():
+    """The signed transactions we have on file."""
+    result = []
+    for filename in sorted(glob.glob(path.join(path.dirname(__file__), 'transactions', '*.json'))):
+        data = open_transaction(filename)
+        data = data.get('transaction', data)
+        if 'TxnSignature' in data:
+            tx = {k: v for k, v in data.items() if k[0].isupper() and k != 'metaData'}
+            result.append((path.basename(filename), tx))
+    return result
+
+
+def test_verify_corpus():
+    """Transactions signed by the network serve as test vectors."""
+    transactions = corpus_transactions()
+    assert transactions
+    for filename, tx in transactions:
+        assert verify_transaction(tx), filename
+
+        tx = dict(tx, Fee=str(int(tx['Fee']) + 1))
+        assert not verify_transaction(tx), filename
+
+
+def test_verify_many_corpus():
+    transactions = [tx for _, tx in corpus_transactions()]
+    assert all(verify_many(transactions, workers=2, chunksize=2))
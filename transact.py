@@ -7,7 +7,7 @@ import argparse
 from pygments import highlight, lexers, formatters
 
 from ripple.client import Remote, ResponseError
-from ripple.sign import get_ripple_from_secret
+from ripple.sign import Signer
 
 
 LOCAL_SIGNING = int(os.environ.get('LOCAL_SIGNING', 1))
@@ -54,10 +54,16 @@ class Command(object):
     def add_args(cls, parser):
         pass
 
+    @property
+    def signer(self):
+        if not hasattr(self, '_signer'):
+            self._signer = Signer(self.secret)
+        return self._signer
+
     @property
     def remote(self):
         if not hasattr(self, '_remote'):
-            self._remote = Remote(self.ripple_uri, self.secret)
+            self._remote = Remote(self.ripple_uri, self.signer)
         return self._remote
 
     def handle(self, result):
@@ -77,7 +83,7 @@ class Command(object):
 
     @property
     def account(self):
-        return get_ripple_from_secret(self.secret)
+        return self.signer.account
 
 
 class GetAddress(Command):
@@ -85,7 +91,7 @@ class GetAddress(Command):
     """
     name = 'get-address'
     def run(self, ns):
-        print(get_ripple_from_secret(self.secret))
+        print(self.signer.account)
 
 
 class RawCommand(Command):